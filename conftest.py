@@ -0,0 +1 @@
+"""Radice dei test: i moduli ``voi_*`` sono importati dalla cartella del progetto."""
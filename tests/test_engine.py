@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from voi_bench import genera_periodi
+from voi_engine import COLONNE_VARIAZIONI, IndicePeriodi
+
+SABATO = 5
+
+
+def variazioni(*righe):
+    return pd.DataFrame(list(righe), columns=COLONNE_VARIAZIONI)
+
+
+def sabato_web(indice, periodo=0):
+    fattore, valore = indice.tensori(["ADR bed WEB"])
+    return fattore[periodo, SABATO, 0], valore[periodo, SABATO, 0]
+
+
+def test_a_parita_di_specificita_vale_la_prima_riga():
+    per = genera_periodi(4)
+    dieci = ("", "", "Sab", "ADR bed WEB", 10.0, np.nan)
+    venti = ("", "", "Ven,Sab", "ADR bed WEB", 20.0, np.nan)
+    for righe, atteso in (((dieci, venti), 1.10), ((venti, dieci), 1.20)):
+        fattore, valore = sabato_web(IndicePeriodi(per, variazioni=variazioni(*righe)))
+        assert fattore == pytest.approx(atteso)
+        assert np.isnan(valore)
+
+
+def test_vale_la_riga_piu_specifica_in_qualunque_ordine():
+    per = genera_periodi(4)
+    p = per["Periodo"].iloc[0]
+    righe = [("", p, "Sab", "ADR bed WEB", np.nan, 180.0),       # periodo
+             ("2026", "", "Sab", "ADR bed WEB", 5.0, np.nan),      # stagione
+             ("2026", p, "Sab", "ADR bed WEB", 15.0, np.nan)]      # stagione + periodo
+    for ordine in (righe, righe[::-1]):
+        indice = IndicePeriodi(per, variazioni=variazioni(*ordine))
+        fattore, valore = sabato_web(indice)
+        assert fattore == pytest.approx(1.15) and np.isnan(valore)
+        assert sabato_web(indice, 1)[0] == pytest.approx(1.05)         # solo la stagione
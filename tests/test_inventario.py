@@ -0,0 +1,70 @@
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from voi_engine import notti_soggiorno
+from voi_inventario import RegistroInventario
+
+CHECK_IN, CHECK_OUT = date(2026, 7, 10), date(2026, 7, 14)
+
+
+@pytest.fixture
+def registro(tmp_path):
+    reg = RegistroInventario(tmp_path)
+    reg.imposta_notti(pd.DataFrame({"Notte": pd.date_range("2026-07-01", "2026-07-31"),
+                                    "Capacità": 50, "Allotment ALPI": 10,
+                                    "Venduto ALPI": 2, "Venduto casa": 0}))
+    return reg
+
+
+def test_blocchi_concorrenti_non_superano_la_capacita(registro, tmp_path):
+    n = 8
+    partenza = threading.Barrier(n)
+    esiti = [None] * n
+
+    def analista(i):
+        reg = RegistroInventario(tmp_path)      # come un'altra sessione sullo stesso file
+        partenza.wait()
+        try:
+            esiti[i] = reg.blocca(f"Gruppo {i}", CHECK_IN, CHECK_OUT, 20, "v2")
+        except ValueError as e:
+            esiti[i] = e
+
+    fili = [threading.Thread(target=analista, args=(i,)) for i in range(n)]
+    for f in fili:
+        f.start()
+    for f in fili:
+        f.join()
+
+    riusciti = [e for e in esiti if isinstance(e, int)]
+    assert len(riusciti) == 2
+    assert all("Capacità superata" in str(e) for e in esiti if not isinstance(e, int))
+    d = registro.soggiorno(CHECK_IN, CHECK_OUT)
+    assert (d.gruppi_allot + d.gruppi_casa == 40).all()
+    assert (d.gruppi_allot == 8).all()          # il primo prende il residuo, il secondo no
+    assert (d.libere == 50 - 2 - 40).all()
+
+
+def test_rilascia_libera_le_notti(registro):
+    blocco = registro.blocca("Gruppo", CHECK_IN, CHECK_OUT, 20, "v1")
+    assert registro.rilascia(blocco) == 4
+    assert (registro.soggiorno(CHECK_IN, CHECK_OUT).residuo_allot == 8).all()
+
+
+def test_soggiorni_zero_notti_e_fuori_libro(registro):
+    registro.blocca("Gruppo", date(2026, 7, 12), date(2026, 7, 13), 5, "v2")
+    inizio = notti_soggiorno(date(2026, 7, 10), date(2026, 7, 11))[0] + np.array([0, 0, 25, -20])
+    out = registro.soggiorni(inizio, [4, 0, 3, 2])
+    # 10–14/07 con la notte del 12 impegnata; 0 notti; 4–7/08 e 20–22/06 fuori dal libro
+    assert out["residuo"][0] == 3
+    assert out["occupazione"][0] == pytest.approx(100 * (2 * 4 + 5) / (50 * 4))
+    assert np.isnan(out["residuo"][1:]).all()
+    assert np.isnan(out["occupazione"][1:]).all()
+
+
+def test_soggiorni_senza_righe(registro):
+    out = registro.soggiorni([], [])
+    assert len(out["residuo"]) == 0 and len(out["occupazione"]) == 0
@@ -0,0 +1,107 @@
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from voi_bench import genera_periodi, genera_richieste
+from voi_engine import IndicePeriodi
+from voi_portafoglio import (ACCETTA, CONTROPROPOSTA, RIFIUTA, _esatto, _euristico, _Problema,
+                             ottimizza_portafoglio)
+
+SOGLIE = {"low": 0.70, "mid": 0.85, "high": 0.95, "auth": 35000}
+
+
+def problema(g=10, n=12, seme=0):
+    """Istanza casuale con gruppi sovrapposti, capacità che vincola e controproposte
+    non sempre disponibili."""
+    rng = np.random.default_rng(seme)
+    inizio = rng.integers(0, n - 2, g)
+    durata = rng.integers(2, 6, g)
+    occupa = np.zeros((g, n), dtype=bool)
+    for i in range(g):
+        occupa[i, inizio[i]:inizio[i] + durata[i]] = True
+    camere = rng.integers(5, 40, g).astype(float)
+    letti = camere * rng.uniform(1.8, 3.0, g)
+    nv = occupa.sum(axis=1)
+    ricavi = np.full((g, 3), np.nan)
+    ricavi[:, RIFIUTA] = 0.0
+    ricavi[:, ACCETTA] = letti * nv * rng.uniform(50, 110, g)
+    rilancio = rng.random(g) < 0.7
+    ricavi[rilancio, CONTROPROPOSTA] = (ricavi[:, ACCETTA] * rng.uniform(0.8, 1.3, g))[rilancio]
+    allot = rng.integers(0, 30, n).astype(float)
+    return _Problema(occupa=occupa, camere=camere, letti=letti, ricavi=ricavi, allot=allot,
+                     capacita=allot + rng.integers(10, 40, n), atteso_allot=rng.uniform(20, 60, n),
+                     atteso_web=rng.uniform(40, 100, n))
+
+
+def forza_bruta(p):
+    migliore = -np.inf
+    for s in itertools.product((RIFIUTA, ACCETTA, CONTROPROPOSTA), repeat=len(p.camere)):
+        s = np.array(s)
+        if np.isnan(p.ricavi[np.arange(len(s)), s]).any():
+            continue
+        if (p.carichi(s)[0] > p.capacita).any():
+            continue
+        migliore = max(migliore, p.valore(s))
+    return migliore
+
+
+def fattibile(p, scelte):
+    ok = ~np.isnan(p.ricavi[np.arange(len(scelte)), scelte])
+    return bool(ok.all() and (p.carichi(scelte)[0] <= p.capacita).all())
+
+
+@pytest.mark.parametrize("seme", [0, 1, 2])
+def test_branch_and_bound_coincide_con_forza_bruta(seme):
+    p = problema(seme=seme)
+    ottimo = forza_bruta(p)
+    scadenza = time.perf_counter() + 60
+    euristica, _ = _euristico(p, scadenza)
+    # anche partendo da «tutti rifiutati» il B&B deve trovare l'ottimo da solo
+    for partenza in (euristica, np.zeros(len(p.camere), dtype=np.int64)):
+        scelte, completo, _ = _esatto(p, scadenza, partenza)
+        assert completo
+        assert fattibile(p, scelte)
+        assert p.valore(scelte) == pytest.approx(ottimo, abs=1e-6)
+    assert fattibile(p, euristica)
+    assert p.valore(euristica) <= ottimo + 1e-6
+
+
+def test_branch_and_bound_scaduto_ritorna_la_partenza():
+    p = problema(g=24, n=30, seme=3)
+    partenza = np.zeros(len(p.camere), dtype=np.int64)
+    scelte, completo, nodi = _esatto(p, time.perf_counter() - 1, partenza)
+    assert not completo
+    assert nodi == 512
+    assert fattibile(p, scelte)
+
+
+def test_tempo_max_rispettato_e_portafoglio_fattibile():
+    indice = IndicePeriodi(genera_periodi(12))
+    rfp = genera_richieste(80, seme=4)
+    t0 = time.perf_counter()
+    esito = ottimizza_portafoglio(indice, rfp, SOGLIE, camere_casa=20, tempo_max=0.5)
+    assert time.perf_counter() - t0 < 10
+    assert not esito.ottimo
+    assert esito.metodo.startswith("euristico")
+    notti = esito.notti
+    assert (notti["Camere gruppi"] <= notti["Capacità"]).all()
+
+
+def test_capacita_notte_per_notte():
+    indice = IndicePeriodi(genera_periodi(6))
+    rfp = genera_richieste(12, seme=5)
+    rfp["Check-in"] = pd.Timestamp("2026-07-01") + pd.to_timedelta(np.arange(12) % 4, unit="D")
+    rfp["Check-out"] = rfp["Check-in"] + pd.Timedelta(days=5)
+    rfp["ADR bed"] = 200.0           # tutte convenienti: vince chi sta nei limiti
+    esito = ottimizza_portafoglio(indice, rfp, SOGLIE, camere_casa=15, allotment=25,
+                                  tempo_max=30)
+    assert esito.ottimo
+    notti = esito.notti
+    assert (notti["Capacità"] == 40).all()
+    assert (notti["Camere gruppi"] <= 40).all()
+    assert (notti["Camere gruppi"] > 0).any()
+    assert (esito.richieste["Scelta portafoglio"] == "Rifiutare").any()
+    assert (notti["Entro allotment"] <= 25).all()
@@ -0,0 +1,32 @@
+from datetime import date
+
+import pytest
+
+from voi_bench import genera_periodi
+from voi_engine import IndicePeriodi, RichiestaGruppo, analizza_soggiorno, valuta
+from voi_rischio import simula_displacement
+
+SOGLIE = {"low": 0.70, "mid": 0.85, "high": 0.95, "auth": 35000}
+
+
+@pytest.mark.parametrize("occupancy", [None, 95, 30])
+def test_media_monte_carlo_coincide_con_valuta(occupancy):
+    # senza storico le Beta sono centrate sui valori di periodo: la media degli
+    # scenari deve ritrovare il displacement deterministico, anche con l'override
+    indice = IndicePeriodi(genera_periodi(12))
+    r = RichiestaGruppo(date(2026, 5, 3), date(2026, 5, 10), 40, tariffa=150,
+                        occupancy=occupancy)
+    atteso = valuta(indice, r, SOGLIE).displacement
+    sog = analizza_soggiorno(indice, r.check_in, r.check_out)
+    mc = simula_displacement(r, sog, SOGLIE, scenari=100_000)
+    assert mc.media == pytest.approx(atteso, rel=1e-3)
+    assert mc.p5 <= mc.p50 <= mc.p95
+
+
+def test_stesso_seme_stessi_scenari():
+    indice = IndicePeriodi(genera_periodi(12))
+    r = RichiestaGruppo(date(2026, 7, 1), date(2026, 7, 8), 25, tariffa=110, allot_residuo=10)
+    sog = analizza_soggiorno(indice, r.check_in, r.check_out)
+    a = simula_displacement(r, sog, SOGLIE, scenari=5_000, seme=7)
+    b = simula_displacement(r, sog, SOGLIE, scenari=5_000, seme=7)
+    assert (a.campioni == b.campioni).all()
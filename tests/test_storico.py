@@ -0,0 +1,42 @@
+import io
+
+import pandas as pd
+
+from voi_bench import genera_scrigno
+from voi_export import to_excel_bytes
+from voi_storico import leggi_file_storico, valida_storico
+
+
+def export(df):
+    return leggi_file_storico(io.BytesIO(to_excel_bytes({"Scrigno": df})))[0]
+
+
+def conteggi(esito):
+    return esito.report.set_index("Regola")["Totale"]
+
+
+def test_data_illeggibile_segnalata_e_scartata():
+    df = genera_scrigno(2025, anomalie=0)
+    totali = df.index[df["Segmento"] == "Total"]
+    df.loc[totali[150], "Giorno"] = "Ven 3x/05/2025"      # in stagione, data rovinata
+    df.loc[totali[10], "Giorno"] = ""                     # riga vuota: non è un giorno
+    daily = export(df)
+    esito = valida_storico({"a.xlsx": daily})
+    assert conteggi(esito)["DATA_NON_VALIDA"] == 1
+    assert esito.scartate["Regole"].tolist() == ["DATA_NON_VALIDA"]
+    assert esito.pulito["dt"].notna().all()
+    assert len(esito.pulito) == len(daily) - 1
+
+
+def test_duplicati_nello_stesso_file_e_fra_file():
+    df = genera_scrigno(2025, anomalie=0)
+    totale = df[df["Segmento"] == "Total"]
+    luglio = totale[totale["Giorno"].str.endswith("/07/2025")]
+    a = export(pd.concat([df, luglio.iloc[:3]], ignore_index=True))     # 3 giorni ripetuti
+    b = export(luglio.iloc[:5])                                         # 5 giorni rifatti dopo
+    esito = valida_storico({"a.xlsx": a, "b.xlsx": b})
+    report = esito.report.set_index("Regola")
+    assert report.loc["DUPLICATO", "a.xlsx"] == 3 + 5
+    assert report.loc["DUPLICATO", "b.xlsx"] == 0
+    assert esito.pulito["dt"].is_unique
+    assert len(esito.pulito) == len(a) + len(b) - 8 == 214        # aprile–ottobre
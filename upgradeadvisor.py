@@ -6,17 +6,32 @@ Metrica primaria: ADR bed  ·  displacement a due livelli (allotment / WEB)
 ==================================================================
 """
 
-import io
-import math
-from datetime import date, timedelta
+from datetime import date
 
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 
+from voi_app import aggiorna_da_sorgente, bottone_export, salva_valutazione
+from voi_engine import (GIORNI_SETTIMANA, TUTTE_LE_TARIFFE, VERDETTI, IndicePeriodi,
+                        RichiestaGruppo, analizza_soggiorno, eur, eur2, griglia_sensibilita,
+                        impronta_periodi, leggi_periodi, normalizza_richieste, notti_soggiorno,
+                        periodi_default, valuta_batch, valuta_richiesta, variazioni_vuote)
+from voi_export import esporta, formati
+from voi_inventario import COLONNE_NOTTI, INVENTARIO
+from voi_perf import PERF
+from voi_portafoglio import ottimizza_portafoglio
+from voi_registro import REGISTRO
+from voi_rischio import modello_domanda, simula_displacement
+from voi_sorgenti import SORGENTE
+from voi_storico import (ARCHIVIO, SETS, AggregatoreStorico, RegoleQualita, calendario_domanda,
+                         indovina_set, leggi_storici, valida_storico)
+
 # ------------------------------------------------------------------
 # CONFIG / STILE
 # ------------------------------------------------------------------
+PERF.inizia_run()
 st.set_page_config(page_title="VOI Group Toolkit", page_icon="🏖️", layout="wide")
 
 PRIM, ACCENT = "#0F4C5C", "#E8833A"
@@ -24,8 +39,6 @@ VERDE, GIALLO, ROSSO, SAND = "#2E7D32", "#E0911A", "#C62828", "#F6F2EA"
 COLOR = {"verde": VERDE, "giallo": GIALLO, "rosso": ROSSO}
 ICON = {"verde": "✅", "giallo": "⚠️", "rosso": "⛔"}
 
-SETS = ["Totale", "Individuali (no Alpitour)", "Alpitour individuali"]
-
 st.markdown(f"""
 <style>
   .main .block-container {{ padding-top: 1.3rem; max-width: 1260px; }}
@@ -50,124 +63,51 @@ st.markdown(f"""
 # ------------------------------------------------------------------
 # HELPERS
 # ------------------------------------------------------------------
-def eur(x):
-    try:
-        return f"{x:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
-    except Exception:
-        return "—"
-
-
-def eur2(x):
-    try:
-        return f"{x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
-    except Exception:
-        return "—"
-
-
-def to_excel_bytes(dfs: dict):
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        for sheet, d in dfs.items():
-            d.to_excel(w, sheet_name=sheet[:31], index=False)
-    return buf.getvalue()
-
-
-def periodi_default():
-    rows = [
-        ("Apertura / Bassa", date(2026, 5, 23), date(2026, 6, 6),  3,  64,  52, 200, 35, 10),
-        ("Bassa Giugno",     date(2026, 6, 7),  date(2026, 6, 27), 3,  86,  67, 200, 82, 47),
-        ("Media Luglio",     date(2026, 6, 28), date(2026, 8, 1),  7, 105,  86, 200, 93, 78),
-        ("Alta Agosto",      date(2026, 8, 2),  date(2026, 8, 22), 7, 150, 113, 200, 93, 80),
-        ("Spalla Settembre", date(2026, 8, 23), date(2026, 9, 12), 5,  95,  78, 200, 75, 45),
-        ("Chiusura",         date(2026, 9, 13), date(2026, 9, 27), 3,  70,  66, 200, 64, 42),
-    ]
-    cols = ["Periodo", "Data inizio", "Data fine", "Min stay",
-            "ADR bed WEB", "ADR bed Alpitour", "Allotment ALPI",
-            "Occupancy attesa %", "Utilizzo allotment %"]
-    df = pd.DataFrame(rows, columns=cols)
-    df["Data inizio"] = pd.to_datetime(df["Data inizio"])
-    df["Data fine"] = pd.to_datetime(df["Data fine"])
-    return df
-
-
-def match_periodo(periodi, giorno):
-    g = pd.Timestamp(giorno)
-    for _, r in periodi.iterrows():
-        di, dfi = r["Data inizio"], r["Data fine"]
-        if pd.notna(di) and pd.notna(dfi) and pd.Timestamp(di) <= g <= pd.Timestamp(dfi):
-            return r
-    return None
-
-
-def analizza_soggiorno(periodi, check_in, check_out):
-    """Assegna ogni notte al periodo. Ritorna notti, segmenti pesati, notti orfane."""
-    notti = (check_out - check_in).days
-    seg, nomatch = {}, 0
-    for n in range(notti):
-        r = match_periodo(periodi, check_in + timedelta(days=n))
-        if r is None:
-            nomatch += 1
-            continue
-        nome = r["Periodo"]
-        if nome not in seg:
-            seg[nome] = {"notti": 0,
-                         "web": float(r["ADR bed WEB"]),
-                         "alpi": float(r["ADR bed Alpitour"]),
-                         "allot": int(r["Allotment ALPI"]),
-                         "occ": float(r["Occupancy attesa %"]),
-                         "util": float(r["Utilizzo allotment %"]),
-                         "min": int(r["Min stay"])}
-        seg[nome]["notti"] += 1
-    return notti, seg, nomatch
-
-
-# --- storico ---
-def leggi_file_storico(file):
-    df = pd.read_excel(file, 0)
-    seg_block = set(df["Segmento"].dropna().unique()) if "Segmento" in df.columns else set()
-    df["dt"] = pd.to_datetime(df["Giorno"].astype(str).str.split(" ").str[-1],
-                              format="%d/%m/%Y", errors="coerce")
-    if "Segmento" in df.columns:
-        daily = df[df["Segmento"] == "Total"].dropna(subset=["dt"]).copy()
-    else:
-        daily = df.dropna(subset=["dt"]).copy()
-    daily = daily[(daily["dt"].dt.month >= 4) & (daily["dt"].dt.month <= 10)]
-    anno = int(daily["dt"].dt.year.mode().iloc[0]) if len(daily) else None
-    return daily, anno, seg_block
-
-
-def indovina_set(seg_block):
-    s = {str(x).upper() for x in seg_block}
-    if any("GRUPPI" in x for x in s):
-        return "Totale"
-    if any("ALPITOUR INDIVIDUALI" in x for x in s) and not any("DIRETTI" in x for x in s):
-        return "Alpitour individuali"
-    if any("DIRETTI" in x for x in s) or any("WEB PORTALI" in x for x in s):
-        return "Individuali (no Alpitour)"
-    return "Totale"
-
-
-def pulisci_storico(df):
-    n0 = len(df)
-    df = df[df["ADR Bed"].between(25, 260)]
-    df = df[df["% Occ."].between(0, 1.05)]
-    return df, n0 - len(df)
-
-
-def righe_periodo(df, di, dfine):
-    """Righe storiche che cadono nello stesso intervallo mese/giorno, per ogni anno."""
-    if df is None or df.empty:
-        return df
-    mask = pd.Series(False, index=df.index)
-    for anno in sorted(df["dt"].dt.year.unique()):
-        try:
-            s = pd.Timestamp(year=anno, month=di.month, day=di.day)
-            e = pd.Timestamp(year=anno, month=dfine.month, day=dfine.day)
-        except ValueError:
-            continue
-        if e >= s:
-            mask |= df["dt"].between(s, e)
-    return df[mask]
+def grafico(fig):
+    with PERF.fase("grafici Plotly"):
+        st.plotly_chart(fig, use_container_width=True)
+
+
+def indice_periodi():
+    """Indice compilato dei periodi del Setup (con le variazioni per giorno della
+    settimana), ricostruito solo quando cambiano."""
+    per, var = st.session_state.periodi, st.session_state.variazioni
+    imp = impronta_periodi(per, var)
+    idx = st.session_state.get("indice_periodi")
+    if idx is None or idx.impronta != imp:
+        with PERF.fase("indice periodi"):
+            idx = st.session_state.indice_periodi = IndicePeriodi(per, imp, var)
+    return idx
+
+
+def calendario():
+    """Calendario domanda notte per notte dallo storico, se attivo; ricalcolato solo
+    quando cambiano i periodi o lo storico caricato."""
+    storico = st.session_state.storico
+    if not storico or not st.session_state.get("usa_calendario", True):
+        return None
+    chiave = (impronta_periodi(st.session_state.periodi), id(storico))
+    cal = st.session_state.get("calendario")
+    if cal is None or cal[0] != chiave:
+        with PERF.fase("calendario domanda"):
+            cal = st.session_state.calendario = (chiave, calendario_domanda(
+                storico, st.session_state.periodi))
+    return cal[1]
+
+
+def modello_rischio():
+    """Modello di domanda per anno dello storico (Monte Carlo), con la stessa
+    chiave di ricalcolo del calendario; None senza storico."""
+    storico = st.session_state.storico
+    if not storico:
+        return None
+    chiave = (impronta_periodi(st.session_state.periodi), id(storico))
+    mod = st.session_state.get("modello_rischio")
+    if mod is None or mod[0] != chiave:
+        with PERF.fase("modello rischio"):
+            mod = st.session_state.modello_rischio = (chiave, modello_domanda(
+                storico, st.session_state.periodi))
+    return mod[1]
 
 
 # ------------------------------------------------------------------
@@ -175,14 +115,18 @@ def righe_periodo(df, di, dfine):
 # ------------------------------------------------------------------
 if "periodi" not in st.session_state:
     st.session_state.periodi = periodi_default()
-if "valutazioni" not in st.session_state:
-    st.session_state.valutazioni = []
+if "variazioni" not in st.session_state:
+    st.session_state.variazioni = variazioni_vuote()
 if "soglie" not in st.session_state:
     st.session_state.soglie = {"low": 0.70, "mid": 0.85, "high": 0.95, "auth": 35000}
 if "storico" not in st.session_state:
-    st.session_state.storico = {}        # set -> DataFrame concatenato pulito
+    # set -> DataFrame concatenato pulito, dall'archivio su disco se presente
+    st.session_state.storico = ARCHIVIO.carica() if ARCHIVIO.disponibile() else {}
 if "storico_info" not in st.session_state:
     st.session_state.storico_info = ""
+if "aggregatore" not in st.session_state:
+    # aggregati per finestra e valori scritti dallo storico (override manuali)
+    st.session_state.aggregatore = AggregatoreStorico()
 
 # ------------------------------------------------------------------
 # HEADER + SIDEBAR
@@ -194,8 +138,8 @@ st.markdown(f"""
 </div>""", unsafe_allow_html=True)
 
 pagina = st.sidebar.radio("Sezione",
-                          ["🧮 Valutazione gruppo", "📂 Dati storici",
-                           "⚙️ Setup periodi", "📋 Riepilogo"],
+                          ["🧮 Valutazione gruppo", "📑 Valutazione batch", "📂 Dati storici",
+                           "⚙️ Setup periodi", "📦 Inventario", "📋 Riepilogo"],
                           label_visibility="collapsed")
 st.sidebar.divider()
 st.sidebar.caption("Soglie ADR bed (% della tariffa WEB del periodo)")
@@ -207,428 +151,818 @@ s["auth"] = st.sidebar.number_input("Soglia autorizzazione direzione (€)",
                                     0, 1_000_000, int(s["auth"]), 5000)
 if st.session_state.storico:
     st.sidebar.success(f"Storico caricato: {', '.join(st.session_state.storico.keys())}")
-
-
-# ==================================================================
-# PAGINA — DATI STORICI
-# ==================================================================
-if pagina == "📂 Dati storici":
-    st.subheader("📂 Caricamento dati storici")
-    st.caption("Carica gli export Scrigno dei tre set (consuntivi stagionali). "
-               "Il toolkit ne ricava le tariffe WEB e Alpitour, l'occupancy e "
-               "l'utilizzo dell'allotment per ciascun periodo del Setup.")
-
-    files = st.file_uploader("Trascina qui i file .xlsx (anche tutti insieme)",
-                             type=["xlsx"], accept_multiple_files=True)
-
-    if files:
-        meta = []
-        cache = {}
-        for f in files:
-            daily, anno, block = leggi_file_storico(f)
-            cache[f.name] = daily
-            rng = (f"{daily['dt'].min().date()} → {daily['dt'].max().date()}"
-                   if len(daily) else "—")
-            meta.append({"File": f.name, "Anno": anno or 0,
-                         "Periodo dati": rng, "Set": indovina_set(block)})
-        meta_df = pd.DataFrame(meta)
-
-        st.markdown("##### Assegna ogni file al suo set")
-        st.caption("Il set è stato indovinato dai segmenti presenti; correggilo se serve.")
-        edited = st.data_editor(
-            meta_df, hide_index=True, use_container_width=True,
-            disabled=["File", "Anno", "Periodo dati"],
-            column_config={"Set": st.column_config.SelectboxColumn("Set", options=SETS)})
-
-        if st.button("⚙️ Elabora e applica al Setup periodi", type="primary",
-                     use_container_width=True):
-            storico, glitch_tot = {}, 0
-            for set_name in SETS:
-                fs = edited[edited["Set"] == set_name]["File"].tolist()
-                if not fs:
-                    continue
-                merged = pd.concat([cache[fn] for fn in fs], ignore_index=True)
-                merged, glitch = pulisci_storico(merged)
-                glitch_tot += glitch
-                storico[set_name] = merged
-            st.session_state.storico = storico
-
-            # --- aggrega per periodo ---
-            per = st.session_state.periodi.copy()
-            tot = storico.get("Totale")
-            ind = storico.get("Individuali (no Alpitour)")
-            alp = storico.get("Alpitour individuali")
-            applicati = 0
-            for idx, r in per.iterrows():
-                di, dfi = r["Data inizio"], r["Data fine"]
-                if pd.isna(di) or pd.isna(dfi):
+    st.sidebar.checkbox("Domanda notte per notte da storico", True, key="usa_calendario",
+                        help="Occupancy e utilizzo allotment di ogni notte dal profilo "
+                             "storico (±3 giorni) invece della media del periodo; le tariffe "
+                             "restano quelle del Setup.")
+st.sidebar.divider()
+mostra_perf = st.sidebar.toggle("⏱ Performance", key="mostra_perf",
+                                help="Tempi per fase dell'ultimo rerun e percentili del processo.")
+pannello_perf = st.sidebar.container()
+
+
+try:
+    # ==================================================================
+    # PAGINA — DATI STORICI
+    # ==================================================================
+    if pagina == "📂 Dati storici":
+        st.subheader("📂 Caricamento dati storici")
+        st.caption("Carica gli export Scrigno dei tre set (consuntivi stagionali). "
+                   "Il toolkit ne ricava le tariffe WEB e Alpitour, l'occupancy e "
+                   "l'utilizzo dell'allotment per ciascun periodo del Setup.")
+
+        files = st.file_uploader("Trascina qui i file .xlsx (anche tutti insieme)",
+                                 type=["xlsx"], accept_multiple_files=True)
+
+        if files:
+            barra = st.progress(0.0, "Lettura file…")
+            with PERF.fase("lettura Excel"):
+                letti, errori = leggi_storici(
+                    {f.name: f.getvalue() for f in files},
+                    lambda fatti, totale, nome: barra.progress(fatti / totale,
+                                                               f"Letto {nome} ({fatti}/{totale})"))
+            barra.empty()
+            for nome, errore in errori.items():
+                st.warning(f"⚠️ {nome} non leggibile, escluso: {errore}")
+            if not letti:
+                st.stop()
+            meta = []
+            cache = {}
+            for f in files:
+                if f.name not in letti:
                     continue
-                di, dfi = di.date(), dfi.date()
-                if tot is not None:
-                    rp = righe_periodo(tot, di, dfi)
-                    if rp is not None and len(rp):
-                        per.at[idx, "Occupancy attesa %"] = round(rp["% Occ."].mean() * 100, 1)
-                if ind is not None:
-                    rp = righe_periodo(ind, di, dfi)
-                    if rp is not None and len(rp):
-                        per.at[idx, "ADR bed WEB"] = round(rp["ADR Bed"].median(), 1)
-                if alp is not None:
-                    rp = righe_periodo(alp, di, dfi)
-                    if rp is not None and len(rp):
-                        per.at[idx, "ADR bed Alpitour"] = round(rp["ADR Bed"].median(), 1)
-                        allot = r["Allotment ALPI"] or 200
-                        per.at[idx, "Utilizzo allotment %"] = round(
-                            rp["Room nights"].mean() / allot * 100, 1)
-                applicati += 1
-            st.session_state.periodi = per
-            st.session_state.storico_info = (
-                f"{len(files)} file · set: {', '.join(storico.keys())} · "
-                f"{glitch_tot} righe anomale escluse")
-            st.success(f"✅ Storico elaborato e applicato a {applicati} periodi. "
-                       f"{glitch_tot} righe anomale (ADR bed fuori 25–260 €) escluse. "
-                       f"Vai su «Setup periodi» per verificare.")
-
-    if st.session_state.storico:
-        st.divider()
-        st.markdown("##### Quadro storico per set")
-        rows = []
-        for k, d in st.session_state.storico.items():
-            rows.append({"Set": k, "Righe-giorno": len(d),
-                         "Anni": ", ".join(map(str, sorted(d["dt"].dt.year.unique()))),
-                         "Occ. media": f"{d['% Occ.'].mean()*100:.1f}%",
-                         "ADR bed mediana": eur2(d["ADR Bed"].median())})
-        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
-
-
-# ==================================================================
-# PAGINA — SETUP PERIODI
-# ==================================================================
-elif pagina == "⚙️ Setup periodi":
-    st.subheader("⚙️ Setup periodi tariffari")
-    st.caption("Anagrafica periodi. Le tariffe sono **ADR bed per pax/notte**. "
-               "Se hai caricato lo storico, i valori sono pre-compilati dai consuntivi "
-               "(restano modificabili).")
-    if st.session_state.storico_info:
-        st.info(f"📂 Pre-compilato da storico — {st.session_state.storico_info}")
-
-    cfg = {
-        "Periodo": st.column_config.TextColumn("Periodo", width="medium"),
-        "Data inizio": st.column_config.DateColumn("Inizio", format="DD/MM/YYYY"),
-        "Data fine": st.column_config.DateColumn("Fine", format="DD/MM/YYYY"),
-        "Min stay": st.column_config.NumberColumn("MLOS", min_value=1, max_value=21, step=1),
-        "ADR bed WEB": st.column_config.NumberColumn("ADR bed WEB", format="%.1f €",
-                       help="Tariffa individuale dinamica (CRS / Vertical Booking / Blastness + OTA + diretto)."),
-        "ADR bed Alpitour": st.column_config.NumberColumn("ADR bed Alpitour", format="%.1f €",
-                            help="ADR bed degli individuali Alpitour in allotment."),
-        "Allotment ALPI": st.column_config.NumberColumn("Allotment ALPI", min_value=0, step=1),
-        "Occupancy attesa %": st.column_config.NumberColumn("Occ. attesa %", format="%.1f"),
-        "Utilizzo allotment %": st.column_config.NumberColumn("Utilizzo allot. %", format="%.1f",
-                                help="Quota dell'allotment tipicamente riempita dagli individuali Alpitour."),
-    }
-    edited = st.data_editor(st.session_state.periodi, column_config=cfg,
-                            num_rows="dynamic", use_container_width=True, hide_index=True)
-    st.session_state.periodi = edited
-
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        st.download_button("⬇️ Esporta periodi", to_excel_bytes({"Periodi": edited}),
-                           "voi_periodi.xlsx",
-                           "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                           use_container_width=True)
-    with c2:
-        up = st.file_uploader("⬆️ Importa periodi", type=["xlsx"], label_visibility="collapsed")
+                daily, anno, block = letti[f.name]
+                cache[f.name] = daily
+                rng = (f"{daily['dt'].min().date()} → {daily['dt'].max().date()}"
+                       if len(daily) else "—")
+                meta.append({"File": f.name, "Anno": anno or 0,
+                             "Periodo dati": rng, "Set": indovina_set(block)})
+            meta_df = pd.DataFrame(meta)
+
+            st.markdown("##### Assegna ogni file al suo set")
+            st.caption("Il set è stato indovinato dai segmenti presenti; correggilo se serve.")
+            edited = st.data_editor(
+                meta_df, hide_index=True, use_container_width=True,
+                disabled=["File", "Anno", "Periodo dati"],
+                column_config={"Set": st.column_config.SelectboxColumn("Set", options=SETS)})
+
+            with st.expander("🧪 Regole di qualità dati"):
+                q1, q2, q3 = st.columns(3)
+                regole = RegoleQualita(
+                    adr_min=q1.number_input("ADR bed minimo (€)", 0.0, 500.0, 25.0, 5.0),
+                    adr_max=q2.number_input("ADR bed massimo (€)", 0.0, 2000.0, 260.0, 10.0),
+                    occ_max=q3.number_input("Occupancy massima", 0.5, 2.0, 1.05, 0.01,
+                                            help="1 = 100%; la tolleranza copre overbooking e "
+                                                 "arrotondamenti dell'export."))
+                st.caption("Scartati anche i giorni senza data leggibile e i giorni ripetuti in "
+                           "più file dello stesso set (vale il file caricato per ultimo).")
+
+            if st.button("⚙️ Elabora e applica al Setup periodi", type="primary",
+                         use_container_width=True):
+                storico, glitch_tot, qualita = {}, 0, {}
+                for set_name in SETS:
+                    fs = edited[edited["Set"] == set_name]["File"].tolist()
+                    if not fs:
+                        continue
+                    with PERF.fase("qualità dati"):
+                        esito = valida_storico({fn: cache[fn] for fn in fs}, regole)
+                    glitch_tot += len(esito.scartate)
+                    qualita[set_name] = esito
+                    storico[set_name] = esito.pulito
+                st.session_state.qualita_storico = qualita
+                if ARCHIVIO.disponibile():
+                    with PERF.fase("archivio storico"):
+                        for set_name, d in storico.items():
+                            ARCHIVIO.salva(set_name, d)
+                        storico = ARCHIVIO.carica()
+                st.session_state.storico = storico
+
+                # --- aggrega per periodo ---
+                with PERF.fase("aggregazione"):
+                    per, applicati, mantenute = st.session_state.aggregatore.applica(
+                        st.session_state.periodi, storico)
+                st.session_state.periodi = per
+                st.session_state.storico_info = (
+                    f"{len(letti)} file · set: {', '.join(storico.keys())} · "
+                    f"{glitch_tot} righe anomale escluse")
+                st.success(f"✅ Storico elaborato e applicato a {applicati} periodi. "
+                           f"{glitch_tot} righe anomale escluse (dettaglio nel report qualità). "
+                           + (f"{mantenute} valori modificati a mano mantenuti. "
+                              if mantenute else "")
+                           + "Vai su «Setup periodi» per verificare.")
+
+            qualita = st.session_state.get("qualita_storico")
+            if qualita:
+                with st.expander("🧪 Report qualità dati (ultima elaborazione)"):
+                    for set_name, esito in qualita.items():
+                        st.markdown(f"**{set_name}** · {len(esito.pulito)} giorni validi · "
+                                    f"{len(esito.scartate)} scartati")
+                        st.dataframe(esito.report, hide_index=True, use_container_width=True)
+                        if not esito.mancanti.empty:
+                            m = esito.mancanti
+                            st.caption("Giorni aprile–ottobre senza dati validi: " + " · ".join(
+                                f"{a}: {n} (dal {d:%d/%m})" for a, n, d in
+                                zip(m["Anno"], m["Giorni mancanti"], m["Primo mancante"])))
+                    scartate = pd.concat([e.scartate.assign(Set=k) for k, e in qualita.items()],
+                                         ignore_index=True)
+                    if len(scartate):
+                        bottone_export("⬇️ Righe scartate", {"Scartate": scartate},
+                                       "voi_storico_scartate", "scartate")
+
+        elif st.session_state.storico:
+            st.caption("Storico già disponibile dall'archivio locale: puoi riapplicarlo ai "
+                       "periodi senza ricaricare i file.")
+            if st.button("⚙️ Applica archivio al Setup periodi", type="primary",
+                         use_container_width=True):
+                with PERF.fase("aggregazione"):
+                    per, applicati, mantenute = st.session_state.aggregatore.applica(
+                        st.session_state.periodi, st.session_state.storico)
+                st.session_state.periodi = per
+                st.session_state.storico_info = (
+                    f"archivio locale · set: {', '.join(st.session_state.storico.keys())}")
+                st.success(f"✅ Archivio applicato a {applicati} periodi."
+                           + (f" {mantenute} valori modificati a mano mantenuti."
+                              if mantenute else ""))
+
+        if st.session_state.storico:
+            st.divider()
+            st.markdown("##### Quadro storico per set")
+            rows = []
+            for k, d in st.session_state.storico.items():
+                rows.append({"Set": k, "Righe-giorno": len(d),
+                             "Anni": ", ".join(map(str, sorted(d["dt"].dt.year.unique()))),
+                             "Occ. media": f"{d['% Occ.'].mean()*100:.1f}%",
+                             "ADR bed mediana": eur2(d["ADR Bed"].median())})
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+            if ARCHIVIO.disponibile():
+                st.caption(f"Archivio locale: {ARCHIVIO.radice}")
+                if st.button("🗑️ Svuota archivio storico"):
+                    ARCHIVIO.svuota()
+                    st.session_state.storico = {}
+                    st.session_state.storico_info = ""
+                    st.session_state.aggregatore = AggregatoreStorico()
+                    st.rerun()
+
+
+    # ==================================================================
+    # PAGINA — VALUTAZIONE BATCH
+    # ==================================================================
+    elif pagina == "📑 Valutazione batch":
+        st.subheader("📑 Valutazione batch richieste (RFP)")
+        st.caption("Carica un foglio con una riga per richiesta: check-in, check-out, camere, "
+                   "pax/cam, tariffa ADR bed, ancillare, allotment ALPI residuo. Occupancy, "
+                   "utilizzo allotment e pick-up WEB, se non indicati, arrivano dai periodi; "
+                   "l'allotment residuo dall'inventario (notte più critica), se copre le date.")
+
+        modello = pd.DataFrame([{"Gruppo": "Gruppo esempio", "Check-in": date(2026, 7, 11),
+                                 "Check-out": date(2026, 7, 14), "Camere": 30, "Pax/cam": 2.25,
+                                 "ADR bed": 95.0, "Ancillare": 0.0, "Allotment residuo": 20,
+                                 "Occupancy %": None, "Utilizzo allotment %": None,
+                                 "Pick-up WEB %": None}])
+        bottone_export("⬇️ Modello foglio richieste", {"Richieste": modello},
+                       "voi_richieste_batch", "modello_batch", ["Excel"])
+
+        up = st.file_uploader("Foglio richieste (.xlsx / .csv)", type=["xlsx", "csv"])
         if up is not None:
             try:
-                imp = pd.read_excel(up)
-                imp["Data inizio"] = pd.to_datetime(imp["Data inizio"])
-                imp["Data fine"] = pd.to_datetime(imp["Data fine"])
-                st.session_state.periodi = imp
-                st.success("Periodi importati.")
-                st.rerun()
+                with PERF.fase("lettura Excel"):
+                    rich = (pd.read_csv(up, sep=None, engine="python")
+                            if up.name.lower().endswith(".csv") else pd.read_excel(up))
+                indice, cal = indice_periodi(), calendario()
+                date_rfp = normalizza_richieste(rich)[["Check-in", "Check-out"]]
+                if date_rfp.notna().all(axis=1).any():
+                    aggiorna_da_sorgente(date_rfp["Check-in"].min(), date_rfp["Check-out"].max())
+                with PERF.fase("valutazione batch"):
+                    ris = valuta_batch(indice, rich, s, cal, INVENTARIO)
             except Exception as e:
-                st.error(f"Import non riuscito: {e}")
-    with c3:
-        if st.button("↺ Ripristina periodi demo", use_container_width=True):
-            st.session_state.periodi = periodi_default()
-            st.session_state.storico_info = ""
-            st.rerun()
-
-
-# ==================================================================
-# PAGINA — RIEPILOGO
-# ==================================================================
-elif pagina == "📋 Riepilogo":
-    st.subheader("📋 Riepilogo valutazioni")
-    if not st.session_state.valutazioni:
-        st.info("Nessuna valutazione salvata in questa sessione.")
-    else:
-        df = pd.DataFrame(st.session_state.valutazioni)
-        st.dataframe(df, use_container_width=True, hide_index=True)
-        c1, c2 = st.columns(2)
+                st.error(f"Valutazione non riuscita: {e}")
+                st.stop()
+
+            conta = ris["Verdetto"].value_counts()
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Richieste", len(ris))
+            m2.metric("✅ Accettare", int(conta.get(VERDETTI[0], 0)))
+            m3.metric("⚠️ Controproposta", int(conta.get(VERDETTI[1], 0)))
+            m4.metric("⛔ Rifiutare", int(conta.get(VERDETTI[2], 0)))
+            st.dataframe(ris, hide_index=True, use_container_width=True)
+            if (ris["Verdetto"] == "NON VALUTABILE").any():
+                st.warning("Alcune righe non sono valutabili: vedi la colonna «Note».")
+            bottone_export("⬇️ Esporta risultati batch", {"Valutazioni batch": ris},
+                           "voi_valutazioni_batch", "batch")
+
+            st.divider()
+            st.markdown("##### 🧩 Portafoglio ottimale")
+            st.caption("Quando più gruppi chiedono date sovrapposte, sceglie la combinazione (ed "
+                       "eventuali controproposte) che massimizza il valore netto del displacement, "
+                       "con allotment e camere di casa condivisi notte per notte. Per le notti "
+                       "nell'inventario valgono allotment residuo e camere libere del libro notti; "
+                       "per le altre il massimo indicato dalle righe che le coprono.")
+            o1, o2, o3, o4 = st.columns(4)
+            casa = o1.number_input("Camere casa libere per notte (oltre allotment)", 0, 2000, 60, 5)
+            usa_contro = o2.checkbox("Valuta controproposte", True)
+            prob = o3.slider("Prob. accettazione controproposta", 0, 100, 50, 5,
+                             help="Usata se il foglio non ha la colonna "
+                                  "«Prob. controproposta %».")
+            tempo = o4.number_input("Tempo massimo (s)", 1, 60, 5, 1)
+            foglio = (up.name, up.size)
+            if st.button("🧩 Ottimizza portafoglio", use_container_width=True):
+                residuo = None
+                dal, al = ris["Check-in"].dropna().min(), ris["Check-out"].dropna().max()
+                if pd.notna(dal) and pd.notna(al) and al > dal:
+                    residuo, libere = INVENTARIO.periodo(dal, al)
+                    casa = libere.reindex(pd.date_range(dal, al)).fillna(casa)
+                with st.spinner("Ottimizzazione in corso…"), PERF.fase("portafoglio"):
+                    st.session_state.portafoglio = (foglio, ottimizza_portafoglio(
+                        indice_periodi(), rich, s, camere_casa=casa, allotment=residuo,
+                        controproposte=usa_contro, prob_controproposta=prob,
+                        calendario=calendario(), tempo_max=tempo, inventario=INVENTARIO))
+            salvato = st.session_state.get("portafoglio")
+            if salvato and salvato[0] == foglio:
+                port = salvato[1]
+                p1, p2, p3, p4 = st.columns(4)
+                p1.metric("Ricavo atteso", eur(port.ricavo))
+                p2.metric("Alternativa attesa", eur(port.alternativa))
+                p3.metric("Displacement netto", eur(port.displacement),
+                          delta=f"{eur(port.displacement - port.riferimento)} "
+                                "vs solo «ACCETTARE»")
+                p4.metric("Gruppi scelti",
+                          int(port.richieste["Scelta portafoglio"].isin(["Accettare",
+                                                                         "Controproposta"]).sum()))
+                st.caption(f"Metodo: {port.metodo} · {port.iterazioni:,} iterazioni · "
+                           f"{port.secondi:.2f} s" + ("" if port.ottimo else
+                                                      " · soluzione buona, ottimo non garantito"))
+                st.dataframe(port.richieste[["Gruppo", "Check-in", "Check-out", "Camere", "ADR bed",
+                                             "Controproposta bed", "Verdetto", "Scelta portafoglio",
+                                             "Tariffa applicata", "Ricavo atteso"]],
+                             hide_index=True, use_container_width=True)
+                fig = go.Figure()
+                fig.add_trace(go.Bar(x=port.notti["Notte"], y=port.notti["Entro allotment"],
+                                     name="Entro allotment", marker_color=PRIM))
+                fig.add_trace(go.Bar(x=port.notti["Notte"], y=port.notti["Oltre allotment"],
+                                     name="Oltre allotment", marker_color=ACCENT))
+                fig.add_trace(go.Scatter(x=port.notti["Notte"], y=port.notti["Capacità"],
+                                         name="Capacità", mode="lines",
+                                         line=dict(color=ROSSO, dash="dash")))
+                fig.update_layout(barmode="stack", title="Camere gruppi per notte", height=320,
+                                  margin=dict(t=46, b=10, l=10, r=10))
+                grafico(fig)
+                bottone_export("⬇️ Esporta portafoglio", {"Portafoglio": port.richieste,
+                                                         "Carico per notte": port.notti},
+                               "voi_portafoglio", "portafoglio")
+
+
+    # ==================================================================
+    # PAGINA — SETUP PERIODI
+    # ==================================================================
+    elif pagina == "⚙️ Setup periodi":
+        st.subheader("⚙️ Setup periodi tariffari")
+        st.caption("Anagrafica periodi. Le tariffe sono **ADR bed per pax/notte**. "
+                   "Se hai caricato lo storico, i valori sono pre-compilati dai consuntivi "
+                   "(restano modificabili: un valore cambiato a mano non viene più sovrascritto, "
+                   "e cambiando le date di un periodo si ricalcola solo quel periodo).")
+        if st.session_state.storico_info:
+            st.info(f"📂 Pre-compilato da storico — {st.session_state.storico_info}")
+
+        cfg = {
+            "Stagione": st.column_config.TextColumn("Stagione", width="small",
+                        help="Etichetta della stagione (es. 2026). "
+                             "Vuota = anno della data di inizio."),
+            "Periodo": st.column_config.TextColumn("Periodo", width="medium"),
+            "Data inizio": st.column_config.DateColumn("Inizio", format="DD/MM/YYYY"),
+            "Data fine": st.column_config.DateColumn("Fine", format="DD/MM/YYYY"),
+            "Min stay": st.column_config.NumberColumn("MLOS", min_value=1, max_value=21, step=1),
+            "ADR bed WEB": st.column_config.NumberColumn("ADR bed WEB", format="%.1f €",
+                           help="Tariffa individuale dinamica (CRS / Vertical Booking / Blastness + OTA + diretto)."),
+            "ADR bed Alpitour": st.column_config.NumberColumn("ADR bed Alpitour", format="%.1f €",
+                                help="ADR bed degli individuali Alpitour in allotment."),
+            "Allotment ALPI": st.column_config.NumberColumn("Allotment ALPI", min_value=0, step=1),
+            "Occupancy attesa %": st.column_config.NumberColumn("Occ. attesa %", format="%.1f"),
+            "Utilizzo allotment %": st.column_config.NumberColumn("Utilizzo allot. %",
+                                    format="%.1f",
+                                    help="Quota dell'allotment tipicamente riempita dagli individuali Alpitour."),
+        }
+        edited = st.data_editor(st.session_state.periodi, column_config=cfg,
+                                num_rows="dynamic", use_container_width=True, hide_index=True)
+        st.session_state.periodi = edited
+        aggregatore = st.session_state.aggregatore
+        if st.session_state.storico and aggregatore.scritti:
+            # righe nuove o con date cambiate: ricalcolo dei soli loro aggregati
+            with PERF.fase("aggregazione"):
+                per, _, _ = aggregatore.applica(edited, st.session_state.storico,
+                                                solo_cambiate=True)
+            if aggregatore.modificate:
+                st.session_state.periodi = per
+                st.rerun()
+        sov = indice_periodi().sovrapposizioni
+        if sov:
+            st.warning("Periodi sovrapposti: " + ", ".join(str(edited["Periodo"].iloc[i]) for i in sov) +
+                       ". Per le notti in comune vale il primo periodo in tabella.")
+        cal = calendario()
+        if cal is not None and len(edited):
+            fine = pd.to_datetime(edited["Data fine"]).max() + pd.Timedelta(days=1)
+            notti = notti_soggiorno(pd.to_datetime(edited["Data inizio"]).min(), fine)
+            notti = notti[indice_periodi().cerca(notti) >= 0]
+            coperte = int((~np.isnan(cal.per_notte(notti)["occ"])).sum())
+            if coperte:
+                st.info(f"📅 Domanda notte per notte da storico attiva: per {coperte} notti "
+                        f"su {len(notti)} «Occ. attesa %» e «Utilizzo allot. %» vengono dallo "
+                        "storico e non da questa tabella. Tariffe, MLOS e allotment restano "
+                        "quelli impostati qui e le variazioni per giorno si applicano anche "
+                        "sopra lo storico (disattiva l'opzione in sidebar per usare solo la "
+                        "tabella).")
+
+        st.markdown("##### Variazioni per giorno della settimana")
+        st.caption("Differenziali per giorno (es. sabato +10% sulle tariffe): su tutte le "
+                   "stagioni, su una stagione, su un periodo o su entrambi; vale la riga più "
+                   "specifica (a parità, la prima in tabella). «Valore», se indicato, "
+                   "sostituisce la cifra del periodo.")
+        numeriche = [c for c in edited.columns
+                     if c not in ("Stagione", "Periodo", "Data inizio", "Data fine")]
+        cfg_var = {
+            "Stagione": st.column_config.TextColumn("Stagione", help="Vuota = tutte le stagioni."),
+            "Periodo": st.column_config.SelectboxColumn(
+                "Periodo", options=sorted(edited["Periodo"].dropna().astype(str).unique()),
+                help="Vuoto = tutti i periodi della stagione."),
+            "Giorni": st.column_config.TextColumn(
+                "Giorni", help=f"Es. «Sab», «Ven,Sab», «Lun-Gio» ({', '.join(GIORNI_SETTIMANA)})."),
+            "Colonna": st.column_config.SelectboxColumn(
+                "Colonna", options=[TUTTE_LE_TARIFFE] + numeriche),
+            "Variazione %": st.column_config.NumberColumn("Variazione %", format="%+.1f"),
+            "Valore": st.column_config.NumberColumn("Valore", help="Sostituisce il valore del periodo."),
+        }
+        st.session_state.variazioni = st.data_editor(
+            st.session_state.variazioni, column_config=cfg_var, num_rows="dynamic",
+            use_container_width=True, hide_index=True)
+        indice = indice_periodi()
+        if indice.scartate:
+            st.warning("Variazioni ignorate (giorni, colonna o periodo non validi): righe " +
+                       ", ".join(str(i + 1) for i in indice.scartate) + ".")
+        if indice.variazioni and len(edited):
+            with st.expander("📅 Anteprima calendario tariffe"):
+                tariffe = [c for c in numeriche if str(c).startswith("ADR bed")]
+                cal = indice.tariffe(pd.to_datetime(edited["Data inizio"]).min(),
+                                     pd.to_datetime(edited["Data fine"]).max(), tariffe)
+                fig = go.Figure([go.Scatter(x=cal["Notte"], y=cal[c], name=c, mode="lines",
+                                            line_shape="hv") for c in tariffe])
+                fig.update_layout(height=320, margin=dict(t=20, b=10, l=10, r=10),
+                                  yaxis_title="€/pax/notte", legend=dict(orientation="h", y=-0.2))
+                grafico(fig)
+
+        c1, c2, c3 = st.columns(3)
         with c1:
-            st.download_button("⬇️ Esporta riepilogo", to_excel_bytes({"Valutazioni": df}),
-                               "voi_valutazioni_gruppi.xlsx",
-                               "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                               use_container_width=True)
+            # sempre Excel: è il formato che «Importa periodi» rilegge
+            bottone_export("⬇️ Esporta periodi", {"Periodi": edited,
+                                                 "Variazioni": st.session_state.variazioni},
+                           "voi_periodi", "periodi", ["Excel"])
         with c2:
-            if st.button("🗑️ Svuota riepilogo", use_container_width=True):
-                st.session_state.valutazioni = []
+            up = st.file_uploader("⬆️ Importa periodi", type=["xlsx"],
+                                  label_visibility="collapsed")
+            # importa una volta per file: al rerun il file resta nell'uploader
+            if up is not None and st.session_state.get("periodi_importati") != (up.name, up.size):
+                try:
+                    with PERF.fase("lettura Excel"):
+                        st.session_state.periodi, st.session_state.variazioni = leggi_periodi(up)
+                    st.session_state.periodi_importati = (up.name, up.size)
+                    st.session_state.aggregatore = AggregatoreStorico()
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Import non riuscito: {e}")
+        with c3:
+            if st.button("↺ Ripristina periodi demo", use_container_width=True):
+                st.session_state.periodi = periodi_default()
+                st.session_state.variazioni = variazioni_vuote()
+                st.session_state.storico_info = ""
+                st.session_state.aggregatore = AggregatoreStorico()
                 st.rerun()
 
 
-# ==================================================================
-# PAGINA — VALUTAZIONE GRUPPO
-# ==================================================================
-else:
-    periodi = st.session_state.periodi
-    st.subheader("🧮 Valutazione richiesta gruppo")
-    if not st.session_state.storico:
-        st.caption("💡 Suggerimento: carica i consuntivi in «Dati storici» per basare la "
-                   "valutazione su tariffe e occupancy reali invece che sui valori demo.")
-
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        nome_gruppo = st.text_input("Nome / riferimento gruppo", "Gruppo senza nome")
-        check_in = st.date_input("Check-in", date(2026, 7, 11), format="DD/MM/YYYY")
-        check_out = st.date_input("Check-out", date(2026, 7, 14), format="DD/MM/YYYY")
-    with c2:
-        camere = st.number_input("Camere richieste", 1, 500, 30, 1)
-        pax_cam = st.number_input("Pax / camera", 1.0, 4.0, 2.25, 0.05,
-                                  help="Default gruppi leisure = 2,25.")
-        meal = st.selectbox("Meal plan (riferimento)", ["BB", "HB", "FB"], index=1)
-    with c3:
-        tariffa = st.number_input("Tariffa proposta — ADR bed (€/pax/notte)",
-                                  0.0, 1000.0, 95.0, 1.0)
-        ancillare = st.number_input("Ricavo ancillare extra (€/pax/notte)",
-                                    0.0, 500.0, 0.0, 1.0)
-        allot_residuo = st.number_input("Allotment ALPI residuo (da Scrigno)",
-                                        0, 500, 20, 1,
-                                        help="Camere ancora libere nell'allotment Alpitour "
-                                             "per le date. Verifica manualmente su Scrigno.")
-
-    # --- pre-analisi periodi (per default override) ---
-    notti, seg, nomatch = analizza_soggiorno(periodi, check_in, check_out) \
-        if check_out > check_in else (0, {}, 0)
-    if seg:
-        nv = sum(v["notti"] for v in seg.values())
-        occ_def = sum(v["notti"] * v["occ"] for v in seg.values()) / nv
-        util_def = sum(v["notti"] * v["util"] for v in seg.values()) / nv
-    else:
-        occ_def, util_def = 75.0, 50.0
-
-    with st.expander("⚙️ Parametri avanzati (default da periodi storici)"):
-        a1, a2, a3 = st.columns(3)
-        with a1:
-            occupancy = st.number_input("Occupancy attesa (%)", 0.0, 100.0,
-                                        round(float(occ_def), 1), 1.0)
-        with a2:
-            util_allot = st.number_input("Utilizzo allotment Alpitour (%)", 0.0, 100.0,
-                                         round(float(util_def), 1), 1.0,
-                                         help="Probabilità che lo slot di allotment venga "
-                                              "comunque riempito dagli individuali Alpitour.")
-        with a3:
-            pickup_web = st.number_input("Pick-up casa / WEB (%)", 0.0, 100.0,
-                                         round(float(occ_def), 1), 1.0,
-                                         help="Probabilità che le camere oltre allotment "
-                                              "si vendano comunque a tariffa WEB.")
-
-    valuta = st.button("▶️  Valuta richiesta", type="primary", use_container_width=True)
-
-    # ---------- ELABORAZIONE ----------
-    if valuta:
-        if check_out <= check_in:
-            st.error("Il check-out deve essere successivo al check-in.")
-            st.stop()
-        if not seg:
-            st.error("Le date non rientrano in alcun periodo configurato (vedi «Setup periodi»).")
+    # ==================================================================
+    # PAGINA — INVENTARIO
+    # ==================================================================
+    elif pagina == "📦 Inventario":
+        st.subheader("📦 Inventario notte per notte")
+        st.caption("Libro notti condiviso: capacità della casa, allotment Alpitour, venduto e "
+                   "camere trattenute dai gruppi. Salvando una valutazione «ACCETTARE» il gruppo "
+                   "blocca le sue camere (prima sull'allotment residuo, poi sulla casa); la "
+                   "valutazione usa l'allotment residuo di ogni notte al posto del valore "
+                   "inserito a mano.")
+        per = st.session_state.periodi
+        inizio = pd.to_datetime(per["Data inizio"]).min()
+        fine = pd.to_datetime(per["Data fine"]).max()
+        c1, c2, c3 = st.columns(3)
+        dal = c1.date_input("Dal", inizio.date() if pd.notna(inizio) else date(2026, 6, 1),
+                            format="DD/MM/YYYY")
+        al = c2.date_input("Al", fine.date() if pd.notna(fine) else date(2026, 9, 30),
+                           format="DD/MM/YYYY")
+        capacita = c3.number_input("Capacità casa (camere)", 1, 2000, 280, 1)
+        if al < dal:
+            st.error("La data finale precede quella iniziale.")
             st.stop()
-        if nomatch:
-            st.warning(f"⚠️ {nomatch} notti su {notti} fuori da ogni periodo: escluse dal calcolo.")
-
-        nv = sum(v["notti"] for v in seg.values())
-        web_w = sum(v["notti"] * v["web"] for v in seg.values()) / nv
-        alpi_w = sum(v["notti"] * v["alpi"] for v in seg.values()) / nv
-        min_eff = max(v["min"] for v in seg.values())
-
-        # volumi gruppo
-        pax = camere * pax_cam
-        bed_nights = pax * nv
-        rev_camere = bed_nights * tariffa
-        rev_anc = bed_nights * ancillare
-        rev_totale = rev_camere + rev_anc
-        adr_room = tariffa * pax_cam
-
-        # displacement a due livelli
-        camere_allot = min(camere, allot_residuo)
-        camere_over = max(0, camere - allot_residuo)
-        rev_alt_allot = camere_allot * pax_cam * alpi_w * nv * (util_allot / 100)
-        rev_alt_web = camere_over * pax_cam * web_w * nv * (pickup_web / 100)
-        rev_alt = rev_alt_allot + rev_alt_web
-        displacement = rev_totale - rev_alt
-
-        # soglia ADR bed
-        pct = s["low"] if occupancy < 60 else s["mid"] if occupancy < 80 else s["high"]
-        soglia_bed = web_w * pct
-
-        # controproposta
-        denom = camere * pax_cam * nv
-        tariffa_be = (rev_alt - rev_anc) / denom if denom else 0
-        controproposta = math.ceil(max(tariffa_be, soglia_bed))
-
-        # ===== CHECK 1 — ALLOTMENT =====
-        if camere_over == 0:
-            c1r = ("verde", "Allotment ALPI",
-                   f"Le {camere} camere rientrano nell'allotment residuo ({allot_residuo}). "
-                   f"Nessuna erosione dell'inventario WEB.")
-        elif camere_over <= max(2, 0.15 * camere):
-            c1r = ("giallo", "Allotment ALPI",
-                   f"{camere_over} camere oltre allotment ({allot_residuo} residue): "
-                   f"erosione contenuta dell'inventario WEB, valutate a tariffa dinamica.")
+        if SORGENTE is None:
+            st.caption("📡 Nessuna sorgente dati collegata: imposta `VOI_SORGENTE` (URL del "
+                       "servizio PMS / channel manager o percorso di un export) per aggiornare il "
+                       "libro in automatico.")
         else:
-            c1r = ("rosso", "Allotment ALPI",
-                   f"{camere_over} camere oltre allotment ({allot_residuo} residue): "
-                   f"erosione significativa dell'inventario WEB ad alto valore.")
-
-        # ===== CHECK 2 — MIN STAY =====
-        if notti >= min_eff:
-            c2r = ("verde", "Minimum stay",
-                   f"Soggiorno di {notti} notti ≥ MLOS del periodo ({min_eff}).")
-        elif notti >= min_eff - 1:
-            c2r = ("giallo", "Minimum stay",
-                   f"{notti} notti contro MLOS {min_eff}: deroga lieve, da autorizzare.")
+            s1, s2 = st.columns([3, 1])
+            if s2.button("⟳ Aggiorna ora", use_container_width=True):
+                SORGENTE.invalida()
+            lettura = aggiorna_da_sorgente(dal, al)
+            letto = f"{lettura.aggiornato:%d/%m/%Y %H:%M}" if lettura.aggiornato else "mai"
+            s1.caption(f"📡 Sorgente: {SORGENTE.nome} · ultima lettura {letto} · "
+                       f"{len(lettura.notti)} notti (i mesi interi dell'intervallo).")
+        if st.button("↧ Genera notti dai periodi", use_container_width=True,
+                     help="Allotment ALPI dai periodi e capacità indicata per tutte le notti "
+                          "dell'intervallo; venduto e gruppi già registrati restano invariati."):
+            n = INVENTARIO.notti_da_periodi(indice_periodi(), dal, al, capacita)
+            st.toast(f"{n} notti aggiornate nell'inventario.", icon="📦")
+
+        with PERF.fase("inventario"):
+            tab = INVENTARIO.intervallo(dal, al).tabella()
+        if tab.empty:
+            st.info("Nessuna notte nell'intervallo: usa «Genera notti dai periodi».")
         else:
-            c2r = ("rosso", "Minimum stay",
-                   f"{notti} notti sotto il MLOS di {min_eff}: deroga importante.")
-
-        # ===== CHECK 3 — ADR BED =====
-        gap = tariffa - soglia_bed
-        if tariffa >= soglia_bed:
-            c3r = ("verde", "ADR bed vs soglia",
-                   f"Tariffa {eur2(tariffa)} ≥ soglia {eur2(soglia_bed)} "
-                   f"({pct*100:.0f}% della WEB con occupancy {occupancy:.0f}%).")
-        elif tariffa >= soglia_bed * 0.92:
-            c3r = ("giallo", "ADR bed vs soglia",
-                   f"Tariffa {eur2(tariffa)} di poco sotto la soglia {eur2(soglia_bed)} "
-                   f"(gap {eur2(gap)}/pax).")
+            calcolate = [c for c in tab.columns if c not in ("Notte", *COLONNE_NOTTI.values())]
+            modificato = st.data_editor(
+                tab, disabled=["Notte", *calcolate], hide_index=True, use_container_width=True,
+                column_config={"Notte": st.column_config.DateColumn("Notte", format="DD/MM/YYYY")})
+            if st.button("💾 Salva notti", use_container_width=True):
+                INVENTARIO.imposta_notti(modificato[["Notte", *COLONNE_NOTTI.values()]])
+                st.rerun()
+            fig = go.Figure()
+            for col, colore in (("Venduto ALPI", "#7E9AA3"), ("Venduto casa", "#B9C5C9"),
+                                ("Gruppi in allotment", PRIM), ("Gruppi su casa", ACCENT),
+                                ("Allotment residuo", GIALLO)):
+                fig.add_trace(go.Bar(x=tab["Notte"], y=tab[col], name=col, marker_color=colore))
+            fig.add_trace(go.Scatter(x=tab["Notte"], y=tab["Capacità"], name="Capacità",
+                                     mode="lines", line=dict(color=ROSSO, dash="dash")))
+            fig.update_layout(barmode="stack", title="Camere per notte", height=340, bargap=0,
+                              margin=dict(t=46, b=10, l=10, r=10),
+                              legend=dict(orientation="h", y=-0.2))
+            grafico(fig)
+
+        st.markdown("##### Gruppi bloccati")
+        blocchi = INVENTARIO.blocchi()
+        if blocchi.empty:
+            st.caption("Nessun gruppo bloccato.")
         else:
-            c3r = ("rosso", "ADR bed vs soglia",
-                   f"Tariffa {eur2(tariffa)} sotto la soglia {eur2(soglia_bed)} "
-                   f"(gap {eur2(gap)}/pax).")
-
-        # ===== CHECK 4 — DISPLACEMENT =====
-        if displacement > 0:
-            c4r = ("verde", "Displacement netto",
-                   f"Il gruppo genera {eur(displacement)} di valore incrementale "
-                   f"rispetto alla vendita alternativa attesa.")
-        elif displacement >= -0.05 * rev_alt:
-            c4r = ("giallo", "Displacement netto",
-                   f"Displacement marginalmente negativo ({eur(displacement)}): "
-                   f"valore quasi equivalente all'alternativa.")
+            st.dataframe(blocchi, hide_index=True, use_container_width=True)
+            b1, b2 = st.columns([3, 1])
+            etichette = {f"#{b} · {g} · {ci} → {co} · {n} cam.": b for b, g, ci, co, n in
+                         blocchi[["Blocco", "Gruppo", "Check-in", "Check-out", "Camere"]]
+                         .itertuples(index=False, name=None)}
+            scelto = b1.selectbox("Blocco da rilasciare", list(etichette),
+                                  label_visibility="collapsed")
+            if b2.button("↺ Rilascia camere", use_container_width=True):
+                INVENTARIO.rilascia(etichette[scelto])
+                st.rerun()
+
+
+    # ==================================================================
+    # PAGINA — RIEPILOGO
+    # ==================================================================
+    elif pagina == "📋 Riepilogo":
+        st.subheader("📋 Riepilogo valutazioni")
+        totale = REGISTRO.conta("v2")
+        if not totale:
+            st.info("Nessuna valutazione nel registro. "
+                    "Vai su «Valutazione gruppo» e usa **Salva valutazione**.")
         else:
-            c4r = ("rosso", "Displacement netto",
-                   f"Il gruppo distrugge {eur(abs(displacement))} di valore "
-                   f"rispetto alla vendita alternativa attesa.")
-
-        checks = [c1r, c2r, c3r, c4r]
-        stati = [c[0] for c in checks]
-        if "rosso" in stati:
-            verdetto, vcol = "RIFIUTARE O RINEGOZIARE", "rosso"
-        elif "giallo" in stati:
-            verdetto, vcol = "VALUTARE — CONTROPROPOSTA CONSIGLIATA", "giallo"
+            f1, f2, f3, f4 = st.columns([1, 1, 1.3, 2])
+            filtri = {"dal": f1.date_input("Check-in dal", None, format="DD/MM/YYYY"),
+                      "al": f2.date_input("Check-in al", None, format="DD/MM/YYYY"),
+                      "gruppo": f3.text_input("Gruppo (inizia con)").strip(),
+                      "verdetti": f4.multiselect("Verdetto", REGISTRO.verdetti("v2"))}
+            trovate = REGISTRO.conta("v2", **filtri)
+            p1, p2, p3 = st.columns([1, 1, 3])
+            righe = p1.selectbox("Righe per pagina", [25, 50, 100, 250], index=1)
+            pagine = max(1, -(-trovate // righe))
+            n = p2.number_input("Pagina", 1, pagine, 1)
+            p3.caption(f"{trovate} valutazioni su {totale} nel registro · "
+                       f"pagina {n} di {pagine}")
+            st.dataframe(REGISTRO.pagina("v2", n - 1, righe, **filtri),
+                         use_container_width=True, hide_index=True)
+            c1, c2 = st.columns(2)
+            with c1:
+                formato = st.selectbox("Formato export", formati())
+                if st.button("⬇️ Prepara export (righe filtrate)", use_container_width=True):
+                    with PERF.fase("export"):
+                        dati = esporta({"Valutazioni": REGISTRO.esporta("v2", **filtri)},
+                                       formato, "voi_valutazioni_gruppi")
+                    st.download_button(f"⬇️ Esporta riepilogo ({formato})", *dati,
+                                       use_container_width=True)
+            with c2:
+                conferma = st.checkbox("Confermo di voler cancellare tutto il registro")
+                if st.button("🗑️ Svuota registro", use_container_width=True, disabled=not conferma):
+                    REGISTRO.svuota("v2")
+                    st.rerun()
+
+
+    # ==================================================================
+    # PAGINA — VALUTAZIONE GRUPPO
+    # ==================================================================
+    else:
+        st.subheader("🧮 Valutazione richiesta gruppo")
+        if not st.session_state.storico:
+            st.caption("💡 Suggerimento: carica i consuntivi in «Dati storici» per basare la "
+                       "valutazione su tariffe e occupancy reali invece che sui valori demo.")
+
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            nome_gruppo = st.text_input("Nome / riferimento gruppo", "Gruppo senza nome")
+            check_in = st.date_input("Check-in", date(2026, 7, 11), format="DD/MM/YYYY")
+            check_out = st.date_input("Check-out", date(2026, 7, 14), format="DD/MM/YYYY")
+        with c2:
+            camere = st.number_input("Camere richieste", 1, 500, 30, 1)
+            pax_cam = st.number_input("Pax / camera", 1.0, 4.0, 2.25, 0.05,
+                                      help="Default gruppi leisure = 2,25.")
+            meal = st.selectbox("Meal plan (riferimento)", ["BB", "HB", "FB"], index=1)
+        with c3:
+            tariffa = st.number_input("Tariffa proposta — ADR bed (€/pax/notte)",
+                                      0.0, 1000.0, 95.0, 1.0)
+            ancillare = st.number_input("Ricavo ancillare extra (€/pax/notte)",
+                                        0.0, 500.0, 0.0, 1.0)
+            disp = None
+            if check_out > check_in:
+                aggiorna_da_sorgente(check_in, check_out)
+                with PERF.fase("inventario"):
+                    disp = INVENTARIO.soggiorno(check_in, check_out)
+            da_inventario = disp is not None and disp.completa and st.toggle(
+                "Allotment residuo dall'inventario", True,
+                help="Residuo notte per notte dal libro notti (sezione «Inventario»), "
+                     "al netto dei gruppi già bloccati.")
+            if da_inventario:
+                st.caption(f"📦 Allotment ALPI residuo: {disp.residuo_allot.min()}–"
+                           f"{disp.residuo_allot.max()} camere per notte.")
+            else:
+                allot_residuo = st.number_input("Allotment ALPI residuo (da Scrigno)",
+                                                0, 500, 20, 1,
+                                                help="Camere ancora libere nell'allotment "
+                                                     "Alpitour per le date. Verifica "
+                                                     "manualmente su Scrigno.")
+
+        # --- pre-analisi periodi (per default override) ---
+        sog = None
+        if check_out > check_in:
+            indice, cal = indice_periodi(), calendario()
+            with PERF.fase("match periodi"):
+                sog = analizza_soggiorno(indice, check_in, check_out, calendario=cal)
+            if da_inventario:
+                # solo le notti valutate (quelle nei periodi), nell'ordine del soggiorno
+                allot_residuo = disp.residuo_allot[np.isin(disp.giorni, sog.giorni)]
+        notti, seg, nomatch = (sog.notti, sog.seg, sog.nomatch) if sog else (0, {}, 0)
+        if seg:
+            occ_def, util_def = sog.medie["occ"], sog.medie["util"]
         else:
-            verdetto, vcol = "ACCETTARE", "verde"
-
-        # ---------- OUTPUT ----------
-        st.divider()
-        m1, m2, m3, m4 = st.columns(4)
-        m1.metric("Pax totali", f"{pax:.0f}", help=f"{camere} camere × {pax_cam} pax/cam")
-        m2.metric("Bed nights", f"{bed_nights:.0f}")
-        m3.metric("ADR bed gruppo", eur2(tariffa))
-        m4.metric("ADR room gruppo", eur2(adr_room))
-
-        m5, m6, m7, m8 = st.columns(4)
-        m5.metric("Valore totale gruppo", eur(rev_totale))
-        m6.metric("Alternativa attesa", eur(rev_alt))
-        m7.metric("Displacement netto", eur(displacement),
-                  delta=f"{displacement/rev_alt*100:+.1f}%" if rev_alt else None)
-        m8.metric("Camere oltre allotment", f"{camere_over}")
-
-        st.markdown(f"""
-        <div class="vt-verdict" style="background:{COLOR[vcol]}">
-          <h2>{ICON[vcol]}  {verdetto}</h2>
+            occ_def, util_def = 75.0, 50.0
+        # occupazione già in casa (venduto e gruppi): l'occupancy attesa non può essere inferiore
+        otb = float(disp.occupazione.mean()) if disp is not None and disp.completa else None
+        if otb is not None:
+            occ_def = max(occ_def, otb)
+
+        with st.expander("⚙️ Parametri avanzati (default da periodi storici)"):
+            if otb is not None:
+                st.caption(f"📦 Già in casa {otb:.0f}% (libro notti): l'occupancy attesa di "
+                           "default non scende sotto questo valore.")
+            a1, a2, a3 = st.columns(3)
+            with a1:
+                occupancy = st.number_input("Occupancy attesa (%)", 0.0, 100.0,
+                                            round(float(occ_def), 1), 1.0)
+            with a2:
+                util_allot = st.number_input("Utilizzo allotment Alpitour (%)", 0.0, 100.0,
+                                             round(float(util_def), 1), 1.0,
+                                             help="Probabilità che lo slot di allotment venga "
+                                                  "comunque riempito dagli individuali Alpitour.")
+            with a3:
+                pickup_web = st.number_input("Pick-up casa / WEB (%)", 0.0, 100.0,
+                                             round(float(occ_def), 1), 1.0,
+                                             help="Probabilità che le camere oltre allotment "
+                                                  "si vendano comunque a tariffa WEB.")
+
+        valuta = st.button("▶️  Valuta richiesta", type="primary", use_container_width=True)
+
+        # ---------- ELABORAZIONE ----------
+        if valuta:
+            if check_out <= check_in:
+                st.error("Il check-out deve essere successivo al check-in.")
+                st.stop()
+            if not seg:
+                st.error("Le date non rientrano in alcun periodo configurato "
+                         "(vedi «Setup periodi»).")
+                st.stop()
+            if nomatch:
+                st.warning(f"⚠️ {nomatch} notti su {notti} fuori da ogni periodo: escluse dal calcolo.")
+
+            richiesta = RichiestaGruppo(check_in=check_in, check_out=check_out, camere=camere,
+                                        pax_cam=pax_cam, tariffa=tariffa, ancillare=ancillare,
+                                        allot_residuo=allot_residuo, occupancy=occupancy,
+                                        util_allot=util_allot, pickup_web=pickup_web,
+                                        nome=nome_gruppo, meal=meal)
+            with PERF.fase("valutazione"):
+                v = valuta_richiesta(richiesta, sog, s)
+            web_w, alpi_w, min_eff = v.web, v.alpi, sog.min_stay
+            rev_alt, displacement, soglia_bed = v.rev_alt, v.displacement, v.soglia_bed
+
+            # ---------- OUTPUT ----------
+            st.divider()
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Pax totali", f"{v.pax:.0f}", help=f"{camere} camere × {pax_cam} pax/cam")
+            m2.metric("Bed nights", f"{v.bed_nights:.0f}")
+            m3.metric("ADR bed gruppo", eur2(tariffa))
+            m4.metric("ADR room gruppo", eur2(v.adr_room))
+
+            m5, m6, m7, m8 = st.columns(4)
+            m5.metric("Valore totale gruppo", eur(v.rev_totale))
+            m6.metric("Alternativa attesa", eur(rev_alt))
+            m7.metric("Displacement netto", eur(displacement),
+                      delta=f"{displacement/rev_alt*100:+.1f}%" if rev_alt else None)
+            m8.metric("Camere oltre allotment", f"{v.camere_over}",
+                      help="Notte più critica del soggiorno." if da_inventario else None)
+
+            st.markdown(f"""
+        <div class="vt-verdict" style="background:{COLOR[v.vcol]}">
+          <h2>{ICON[v.vcol]}  {v.verdetto}</h2>
           <p>{nome_gruppo} · {check_in.strftime('%d/%m/%Y')} → {check_out.strftime('%d/%m/%Y')}
              · {notti} notti · {camere} camere · meal {meal}</p>
         </div>""", unsafe_allow_html=True)
 
-        cL, cR = st.columns([3, 2])
-        with cL:
-            st.markdown("##### Esito controlli")
-            for stato, titolo, dett in checks:
-                st.markdown(f"""<div class="vt-check" style="background:{COLOR[stato]}">
+            cL, cR = st.columns([3, 2])
+            with cL:
+                st.markdown("##### Esito controlli")
+                for stato, titolo, dett in v.checks:
+                    st.markdown(f"""<div class="vt-check" style="background:{COLOR[stato]}">
                   <b>{ICON[stato]} {titolo}</b><br>{dett}</div>""", unsafe_allow_html=True)
-            if rev_totale > s["auth"]:
-                st.warning(f"📨 Valore totale {eur(rev_totale)} oltre la soglia di "
-                           f"{eur(s['auth'])}: **richiede autorizzazione direzione**.")
-        with cR:
-            st.markdown("##### Controproposta")
-            st.markdown(f"""<div class="vt-card">
+                if v.autorizzazione:
+                    st.warning(f"📨 Valore totale {eur(v.rev_totale)} oltre la soglia di "
+                               f"{eur(s['auth'])}: **richiede autorizzazione direzione**.")
+            with cR:
+                st.markdown("##### Controproposta")
+                st.markdown(f"""<div class="vt-card">
               <p style="margin:0 0 4px;font-size:.84rem;color:#555">Break-even bed (displ. = 0)</p>
-              <p style="margin:0;font-size:1.3rem;font-weight:700;color:{PRIM}">{eur2(tariffa_be)}/pax</p>
+              <p style="margin:0;font-size:1.3rem;font-weight:700;color:{PRIM}">{eur2(v.tariffa_be)}/pax</p>
               <hr style="margin:9px 0;border-color:#E4DCC9">
               <p style="margin:0 0 4px;font-size:.84rem;color:#555">Soglia ADR bed (occ {occupancy:.0f}%)</p>
               <p style="margin:0;font-size:1.3rem;font-weight:700;color:{PRIM}">{eur2(soglia_bed)}/pax</p>
               <hr style="margin:9px 0;border-color:#E4DCC9">
               <p style="margin:0 0 4px;font-size:.84rem;color:#555">✅ Tariffa bed da richiedere</p>
-              <p style="margin:0;font-size:1.55rem;font-weight:800;color:{ACCENT}">{eur(controproposta)}/pax</p>
-              <p style="margin:3px 0 0;font-size:.76rem;color:#777">≈ {eur(controproposta*pax_cam)}/camera</p>
+              <p style="margin:0;font-size:1.55rem;font-weight:800;color:{ACCENT}">{eur(v.controproposta)}/pax</p>
+              <p style="margin:3px 0 0;font-size:.76rem;color:#777">≈ {eur(v.controproposta*pax_cam)}/camera</p>
             </div>""", unsafe_allow_html=True)
 
-        g1, g2 = st.columns(2)
-        with g1:
-            fig = go.Figure()
-            fig.add_bar(name="Ricavo camere", x=["Gruppo"], y=[rev_camere], marker_color=PRIM)
-            fig.add_bar(name="Ricavo ancillare", x=["Gruppo"], y=[rev_anc], marker_color=ACCENT)
-            fig.add_bar(name="Alt. — slot allotment", x=["Alternativa"],
-                        y=[rev_alt_allot], marker_color="#7E9AA3")
-            fig.add_bar(name="Alt. — inventario WEB", x=["Alternativa"],
-                        y=[rev_alt_web], marker_color="#B9C5C9")
-            fig.update_layout(barmode="stack", title="Valore gruppo vs alternativa attesa",
-                              height=350, margin=dict(t=46, b=10, l=10, r=10),
-                              legend=dict(orientation="h", y=-0.2))
-            st.plotly_chart(fig, use_container_width=True)
-        with g2:
-            fig2 = go.Figure(go.Bar(
-                x=["Proposta", "Soglia", "WEB", "Alpitour"],
-                y=[tariffa, soglia_bed, web_w, alpi_w],
-                marker_color=[ACCENT, GIALLO, PRIM, "#7E9AA3"],
-                text=[eur2(v) for v in [tariffa, soglia_bed, web_w, alpi_w]],
-                textposition="outside"))
-            fig2.update_layout(title="ADR bed — confronto (€/pax/notte)",
-                               height=350, margin=dict(t=46, b=10, l=10, r=10))
-            st.plotly_chart(fig2, use_container_width=True)
-
-        with st.expander("🔎 Dettaglio periodi del soggiorno"):
-            det = pd.DataFrame([
-                {"Periodo": k, "Notti": v["notti"], "ADR WEB": eur2(v["web"]),
-                 "ADR Alpitour": eur2(v["alpi"]), "Occ. attesa": f"{v['occ']:.0f}%",
-                 "Utilizzo allot.": f"{v['util']:.0f}%", "MLOS": v["min"]}
-                for k, v in seg.items()])
-            st.dataframe(det, hide_index=True, use_container_width=True)
-            st.caption(f"Valori pesati sul soggiorno → ADR WEB {eur2(web_w)} · "
-                       f"ADR Alpitour {eur2(alpi_w)} · MLOS effettivo {min_eff}.")
-
-        record = {"Gruppo": nome_gruppo, "Check-in": check_in.strftime("%d/%m/%Y"),
-                  "Check-out": check_out.strftime("%d/%m/%Y"), "Notti": notti,
-                  "Camere": camere, "Pax": round(pax), "Meal": meal,
-                  "ADR bed": round(tariffa, 2), "Valore totale": round(rev_totale),
-                  "Displacement": round(displacement),
-                  "Controproposta bed": controproposta, "Verdetto": verdetto}
-        if st.button("💾 Salva valutazione nel riepilogo", use_container_width=True):
-            st.session_state.valutazioni.append(record)
-            st.success("Valutazione salvata.")
-
-    with st.expander("ℹ️ Metodologia di calcolo"):
-        st.markdown("""
+            g1, g2 = st.columns(2)
+            with g1:
+                fig = go.Figure()
+                fig.add_bar(name="Ricavo camere", x=["Gruppo"], y=[v.rev_camere], marker_color=PRIM)
+                fig.add_bar(name="Ricavo ancillare", x=["Gruppo"], y=[v.rev_anc],
+                            marker_color=ACCENT)
+                fig.add_bar(name="Alt. — slot allotment", x=["Alternativa"],
+                            y=[v.rev_alt_allot], marker_color="#7E9AA3")
+                fig.add_bar(name="Alt. — inventario WEB", x=["Alternativa"],
+                            y=[v.rev_alt_web], marker_color="#B9C5C9")
+                fig.update_layout(barmode="stack", title="Valore gruppo vs alternativa attesa",
+                                  height=350, margin=dict(t=46, b=10, l=10, r=10),
+                                  legend=dict(orientation="h", y=-0.2))
+                grafico(fig)
+            with g2:
+                fig2 = go.Figure(go.Bar(
+                    x=["Proposta", "Soglia", "WEB", "Alpitour"],
+                    y=[tariffa, soglia_bed, web_w, alpi_w],
+                    marker_color=[ACCENT, GIALLO, PRIM, "#7E9AA3"],
+                    text=[eur2(v) for v in [tariffa, soglia_bed, web_w, alpi_w]],
+                    textposition="outside"))
+                fig2.update_layout(title="ADR bed — confronto (€/pax/notte)",
+                                   height=350, margin=dict(t=46, b=10, l=10, r=10))
+                grafico(fig2)
+
+            with st.expander("🔎 Dettaglio periodi del soggiorno"):
+                det = pd.DataFrame([
+                    {"Periodo": k, "Notti": x["notti"], "ADR WEB": eur2(x["web"]),
+                     "ADR Alpitour": eur2(x["alpi"]), "Occ. attesa": f"{x['occ']:.0f}%",
+                     "Utilizzo allot.": f"{x['util']:.0f}%", "MLOS": x["min"]}
+                    for k, x in seg.items()])
+                st.dataframe(det, hide_index=True, use_container_width=True)
+                st.caption(f"Valori pesati sul soggiorno → ADR WEB {eur2(web_w)} · "
+                           f"ADR Alpitour {eur2(alpi_w)} · MLOS effettivo {min_eff}.")
+                if sog.da_calendario:
+                    st.caption(f"📅 {sog.da_calendario} notti su {sog.notti_valide} con domanda "
+                               "notte per notte dallo storico (ha la precedenza sulla media del "
+                               "periodo).")
+
+            if da_inventario:
+                with st.expander("📦 Inventario notte per notte"):
+                    tab = disp.tabella(camere)
+                    st.dataframe(tab, hide_index=True, use_container_width=True,
+                                 column_config={"Notte": st.column_config.DateColumn(
+                                     "Notte", format="DD/MM/YYYY")})
+                    if tab["Sforamento"].any():
+                        st.warning(f"⛔ Capacità superata di {tab['Sforamento'].max()} camere "
+                                   "nella notte più critica: il gruppo non può essere bloccato.")
+                    elif v.verdetto == VERDETTI[0]:
+                        st.caption("Salvando la valutazione le camere vengono bloccate "
+                                   "nell'inventario.")
+
+            st.button("💾 Salva valutazione nel riepilogo", use_container_width=True,
+                      on_click=salva_valutazione, args=(v, "v2"))
+
+        # ---------- SENSIBILITÀ ----------
+        if seg and st.toggle("📈 Sensibilità tariffa × occupancy",
+                             help="Displacement e verdetto su tutta la griglia di tariffe e "
+                                  "livelli di occupancy, con gli altri parametri della richiesta "
+                                  "fissi."):
+            web_p = sog.medie["web"]
+            tariffe = np.linspace(min(0.4 * web_p, 0.8 * tariffa),
+                                  max(1.4 * web_p, 1.2 * tariffa), 200)
+            occ_ax = np.linspace(1, 100, 100)
+            scenari = {"Pick-up = occupancy": occ_ax,
+                       "Pick-up −15 pt": np.clip(occ_ax - 15, 0, 100),
+                       "Pick-up +15 pt": np.clip(occ_ax + 15, 0, 100),
+                       f"Pick-up fisso {pickup_web:.0f}%": np.full_like(occ_ax, pickup_web)}
+            base = RichiestaGruppo(check_in=check_in, check_out=check_out, camere=camere,
+                                   pax_cam=pax_cam, tariffa=tariffa, ancillare=ancillare,
+                                   allot_residuo=allot_residuo, util_allot=util_allot)
+            with PERF.fase("sensibilità"):
+                g = griglia_sensibilita(base, sog, s, tariffe, occ_ax,
+                                        np.stack(list(scenari.values())))
+            scenario = st.radio("Scenario pick-up WEB", list(scenari), horizontal=True)
+            i = list(scenari).index(scenario)
+
+            def sovrapposizioni(fig):
+                fig.add_trace(go.Scatter(x=g["tariffa_be"][i, :, 0], y=occ_ax, mode="lines",
+                                         name="Break-even (displ. = 0)",
+                                         line=dict(color="black", width=2)))
+                fig.add_trace(go.Scatter(x=g["soglia_bed"][0, :, 0], y=occ_ax, mode="lines",
+                                         name="Soglia ADR bed", line=dict(color=PRIM, dash="dash")))
+                fig.add_trace(go.Scatter(x=[tariffa], y=[occupancy], mode="markers",
+                                         name="Richiesta attuale",
+                                         marker=dict(symbol="star", size=14, color=ACCENT,
+                                                     line=dict(color="white", width=1))))
+                fig.update_layout(height=430, margin=dict(t=30, b=10, l=10, r=10),
+                                  xaxis_title="ADR bed proposta (€/pax/notte)",
+                                  yaxis_title="Occupancy attesa (%)",
+                                  xaxis_range=[tariffe[0], tariffe[-1]], yaxis_range=[1, 100],
+                                  legend=dict(orientation="h", y=-0.2))
+                grafico(fig)
+
+            t1, t2 = st.tabs(["Displacement netto", "Verdetto"])
+            with t1:
+                sovrapposizioni(go.Figure(go.Heatmap(
+                    x=tariffe, y=occ_ax, z=g["displacement"][i], colorscale="RdYlGn", zmid=0,
+                    colorbar=dict(title="€"),
+                    hovertemplate="ADR bed %{x:.0f} € · occ %{y:.0f}%<br>displ. %{z:,.0f} €"
+                                  "<extra></extra>")))
+            with t2:
+                sovrapposizioni(go.Figure(go.Heatmap(
+                    x=tariffe, y=occ_ax, z=g["esito"][i], zmin=0, zmax=2, showscale=False,
+                    colorscale=[[0, VERDE], [1 / 3, VERDE], [1 / 3, GIALLO], [2 / 3, GIALLO],
+                                [2 / 3, ROSSO], [1, ROSSO]],
+                    customdata=VERDETTI[g["esito"][i]],
+                    hovertemplate="ADR bed %{x:.0f} € · occ %{y:.0f}%<br>%{customdata}"
+                                  "<extra></extra>")))
+            st.caption(f"{len(tariffe)} tariffe × {len(occ_ax)} livelli di occupancy × "
+                       f"{len(scenari)} scenari calcolati in un solo passaggio. A destra della "
+                       "linea di break-even il gruppo crea valore; l'occupancy sposta anche la "
+                       "soglia ADR bed.")
+
+        # ---------- RISCHIO (MONTE CARLO) ----------
+        if seg and st.toggle("🎲 Rischio displacement (Monte Carlo)",
+                             help="Distribuzione del displacement campionando domanda WEB e "
+                                  "utilizzo allotment notte per notte invece dei soli valori "
+                                  "attesi."):
+            k1, k2 = st.columns(2)
+            n_scenari = k1.select_slider("Scenari", [10_000, 50_000, 100_000, 250_000], 100_000,
+                                         format_func=lambda n: f"{n:,}".replace(",", "."))
+            seme = k2.number_input("Seme generatore", 0, 1_000_000, 0, 1,
+                                   help="Stesso seme e stessi input → stessi risultati.")
+            richiesta_mc = RichiestaGruppo(check_in=check_in, check_out=check_out, camere=camere,
+                                           pax_cam=pax_cam, tariffa=tariffa, ancillare=ancillare,
+                                           allot_residuo=allot_residuo, occupancy=occupancy,
+                                           util_allot=util_allot, pickup_web=pickup_web)
+            domanda = modello_rischio()
+            with PERF.fase("Monte Carlo"):
+                mc = simula_displacement(richiesta_mc, sog, s, domanda, n_scenari, int(seme))
+            r1, r2, r3, r4 = st.columns(4)
+            r1.metric("P5 (scenario avverso)", eur(mc.p5))
+            r2.metric("P50 (mediana)", eur(mc.p50))
+            r3.metric("P95 (scenario favorevole)", eur(mc.p95))
+            r4.metric("Prob. distruzione di valore", f"{mc.prob_distruzione * 100:.1f}%")
+            conta, bordi = np.histogram(mc.campioni, bins=80)
+            centri = (bordi[:-1] + bordi[1:]) / 2
+            fig = go.Figure(go.Bar(x=centri, y=conta / mc.scenari * 100,
+                                   marker_color=np.where(centri < 0, ROSSO, VERDE),
+                                   hovertemplate="%{x:,.0f} €<br>%{y:.2f}% scenari"
+                                                 "<extra></extra>"))
+            for q, nome in ((mc.p5, "P5"), (mc.p50, "P50"), (mc.p95, "P95")):
+                fig.add_vline(x=q, line_dash="dot", line_color=PRIM, annotation_text=nome)
+            fig.update_layout(title="Distribuzione del displacement netto", bargap=0, height=340,
+                              xaxis_title="Displacement (€)", yaxis_title="% scenari",
+                              margin=dict(t=46, b=10, l=10, r=10))
+            grafico(fig)
+            fonte = (f"anni storici campionati: {mc.anni}" if mc.anni
+                     else "senza storico: variabilità attorno ai valori dei periodi")
+            st.caption(f"{mc.scenari:,} scenari in {mc.secondi * 1000:.0f} ms · {fonte} · "
+                       f"seme {mc.seme}.".replace(",", "."))
+
+        with st.expander("ℹ️ Metodologia di calcolo"):
+            st.markdown("""
 **Displacement a due livelli.** Le camere del gruppo entro l'allotment ALPI residuo e quelle
 che lo sforano hanno un costo-opportunità diverso:
 
@@ -640,11 +974,44 @@ che lo sforano hanno un costo-opportunità diverso:
   probabilità di pick-up*.
 
 Il **displacement netto** è il valore totale del gruppo (camere + ancillare) meno la somma
-delle due alternative attese.
+delle due alternative attese. Con l'inventario la ripartizione è fatta notte per notte
+sull'allotment residuo di ciascuna notte.
 
 **Soglia ADR bed** = percentuale della tariffa WEB del periodo, crescente con l'occupancy.
 **Controproposta** = la più alta tra la tariffa di break-even (displacement nullo) e la soglia.
 
 Tariffe, occupancy e utilizzo dell'allotment sono pre-compilati dai consuntivi caricati in
 «Dati storici» (mediana per le ADR, robusta agli errori di export), e restano modificabili.
+
+**Domanda notte per notte.** Con lo storico caricato ogni notte del soggiorno usa il proprio
+profilo (finestra di ±3 giorni su tutti gli anni) invece della media del periodo: un ponte o
+un evento dentro un periodo pesa solo sulle notti che tocca. Il valore atteso è la media,
+notte per notte, di *tariffa × probabilità*; se modifichi occupancy o utilizzo il profilo
+viene riscalato sul valore inserito.
+
+**Rischio (Monte Carlo).** Ogni scenario estrae un anno dello storico e, per ogni notte, un
+pick-up WEB e un utilizzo dell'allotment da una distribuzione Beta attorno al profilo di
+quell'anno (dispersione stimata dai giornalieri). P5 è il displacement che viene superato nel
+95% degli scenari; la probabilità di distruzione di valore è la quota di scenari sotto zero.
 """)
+finally:
+    # anche i rerun interrotti da st.stop() / st.rerun() finiscono nelle metriche
+    ripartizione = PERF.chiudi_run()
+
+
+# ------------------------------------------------------------------
+# PANNELLO PRESTAZIONI
+# ------------------------------------------------------------------
+if mostra_perf:
+    with pannello_perf:
+        if not PERF.attivo:
+            st.caption("Cronometri disattivati (VOI_PERF=0).")
+        else:
+            st.caption(f"Ultimo rerun · {pagina}")
+            st.dataframe(ripartizione, hide_index=True, use_container_width=True,
+                         column_config={"Chiamate": st.column_config.NumberColumn(format="%d"),
+                                        "ms": st.column_config.NumberColumn(format="%.1f")})
+            st.caption(f"Processo · p50/p95 sugli ultimi campioni · {PERF.percorso.name}")
+            st.dataframe(PERF.riepilogo(), hide_index=True, use_container_width=True,
+                         column_config={c: st.column_config.NumberColumn(format="%.1f")
+                                        for c in ("p50 ms", "p95 ms", "max ms")})
@@ -0,0 +1,73 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  helper condivisi delle app
+Callback e azioni Streamlit comuni alle due app (v1 e v2): export
+su richiesta, salvataggio nel registro, blocco delle camere nell'inventario e
+allineamento del libro notti alla sorgente dati.
+==================================================================
+"""
+
+import streamlit as st
+
+from voi_engine import VERDETTI
+from voi_export import esporta, formati, impronta_fogli
+from voi_inventario import INVENTARIO
+from voi_perf import PERF
+from voi_registro import REGISTRO
+from voi_sorgenti import SORGENTE, sincronizza
+
+
+def bottone_export(etichetta, fogli: dict, nome, chiave, scelte=None):
+    """Formato a scelta + download. L'export si scrive solo su richiesta e i byte
+    restano in sessione finché il contenuto dei fogli non cambia. ``scelte``: formati
+    offerti (default ``formati()``); con uno solo il selettore non compare."""
+    scelte = formati() if scelte is None else scelte
+    if len(scelte) > 1:
+        c1, c2 = st.columns([1, 3])
+        formato = c1.selectbox("Formato", scelte, key=f"formato_{chiave}",
+                               label_visibility="collapsed")
+    else:
+        c2, formato = st.container(), scelte[0]
+    firma = (formato, impronta_fogli(fogli))
+    cache = st.session_state.setdefault("export", {})
+    if chiave not in cache or cache[chiave][0] != firma:
+        if not c2.button(etichetta.replace("⬇️", "⚙️ Prepara:", 1), key=f"prepara_{chiave}",
+                         use_container_width=True):
+            return
+        with PERF.fase("export"):
+            cache[chiave] = (firma, esporta(fogli, formato, nome))
+    c2.download_button(etichetta, *cache[chiave][1], use_container_width=True)
+
+
+def salva_valutazione(v, app, messaggio="Valutazione salvata nel registro."):
+    """Callback del bottone «Salva»: riceve l'esito della run che lo ha mostrato
+    (alla run successiva il blocco «Valuta» non viene rieseguito). Un gruppo da
+    accettare trattiene le sue camere nell'inventario, se questo copre le date."""
+    id_valutazione = REGISTRO.registra(v, app)
+    st.toast(messaggio, icon="💾")
+    blocca_inventario(v, app, id_valutazione)
+
+
+def blocca_inventario(v, app, id_valutazione=None):
+    r = v.richiesta
+    if v.verdetto != VERDETTI[0] or not INVENTARIO.soggiorno(r.check_in, r.check_out).completa:
+        return
+    try:
+        INVENTARIO.blocca(r.nome, r.check_in, r.check_out, r.camere, app, id_valutazione)
+        st.toast(f"{r.camere} camere bloccate nell'inventario.", icon="📦")
+    except ValueError as e:
+        st.toast(f"Inventario non aggiornato: {e}", icon="⚠️")
+
+
+def aggiorna_da_sorgente(dal, al):
+    """Allinea il libro notti alla sorgente dati configurata (PMS / channel manager)
+    fra due date; la cache della sorgente evita una chiamata a ogni rerun."""
+    if SORGENTE is None:
+        return None
+    with PERF.fase("sorgente dati"):
+        lettura = sincronizza(INVENTARIO, dal, al, SORGENTE)
+    if lettura.errore:
+        quando = (f"snapshot del {lettura.aggiornato:%d/%m/%Y %H:%M}" if lettura.aggiornato
+                  else "nessuno snapshot disponibile")
+        st.warning(f"📡 {SORGENTE.nome} non raggiungibile ({quando}): {lettura.errore}")
+    return lettura
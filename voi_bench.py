@@ -0,0 +1,352 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  benchmark
+Export Scrigno sintetici e griglie periodi di dimensione a scelta;
+tempi delle fasi principali a più taglie, accodati a uno storico
+CSV locale (.voi_data/bench.csv) per seguirne l'andamento fra una
+versione e l'altra.
+==================================================================
+
+Headless, senza Streamlit:
+
+    python voi_bench.py                            # taglie piccola e media
+    python voi_bench.py --taglie grande --ripetizioni 5
+    python voi_bench.py --genera cartella --taglie media   # solo i file sintetici
+"""
+
+import argparse
+import io
+import os
+import platform
+import statistics
+import subprocess
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from voi_engine import (GIORNI_SETTIMANA, IndicePeriodi, RichiestaGruppo, analizza_soggiorno,
+                        valuta, valuta_batch)
+from voi_export import to_excel_bytes
+from voi_storico import (DATA_DIR, SETS, AggregatoreStorico, indicizza_stagione,
+                         leggi_file_storico, pulisci_storico, righe_periodo, valida_storico)
+
+# misure locali: fuori dal repository, accanto agli altri dati della macchina
+STORICO_BENCH = DATA_DIR / "bench.csv"
+SOGLIE = {"low": 0.70, "mid": 0.85, "high": 0.95, "auth": 35000}
+
+
+# ------------------------------------------------------------------
+# EXPORT SCRIGNO SINTETICI
+# ------------------------------------------------------------------
+# segmenti di ogni set: gli stessi nomi che ``indovina_set`` riconosce
+SEGMENTI_SET = {
+    "Totale": ["Diretti", "Web portali", "Alpitour individuali", "Gruppi", "TO vari",
+               "Agenzie", "Corporate"],
+    "Individuali (no Alpitour)": ["Diretti", "Web portali", "Agenzie", "Corporate"],
+    "Alpitour individuali": ["Alpitour individuali"],
+}
+CAMERE_HOTEL = 280
+
+
+def _stagionalita(giorni):
+    """0–1, picco a metà agosto, più un ritocco per venerdì e sabato."""
+    doy = giorni.dayofyear.to_numpy()
+    picco = np.exp(-((doy - 226) / 48.0) ** 2)
+    return picco + 0.04 * np.isin(giorni.dayofweek.to_numpy(), (4, 5))
+
+
+def genera_scrigno(anno, set_name="Totale", anomalie=0.01, seme=0):
+    """Export giornaliero Scrigno di un anno per un set: per ogni giorno un blocco
+    di righe segmento più la riga «Total», con le colonne extra dell'export vero.
+
+    Occupancy e ADR bed seguono la stagionalità; una quota ``anomalie`` delle
+    righe «Total» ha ADR a zero od occupancy oltre il 100% (da scartare).
+    """
+    rng = np.random.default_rng(seme)
+    giorni = pd.date_range(f"{anno}-01-01", f"{anno}-12-31")
+    segmenti = SEGMENTI_SET[set_name] + ["Total"]
+    n, k = len(giorni), len(segmenti)
+
+    s = _stagionalita(giorni)
+    quota = {"Totale": 1.0, "Individuali (no Alpitour)": 0.55, "Alpitour individuali": 0.2}
+    occ = np.clip((0.3 + 0.65 * s + rng.normal(0, 0.04, n)) * quota[set_name], 0, 1)
+    adr = (48 + 120 * s) * (0.8 if set_name == "Alpitour individuali" else 1.0)
+    adr = np.round(adr + rng.normal(0, 6, n), 2)
+    rn = np.round(occ * CAMERE_HOTEL)
+    difetti = rng.random(n) < anomalie
+    adr[difetti & (rng.random(n) < 0.5)] = 0.0
+    occ[difetti & (adr > 0)] = 1.4
+
+    # ripartizione delle camere fra i segmenti del blocco (la riga Total è la somma)
+    parti = rng.dirichlet(np.ones(k - 1), n) if k > 1 else np.ones((n, 0))
+    camere = np.column_stack([np.round(parti * rn[:, None]), rn])
+    occ_righe = np.column_stack([camere[:, :-1] / CAMERE_HOTEL, occ])
+    adr_righe = np.column_stack([adr[:, None] * rng.uniform(0.85, 1.15, (n, k - 1)), adr])
+    pax = np.round(camere * rng.uniform(2.0, 2.6, (n, k)))
+
+    giorno = [f"{GIORNI_SETTIMANA[d.dayofweek]} {d:%d/%m/%Y}" for d in giorni]
+    return pd.DataFrame({
+        "Giorno": np.repeat(giorno, k),
+        "Segmento": np.tile(segmenti, n),
+        "Camere": camere.ravel().astype(int),
+        "Room nights": camere.ravel().astype(int),
+        "Bed nights": pax.ravel().astype(int),
+        "ADR Room": np.round(adr_righe * 2.25, 2).ravel(),
+        "ADR Bed": np.round(adr_righe, 2).ravel(),
+        "% Occ.": np.round(occ_righe, 4).ravel(),
+        "Ricavo camere": np.round(adr_righe * pax, 2).ravel(),
+    })
+
+
+def file_scrigno(anni, sets=SETS, anomalie=0.01, seme=0):
+    """Nome file → byte .xlsx, un export per set e per anno."""
+    out = {}
+    for i, set_name in enumerate(sets):
+        for anno in anni:
+            df = genera_scrigno(anno, set_name, anomalie, seme + 1000 * i + anno)
+            out[f"scrigno_{set_name.split()[0].lower()}_{anno}.xlsx"] = to_excel_bytes(
+                {"Scrigno": df})
+    return out
+
+
+# ------------------------------------------------------------------
+# GRIGLIE PERIODI E RICHIESTE
+# ------------------------------------------------------------------
+def genera_periodi(n, stagioni=(2026,), seme=0):
+    """``n`` periodi per stagione che coprono aprile–ottobre, nel formato di
+    ``periodi_default``. Oltre i 214 giorni della stagione i periodi diventano di
+    una notte e si sovrappongono (vale il primo, come nel Setup)."""
+    rng = np.random.default_rng(seme)
+    righe = []
+    for anno in stagioni:
+        inizio, giorni = pd.Timestamp(f"{anno}-04-01"), 214
+        confini = np.floor(np.linspace(0, giorni, n + 1)).astype(int)
+        for i in range(n):
+            a = inizio + timedelta(days=int(min(confini[i], giorni - 1)))
+            b = inizio + timedelta(days=int(max(confini[i + 1] - 1, min(confini[i], giorni - 1))))
+            s = float(_stagionalita(pd.DatetimeIndex([a + (b - a) / 2]))[0])
+            web = round(60 + 100 * s + rng.normal(0, 3))
+            righe.append((str(anno), f"P{i + 1:03d}", a, b, int(rng.integers(1, 8)), web,
+                          round(web * 0.78), 200, round(min(99, 40 + 55 * s)),
+                          round(min(99, 20 + 70 * s))))
+    return pd.DataFrame(righe, columns=[
+        "Stagione", "Periodo", "Data inizio", "Data fine", "Min stay", "ADR bed WEB",
+        "ADR bed Alpitour", "Allotment ALPI", "Occupancy attesa %", "Utilizzo allotment %"])
+
+
+def genera_richieste(n, anno=2026, seme=0):
+    """Foglio RFP di ``n`` richieste con check-in in stagione e 1–14 notti."""
+    rng = np.random.default_rng(seme)
+    ci = pd.Timestamp(f"{anno}-04-01") + pd.to_timedelta(rng.integers(0, 200, n), unit="D")
+    return pd.DataFrame({
+        "Gruppo": [f"Gruppo {i + 1}" for i in range(n)],
+        "Check-in": ci,
+        "Check-out": ci + pd.to_timedelta(rng.integers(1, 15, n), unit="D"),
+        "Camere": rng.integers(5, 61, n),
+        "Pax/cam": np.round(rng.uniform(1.8, 3.0, n), 2),
+        "ADR bed": np.round(rng.uniform(55, 170, n)),
+        "Allotment residuo": rng.integers(0, 41, n),
+    })
+
+
+def _richieste_tipizzate(rfp):
+    return [RichiestaGruppo(check_in=a.date(), check_out=b.date(), camere=int(c), pax_cam=p,
+                            tariffa=t, allot_residuo=int(r))
+            for a, b, c, p, t, r in zip(rfp["Check-in"], rfp["Check-out"], rfp["Camere"],
+                                        rfp["Pax/cam"], rfp["ADR bed"], rfp["Allotment residuo"])]
+
+
+# ------------------------------------------------------------------
+# TAGLIE E FASI
+# ------------------------------------------------------------------
+@dataclass(slots=True)
+class Taglia:
+    anni: int           # anni di storico per set
+    sets: int           # set caricati (1–3)
+    periodi: int        # periodi della griglia
+    richieste: int      # richieste del foglio batch (le singole sono al più 500)
+
+
+TAGLIE = {
+    "piccola": Taglia(anni=1, sets=3, periodi=6, richieste=100),
+    "media": Taglia(anni=4, sets=3, periodi=30, richieste=1_000),
+    "grande": Taglia(anni=10, sets=3, periodi=200, richieste=10_000),
+}
+
+
+@dataclass(slots=True)
+class Misura:
+    taglia: str
+    fase: str
+    n: int              # operazioni per ripetizione (file, periodi, richieste…)
+    min_s: float
+    mediana_s: float
+    ripetizioni: int
+
+
+def misura(funzione, ripetizioni):
+    """Secondi di ogni ripetizione, dopo un giro di riscaldamento."""
+    funzione()
+    tempi = []
+    for _ in range(ripetizioni):
+        t0 = time.perf_counter()
+        funzione()
+        tempi.append(time.perf_counter() - t0)
+    return tempi
+
+
+def fasi(taglia, seme=0):
+    """Prepara i dati di una taglia; ritorna [(fase, n, funzione)] da cronometrare."""
+    anni = list(range(2026 - taglia.anni, 2026))
+    sets = SETS[:taglia.sets]
+    files = file_scrigno(anni, sets, seme=seme)
+    per_set = {s: [n for n in files if n.startswith(f"scrigno_{s.split()[0].lower()}_")]
+               for s in sets}
+    daily = {n: leggi_file_storico(io.BytesIO(b))[0] for n, b in files.items()}
+    storico = {s: valida_storico({n: daily[n] for n in nomi}).pulito
+               for s, nomi in per_set.items()}
+    uniti = {s: pd.concat([daily[n] for n in nomi], ignore_index=True)
+             for s, nomi in per_set.items()}
+    base = indicizza_stagione(uniti[sets[0]])
+
+    periodi = genera_periodi(taglia.periodi, seme=seme)
+    spostati = periodi.copy()      # stessa griglia con una riga dalle date cambiate
+    spostati.loc[0, "Data fine"] += timedelta(days=1)
+    indice = IndicePeriodi(periodi)
+    rfp = genera_richieste(taglia.richieste, seme=seme)
+    singole = _richieste_tipizzate(rfp.head(500))
+    incrementale = AggregatoreStorico()
+    incrementale.applica(periodi, storico)
+    turno = [0]
+
+    def leggi():
+        for b in files.values():
+            leggi_file_storico(io.BytesIO(b))
+
+    def pulisci():
+        for df in uniti.values():
+            pulisci_storico(df)
+
+    def righe():
+        for a, b in zip(periodi["Data inizio"], periodi["Data fine"]):
+            righe_periodo(base, a, b)
+
+    def elabora():
+        pulito = {s: valida_storico({n: daily[n] for n in nomi}).pulito
+                  for s, nomi in per_set.items()}
+        AggregatoreStorico().applica(periodi, pulito)
+
+    def elabora_incrementale():
+        # alterna le due griglie: a ogni giro cambia una sola riga
+        turno[0] ^= 1
+        incrementale.applica(spostati if turno[0] else periodi, storico, solo_cambiate=True)
+
+    def soggiorni():
+        for r in singole:
+            analizza_soggiorno(indice, r.check_in, r.check_out)
+
+    def valutazioni():
+        for r in singole:
+            valuta(indice, r, SOGLIE)
+
+    return [
+        ("leggi_file_storico", len(files), leggi),
+        ("pulisci_storico", len(uniti), pulisci),
+        ("righe_periodo", len(periodi), righe),
+        ("elabora", len(periodi), elabora),
+        ("elabora_incrementale", 1, elabora_incrementale),
+        ("analizza_soggiorno", len(singole), soggiorni),
+        ("valuta", len(singole), valutazioni),
+        ("valuta_batch", len(rfp), lambda: valuta_batch(indice, rfp, SOGLIE)),
+    ]
+
+
+def esegui(taglie, ripetizioni=5, seme=0, avanzamento=print):
+    out = []
+    for nome in taglie:
+        t0 = time.perf_counter()
+        casi = fasi(TAGLIE[nome], seme)
+        avanzamento(f"{nome}: dati sintetici pronti in {time.perf_counter() - t0:.1f} s")
+        for fase, n, funzione in casi:
+            tempi = misura(funzione, ripetizioni)
+            out.append(Misura(nome, fase, n, min(tempi), statistics.median(tempi), ripetizioni))
+            avanzamento(f"  {fase:<22} {statistics.median(tempi) * 1000:9.1f} ms")
+    return out
+
+
+# ------------------------------------------------------------------
+# STORICO RISULTATI
+# ------------------------------------------------------------------
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def ambiente():
+    """Colonne che identificano la macchina e la versione misurate."""
+    return {"quando": datetime.now().isoformat(timespec="seconds"), "commit": _commit(),
+            "python": platform.python_version(), "pandas": pd.__version__,
+            "macchina": platform.node(), "cpu": os.cpu_count()}
+
+
+def salva(misure, percorso=STORICO_BENCH):
+    """Accoda le misure allo storico CSV e ritorna il confronto con l'ultima
+    misura precedente della stessa macchina (taglia × fase)."""
+    percorso, env = Path(percorso), ambiente()
+    nuove = pd.DataFrame([{**env, "taglia": m.taglia, "fase": m.fase, "n": m.n,
+                           "min_s": round(m.min_s, 6), "mediana_s": round(m.mediana_s, 6),
+                           "ripetizioni": m.ripetizioni} for m in misure])
+    prima = pd.read_csv(percorso) if percorso.exists() else nuove.iloc[:0]
+    percorso.parent.mkdir(parents=True, exist_ok=True)
+    nuove.to_csv(percorso, mode="a", header=not percorso.exists(), index=False)
+
+    stessa = prima[prima["macchina"] == platform.node()]
+    ultime = stessa.groupby(["taglia", "fase"])["mediana_s"].last()
+    cfr = nuove[["taglia", "fase", "n", "mediana_s"]].join(
+        ultime.rename("precedente_s"), on=["taglia", "fase"])
+    cfr["variazione %"] = (cfr["mediana_s"] / cfr["precedente_s"] - 1) * 100
+    return cfr
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark headless del VOI Group Toolkit.")
+    ap.add_argument("--taglie", nargs="+", choices=list(TAGLIE), default=["piccola", "media"])
+    ap.add_argument("--ripetizioni", type=int, default=5)
+    ap.add_argument("--seme", type=int, default=0)
+    ap.add_argument("--storico", default=str(STORICO_BENCH),
+                    help="CSV a cui accodare i risultati.")
+    ap.add_argument("--non-salvare", action="store_true", help="Non aggiorna lo storico.")
+    ap.add_argument("--genera", metavar="CARTELLA",
+                    help="Scrive solo gli export Scrigno sintetici delle taglie scelte.")
+    a = ap.parse_args(argv)
+
+    if a.genera:
+        cartella = Path(a.genera)
+        cartella.mkdir(parents=True, exist_ok=True)
+        for nome in a.taglie:
+            t = TAGLIE[nome]
+            for f, dati in file_scrigno(range(2026 - t.anni, 2026), SETS[:t.sets],
+                                        seme=a.seme).items():
+                (cartella / f).write_bytes(dati)
+            genera_periodi(t.periodi, seme=a.seme).to_excel(cartella / f"periodi_{nome}.xlsx",
+                                                           index=False)
+        print(f"File sintetici in {cartella}")
+        return
+
+    misure = esegui(a.taglie, a.ripetizioni, a.seme)
+    if a.non_salvare:
+        return
+    cfr = salva(misure, a.storico)
+    print(f"\nRisultati accodati a {a.storico}\n")
+    print(cfr.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
+
+
+if __name__ == "__main__":
+    main()
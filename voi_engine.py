@@ -0,0 +1,999 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  motore di calcolo condiviso
+Indice periodi, scomposizione soggiorni, displacement a due livelli,
+soglia ADR bed, controproposta e check semaforo.
+Nessuna dipendenza da Streamlit / Plotly / openpyxl: importabile da
+script, batch e benchmark.
+==================================================================
+"""
+
+import re
+from dataclasses import dataclass, field
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+GIORNO_NS = 86_400 * 10**9
+
+
+# ------------------------------------------------------------------
+# FORMATO
+# ------------------------------------------------------------------
+def eur(x):
+    """Formato valuta italiano: 1.234 €"""
+    try:
+        return f"{x:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
+    except Exception:
+        return "—"
+
+
+def eur2(x):
+    try:
+        return f"{x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
+    except Exception:
+        return "—"
+
+
+# ------------------------------------------------------------------
+# PERIODI DEMO
+# ------------------------------------------------------------------
+def periodi_default():
+    rows = [
+        ("Apertura / Bassa", date(2026, 5, 23), date(2026, 6, 6),  3,  64,  52, 200, 35, 10),
+        ("Bassa Giugno",     date(2026, 6, 7),  date(2026, 6, 27), 3,  86,  67, 200, 82, 47),
+        ("Media Luglio",     date(2026, 6, 28), date(2026, 8, 1),  7, 105,  86, 200, 93, 78),
+        ("Alta Agosto",      date(2026, 8, 2),  date(2026, 8, 22), 7, 150, 113, 200, 93, 80),
+        ("Spalla Settembre", date(2026, 8, 23), date(2026, 9, 12), 5,  95,  78, 200, 75, 45),
+        ("Chiusura",         date(2026, 9, 13), date(2026, 9, 27), 3,  70,  66, 200, 64, 42),
+    ]
+    cols = ["Periodo", "Data inizio", "Data fine", "Min stay",
+            "ADR bed WEB", "ADR bed Alpitour", "Allotment ALPI",
+            "Occupancy attesa %", "Utilizzo allotment %"]
+    df = pd.DataFrame(rows, columns=cols)
+    df["Data inizio"] = pd.to_datetime(df["Data inizio"])
+    df["Data fine"] = pd.to_datetime(df["Data fine"])
+    df.insert(0, "Stagione", "2026")
+    return df
+
+
+# ------------------------------------------------------------------
+# VARIAZIONI PER GIORNO DELLA SETTIMANA
+# ------------------------------------------------------------------
+GIORNI_SETTIMANA = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
+COLONNE_VARIAZIONI = ["Stagione", "Periodo", "Giorni", "Colonna", "Variazione %", "Valore"]
+TUTTE_LE_TARIFFE = "Tutte le tariffe"
+
+
+def variazioni_vuote():
+    """Foglio variazioni senza righe (nessuna differenza fra i giorni)."""
+    return pd.DataFrame({c: pd.Series(dtype=float if c in ("Variazione %", "Valore") else object)
+                         for c in COLONNE_VARIAZIONI})
+
+
+def stagioni(periodi):
+    """Stagione di ogni periodo: colonna «Stagione» se valorizzata, altrimenti l'anno
+    della data di inizio (i fogli a stagione unica restano validi)."""
+    anno = pd.to_datetime(periodi["Data inizio"], errors="coerce").dt.year
+    anno = anno.astype("Int64").astype(str).replace("<NA>", "")
+    if "Stagione" not in periodi.columns:
+        return anno
+    testo = periodi["Stagione"].astype("string").fillna("").str.strip()
+    return testo.where(testo != "", anno)
+
+
+def maschera_giorni(testo):
+    """«Ven,Sab», «Lun-Gio», «Sab Dom»; vuoto o «tutti» = tutta la settimana."""
+    testo = "" if testo is None or pd.isna(testo) else str(testo).strip().lower()
+    m = np.zeros(7, dtype=bool)
+    if testo in ("", "tutti", "tutta la settimana"):
+        m[:] = True
+        return m
+    codici = [g.lower() for g in GIORNI_SETTIMANA]
+    for parte in filter(None, re.split(r"[,;/\s]+", testo)):
+        estremi = parte.split("-")
+        if len(estremi) > 2 or any(e[:3] not in codici for e in estremi):
+            raise ValueError(f"Giorno non riconosciuto: «{parte}»")
+        a, b = codici.index(estremi[0][:3]), codici.index(estremi[-1][:3])
+        m[np.arange(a, a + (b - a) % 7 + 1) % 7] = True
+    return m
+
+
+def leggi_periodi(file):
+    """Periodi e variazioni da un export Excel (fogli «Periodi» e «Variazioni»).
+
+    I file a foglio unico delle versioni precedenti restano validi: si legge il
+    primo foglio e le variazioni sono vuote.
+    """
+    fogli = pd.read_excel(file, sheet_name=None)
+    per = fogli.get("Periodi", next(iter(fogli.values())))
+    per["Data inizio"] = pd.to_datetime(per["Data inizio"])
+    per["Data fine"] = pd.to_datetime(per["Data fine"])
+    if "Stagione" in per.columns:
+        per["Stagione"] = per["Stagione"].map(_testo)
+    var = fogli.get("Variazioni")
+    if var is None:
+        return per, variazioni_vuote()
+    var = var.reindex(columns=COLONNE_VARIAZIONI)
+    for c in ("Stagione", "Periodo", "Giorni", "Colonna"):
+        var[c] = var[c].map(_testo)
+    return per, var
+
+
+def _testo(x):
+    """Cella Excel → testo («2026» e non «2026.0»); vuoto se mancante."""
+    if x is None or pd.isna(x):
+        return ""
+    if isinstance(x, float) and x.is_integer():
+        return str(int(x))
+    return str(x).strip()
+
+
+def giorno_settimana(giorni):
+    """Ordinali giorno → giorno della settimana (0 = lunedì; il 1970-01-01 è giovedì)."""
+    return (np.asarray(giorni, dtype=np.int64) + 3) % 7
+
+
+# ------------------------------------------------------------------
+# INDICE PERIODI
+# ------------------------------------------------------------------
+def impronta_periodi(periodi, variazioni=None):
+    """Impronta del contenuto dei periodi (e delle variazioni): cambia solo se
+    cambia la griglia."""
+    if periodi is None or periodi.empty:
+        return 0
+    h = pd.util.hash_pandas_object(periodi.astype(str), index=False).to_numpy()
+    if variazioni is None or variazioni.empty:
+        return hash((tuple(periodi.columns), h.tobytes()))
+    v = pd.util.hash_pandas_object(variazioni.astype(str), index=False).to_numpy()
+    return hash((tuple(periodi.columns), h.tobytes(), v.tobytes()))
+
+
+def _giorni(valori):
+    """Date → ordinale giorno (int64, giorni dal 1970-01-01)."""
+    d = pd.to_datetime(pd.Series(valori), errors="coerce").to_numpy("datetime64[ns]")
+    return d.astype("datetime64[D]").astype(np.int64)
+
+
+class IndicePeriodi:
+    """Indice compilato della griglia periodi (anche su più stagioni).
+
+    Gli estremi dei periodi sono ridotti a confini elementari ordinati; per ogni
+    tratto fra due confini si tiene la posizione del primo periodo (in ordine di
+    tabella) che lo copre. Una ricerca ``searchsorted`` risolve così un intero
+    soggiorno con la stessa regola «vince il primo» di ``match_periodo``.
+
+    Le ``variazioni`` per giorno della settimana (vedi ``COLONNE_VARIAZIONI``)
+    sono compilate in tensori periodo × giorno × colonna: fattore moltiplicativo
+    e valore assoluto (NaN = nessuno). Vale la riga più specifica (stagione <
+    periodo < stagione + periodo); a parità, la prima in tabella.
+    """
+
+    __slots__ = ("periodi", "impronta", "confini", "vincitore", "sovrapposizioni",
+                 "codici", "nomi", "variazioni", "scartate", "_matrici", "_tensori")
+
+    def __init__(self, periodi, impronta=None, variazioni=None):
+        self.periodi = periodi.reset_index(drop=True)
+        self.impronta = impronta_periodi(periodi, variazioni) if impronta is None else impronta
+        self.codici, self.nomi = pd.factorize(self.periodi["Periodo"].to_numpy(),
+                                              use_na_sentinel=False)
+        self._matrici = {}
+        self._tensori = {}
+        self.variazioni, self.scartate = self._compila_variazioni(variazioni)
+
+        di = pd.to_datetime(self.periodi["Data inizio"], errors="coerce").to_numpy("datetime64[ns]")
+        dfi = pd.to_datetime(self.periodi["Data fine"], errors="coerce").to_numpy("datetime64[ns]")
+        ok = ~(np.isnat(di) | np.isnat(dfi))
+        pos = np.flatnonzero(ok)
+        # la notte g (mezzanotte) rientra se inizio <= g <= fine
+        ns_i = di[ok].astype(np.int64)
+        ns_f = dfi[ok].astype(np.int64)
+        ini = -((-ns_i) // GIORNO_NS)
+        fin = ns_f // GIORNO_NS
+        valido = fin >= ini
+        pos, ini, fin = pos[valido], ini[valido], fin[valido]
+
+        self.confini = np.unique(np.concatenate([ini, fin + 1]))
+        if len(self.confini):
+            copre = ((ini[:, None] <= self.confini[None, :]) &
+                     (fin[:, None] >= self.confini[None, :]))
+            cand = np.where(copre, pos[:, None], np.iinfo(np.int64).max)
+            vinc = cand.min(axis=0) if len(pos) else np.full(len(self.confini), -1)
+            vinc[vinc == np.iinfo(np.int64).max] = -1
+            self.vincitore = vinc.astype(np.int64)
+        else:
+            self.vincitore = np.empty(0, dtype=np.int64)
+
+        ordine = np.argsort(ini, kind="stable")
+        a, b = ini[ordine], fin[ordine]
+        fine_max = np.maximum.accumulate(b) if len(b) else b
+        sov = np.flatnonzero(a[1:] <= fine_max[:-1]) + 1 if len(a) > 1 else np.empty(0, int)
+        self.sovrapposizioni = [int(pos[ordine][i]) for i in sov]
+
+    def cerca(self, giorni):
+        """Posizione del periodo per ogni giorno (array), -1 se fuori griglia."""
+        g = np.asarray(giorni)
+        if g.dtype.kind != "i":
+            g = _giorni(g)
+        if not len(self.confini):
+            return np.full(g.shape, -1, dtype=np.int64)
+        k = np.searchsorted(self.confini, g, side="right") - 1
+        out = np.where(k >= 0, self.vincitore[np.clip(k, 0, None)], -1)
+        return out.astype(np.int64)
+
+    def matrice(self, colonne):
+        """Valori numerici dei periodi (righe × colonne), compilati una volta."""
+        chiave = tuple(colonne)
+        m = self._matrici.get(chiave)
+        if m is None:
+            m = self._matrici[chiave] = np.column_stack(
+                [pd.to_numeric(self.periodi[c], errors="coerce").to_numpy(float)
+                 for c in chiave]) if chiave else np.empty((len(self.periodi), 0))
+        return m
+
+    def _compila_variazioni(self, variazioni):
+        """Righe valide come (righe periodo, giorni, colonne, fattore, valore), dalla meno
+        alla più specifica; ritorna anche gli indici delle righe scartate."""
+        if variazioni is None or variazioni.empty:
+            return [], []
+        stag = stagioni(self.periodi).to_numpy()
+        nomi = self.periodi["Periodo"].astype(str).to_numpy()
+        tariffe = [c for c in self.periodi.columns if str(c).startswith("ADR bed")]
+        regole, scartate = [], []
+        for i, v in enumerate(variazioni.reset_index(drop=True).to_dict("records")):
+            try:
+                giorni = maschera_giorni(v.get("Giorni"))
+            except ValueError:
+                scartate.append(i)
+                continue
+            col = str(v.get("Colonna") or "").strip()
+            colonne = tariffe if col in ("", TUTTE_LE_TARIFFE) else [col]
+            fattore = 1 + (0.0 if pd.isna(v.get("Variazione %")) else v["Variazione %"]) / 100
+            valore = np.nan if pd.isna(v.get("Valore")) else float(v["Valore"])
+            s_, p_ = (str(v.get(k) or "").strip() for k in ("Stagione", "Periodo"))
+            righe = np.ones(len(self.periodi), dtype=bool)
+            if s_:
+                righe &= stag == s_
+            if p_:
+                righe &= nomi == p_
+            if any(c not in self.periodi.columns for c in colonne) or not righe.any():
+                scartate.append(i)
+                continue
+            specificita = (2 if p_ else 0) + (1 if s_ else 0)
+            regole.append((specificita, -i, righe, giorni, colonne, fattore, valore))
+        regole.sort(key=lambda x: x[:2])
+        return [x[2:] for x in regole], scartate
+
+    def tensori(self, colonne):
+        """(fattore, valore) periodo × giorno × colonna per le colonne indicate, o None
+        se nessuna variazione le riguarda."""
+        chiave = tuple(colonne)
+        if chiave not in self._tensori:
+            fattore = np.ones((len(self.periodi), 7, len(chiave)))
+            valore = np.full(fattore.shape, np.nan)
+            tocca = False
+            for righe, giorni, cols, f, v in self.variazioni:
+                for j, c in enumerate(chiave):
+                    if c in cols:
+                        blocco = np.ix_(righe, giorni, [j])
+                        fattore[blocco], valore[blocco] = f, v
+                        tocca = True
+            self._tensori[chiave] = (fattore, valore) if tocca else None
+        return self._tensori[chiave]
+
+    def applica_variazioni(self, valori, righe, giorni, colonne):
+        """Valori notte per notte (N × colonne) con le variazioni del giorno della settimana."""
+        t = self.tensori(colonne)
+        if t is None or not len(righe):
+            return valori
+        g = giorno_settimana(giorni)
+        fattore, assoluto = t[0][righe, g], t[1][righe, g]
+        return np.where(np.isnan(assoluto), valori * fattore, assoluto)
+
+    def tariffe(self, inizio, fine, colonne):
+        """Calendario notte per notte fra due date (incluse): una riga per notte con
+        periodo, stagione, giorno della settimana e valori già variati."""
+        giorni = np.arange(_giorni([inizio])[0], _giorni([fine])[0] + 1, dtype=np.int64)
+        pos = self.cerca(giorni)
+        ok = pos >= 0
+        giorni, pos = giorni[ok], pos[ok]
+        colonne = list(colonne)
+        valori = self.applica_variazioni(self.matrice(colonne)[pos], pos, giorni, colonne)
+        out = pd.DataFrame(valori, columns=colonne)
+        out.insert(0, "Notte", giorni.astype("datetime64[D]"))
+        out.insert(1, "Giorno", np.asarray(GIORNI_SETTIMANA)[giorno_settimana(giorni)])
+        out.insert(2, "Stagione", stagioni(self.periodi).to_numpy()[pos])
+        out.insert(3, "Periodo", self.periodi["Periodo"].to_numpy()[pos])
+        return out
+
+
+def match_periodo(periodi, giorno, indice=None):
+    """Periodo (riga) che contiene il giorno, oppure None."""
+    if indice is None:
+        indice = IndicePeriodi(periodi)
+    p = int(indice.cerca([pd.Timestamp(giorno)])[0])
+    return None if p < 0 else indice.periodi.iloc[p]
+
+
+def notti_soggiorno(check_in, check_out):
+    """Array degli ordinali giorno delle notti del soggiorno."""
+    start = pd.Timestamp(check_in).to_datetime64().astype("datetime64[D]").astype(np.int64)
+    n = (pd.Timestamp(check_out) - pd.Timestamp(check_in)).days
+    return start + np.arange(max(n, 0), dtype=np.int64)
+
+
+# ------------------------------------------------------------------
+# SCOMPOSIZIONE SOGGIORNO
+# ------------------------------------------------------------------
+CAMPI_INTERI = ("min", "allot")
+# tariffa × probabilità notte per notte, per il valore atteso dell'alternativa
+PRODOTTI = (("alpi", "util"), ("web", "occ"))
+
+
+# chiavi di domanda che il calendario storico sovrappone notte per notte: tariffe,
+# MLOS e allotment restano quelli del Setup
+CHIAVI_DOMANDA = ("occ", "util")
+
+
+def _valori_notte(indice, per_notte, righe, giorni, chiavi, colonne, calendario):
+    """Valori notte per notte: domanda dal calendario dove nota, poi le variazioni per
+    giorno della settimana (anche sopra lo storico), poi i prodotti tariffa × probabilità.
+    Ritorna il dict dei valori e il numero di notti con domanda dallo storico."""
+    sostituite = 0
+    if calendario is not None and len(giorni):
+        per_notte = per_notte.copy()
+        for k, v in calendario.per_notte(giorni).items():
+            if k in CHIAVI_DOMANDA and k in chiavi:
+                j = chiavi.index(k)
+                noto = ~np.isnan(v)
+                per_notte[:, j] = np.where(noto, v, per_notte[:, j])
+                sostituite = max(sostituite, int(noto.sum()))
+    per_notte = indice.applica_variazioni(per_notte, righe, giorni,
+                                          [colonne[k] for k in chiavi])
+    valori = {k: per_notte[:, j] for j, k in enumerate(chiavi)}
+    for a, b in PRODOTTI:
+        if a in valori and b in valori:
+            valori[f"{a}*{b}"] = valori[a] * valori[b]
+    return valori, sostituite
+
+
+@dataclass(slots=True)
+class Soggiorno:
+    """Scomposizione di un soggiorno sui periodi: medie pesate per notte e vista ``seg``."""
+    notti: int
+    nomatch: int
+    giorni: np.ndarray
+    valori: dict
+    medie: dict
+    min_stay: int
+    seg: dict
+    da_calendario: int = 0
+
+    @property
+    def notti_valide(self):
+        return len(self.giorni)
+
+
+def scomponi_soggiorno(indice, giorni, colonne, calendario=None):
+    """Assegna le notti ai periodi e ne ricava in un passaggio le grandezze pesate.
+
+    ``colonne`` mappa una chiave breve sulla colonna dei periodi (es. ``{"web":
+    "ADR bed WEB"}``); la chiave ``"min"`` è il MLOS. Se più righe condividono il
+    nome del periodo valgono i valori della prima notte incontrata, come nella
+    vista ``seg`` originale. Con un ``calendario`` (vedi
+    ``voi_storico.CalendarioDomanda``) occupancy e utilizzo allotment
+    (``CHIAVI_DOMANDA``) sono presi notte per notte dallo storico; le tariffe
+    restano quelle dei periodi. Le variazioni per giorno della settimana dell'indice
+    si applicano dopo il calendario; la vista ``seg`` resta sui valori dei periodi.
+    """
+    giorni = np.asarray(giorni, dtype=np.int64)
+    pos = indice.cerca(giorni)
+    ok = pos >= 0
+    giorni, pos = giorni[ok], pos[ok]
+    chiavi = list(colonne)
+    mat = indice.matrice([colonne[k] for k in chiavi])
+
+    codici = indice.codici[pos]
+    uniq, primi, inv, conta = np.unique(codici, return_index=True,
+                                        return_inverse=True, return_counts=True)
+    ordine = np.argsort(primi, kind="stable")
+    rappr = pos[primi]
+    per_notte = mat[rappr][inv] if len(pos) else np.empty((0, len(chiavi)))
+    valori, da_cal = _valori_notte(indice, per_notte, rappr[inv], giorni, chiavi, colonne,
+                                   calendario)
+    medie = {k: float(v.mean()) if len(v) else 0.0 for k, v in valori.items()}
+    min_stay = int(valori["min"].max()) if "min" in valori and len(pos) else 0
+
+    seg = {}
+    for o in ordine:
+        riga = mat[rappr[o]]
+        voce = {"notti": int(conta[o])}
+        for j, k in enumerate(chiavi):
+            voce[k] = int(riga[j]) if k in CAMPI_INTERI else float(riga[j])
+        seg[indice.nomi[uniq[o]]] = voce
+    return Soggiorno(notti=int(ok.size), nomatch=int((~ok).sum()), giorni=giorni,
+                     valori=valori, medie=medie, min_stay=min_stay, seg=seg,
+                     da_calendario=da_cal)
+
+
+COLONNE_SOGGIORNO = {"web": "ADR bed WEB", "alpi": "ADR bed Alpitour",
+                     "allot": "Allotment ALPI", "occ": "Occupancy attesa %",
+                     "util": "Utilizzo allotment %", "min": "Min stay"}
+
+
+def analizza_soggiorno(indice, check_in, check_out, colonne=COLONNE_SOGGIORNO, calendario=None):
+    """Assegna ogni notte al periodo: medie pesate, MLOS, segmenti e notti orfane."""
+    return scomponi_soggiorno(indice, notti_soggiorno(check_in, check_out), colonne, calendario)
+
+
+def scomponi_soggiorni(indice, inizio, notti, colonne, calendario=None):
+    """Versione colonnare di ``scomponi_soggiorno`` per molte richieste insieme.
+
+    ``inizio`` e ``notti`` sono array (ordinale del check-in, numero di notti).
+    Tutte le notti di tutte le richieste sono risolte con una sola ricerca
+    nell'indice e poi riaggregate per richiesta. Ritorna un dict di array per
+    richiesta: ``nv``, ``nomatch``, ``min`` (MLOS più restrittivo) e la media
+    pesata di ogni chiave di ``colonne``.
+    """
+    inizio = np.asarray(inizio, dtype=np.int64)
+    notti = np.clip(np.asarray(notti, dtype=np.int64), 0, None)
+    r = len(inizio)
+    riga = np.repeat(np.arange(r), notti)
+    base = np.repeat(np.cumsum(notti) - notti, notti)
+    giorni = inizio[riga] + (np.arange(len(riga)) - base)
+
+    pos = indice.cerca(giorni)
+    ok = pos >= 0
+    riga, pos = riga[ok], pos[ok]
+    chiavi = list(colonne)
+    mat = indice.matrice([colonne[k] for k in chiavi])
+
+    # stessa regola della vista seg: per (richiesta, nome periodo) vale la prima notte
+    chiave = riga * max(len(indice.nomi), 1) + indice.codici[pos]
+    _, primi, inv = np.unique(chiave, return_index=True, return_inverse=True)
+    per_notte = mat[pos[primi]][inv] if len(pos) else np.empty((0, len(chiavi)))
+    valori, _ = _valori_notte(indice, per_notte, pos[primi][inv], giorni[ok], chiavi, colonne,
+                              calendario)
+
+    nv = np.bincount(riga, minlength=r)
+    out = {"nv": nv, "nomatch": notti - nv}
+    for k, v in valori.items():
+        somma = np.bincount(riga, weights=v, minlength=r)
+        out[k] = np.where(nv > 0, somma / np.maximum(nv, 1), 0.0)
+    if "min" in colonne:
+        mlos = np.full(r, -np.inf)
+        np.maximum.at(mlos, riga, valori["min"])
+        out["min"] = np.where(nv > 0, mlos, 0).astype(np.int64)
+    return out
+
+
+# ------------------------------------------------------------------
+# VALUTAZIONE (scalare o colonnare)
+# ------------------------------------------------------------------
+VERDE, GIALLO, ROSSO = 0, 1, 2
+STATI = np.array(["verde", "giallo", "rosso"])
+VERDETTI = np.array(["ACCETTARE", "VALUTARE — CONTROPROPOSTA CONSIGLIATA",
+                     "RIFIUTARE O RINEGOZIARE"])
+
+
+def pct_soglia(occ, low, mid, high):
+    """Percentuale della tariffa WEB richiesta, crescente con l'occupancy."""
+    return np.where(occ < 60, low, np.where(occ < 80, mid, high))
+
+
+def valore_atteso(tariffa_w, prob, prodotto_w=None, prob_w=None):
+    """€/bed-night attesi dall'alternativa (probabilità in 0–100).
+
+    Con il profilo notte per notte (``prodotto_w`` = media di tariffa × probabilità,
+    ``prob_w`` = media della probabilità) il valore segue le singole notti; se
+    l'analista modifica la probabilità, il profilo è riscalato in proporzione.
+    Senza profilo vale tariffa media × probabilità.
+    """
+    if prodotto_w is None or prob_w is None:
+        return tariffa_w * np.asarray(prob) / 100
+    prob_w = np.asarray(prob_w, dtype=float)
+    con_profilo = prob_w > 0
+    return np.where(con_profilo, prodotto_w * prob / np.where(con_profilo, prob_w, 1),
+                    tariffa_w * prob) / 100
+
+
+def valuta_displacement(camere, pax_cam, notti, nv, min_stay, tariffa, ancillare,
+                        allot_residuo, web, atteso_allot, atteso_web, occupancy, soglie,
+                        per_notte=False):
+    """Displacement a due livelli, soglia ADR bed, controproposta e i quattro check.
+
+    Tutti gli argomenti possono essere scalari o array della stessa lunghezza
+    (una riga per richiesta). ``atteso_allot`` e ``atteso_web`` sono i €/bed-night
+    attesi dall'alternativa sui due livelli (vedi ``valore_atteso``); l'occupancy
+    è in 0–100. Con ``per_notte`` l'ultimo asse di ``allot_residuo`` (e dei valori
+    attesi, se lo hanno) è quello delle notti valide: la ripartizione entro/oltre
+    allotment è fatta notte per notte e ``camere_allot``/``camere_over`` sono quelle
+    della notte più critica. Ritorna un dict di array con volumi, valori, break-even
+    e stato (0 verde, 1 giallo, 2 rosso) di ciascun check più il verdetto complessivo.
+    """
+    camere, pax_cam, nv = (np.asarray(x, dtype=float) for x in (camere, pax_cam, nv))
+    pax = camere * pax_cam
+    bed_nights = pax * nv
+    rev_camere = bed_nights * tariffa
+    rev_anc = bed_nights * ancillare
+    rev_totale = rev_camere + rev_anc
+
+    if per_notte:
+        entro = np.minimum(camere[..., None], allot_residuo)
+        oltre = camere[..., None] - entro
+        camere_allot, camere_over = entro.min(axis=-1), oltre.max(axis=-1)
+        rev_alt_allot = pax_cam * (entro * atteso_allot).sum(axis=-1)
+        rev_alt_web = pax_cam * (oltre * atteso_web).sum(axis=-1)
+    else:
+        camere_allot = np.minimum(camere, allot_residuo)
+        camere_over = np.maximum(0, camere - allot_residuo)
+        rev_alt_allot = camere_allot * pax_cam * nv * atteso_allot
+        rev_alt_web = camere_over * pax_cam * nv * atteso_web
+    rev_alt = rev_alt_allot + rev_alt_web
+    displacement = rev_totale - rev_alt
+
+    pct = pct_soglia(np.asarray(occupancy), soglie["low"], soglie["mid"], soglie["high"])
+    soglia_bed = web * pct
+    denom = camere * pax_cam * nv
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tariffa_be = np.where(denom > 0, (rev_alt - rev_anc) / np.where(denom > 0, denom, 1), 0.0)
+    controproposta = np.ceil(np.maximum(tariffa_be, soglia_bed))
+
+    check_allot = np.select([camere_over == 0, camere_over <= np.maximum(2, 0.15 * camere)],
+                            [VERDE, GIALLO], ROSSO)
+    check_mlos = np.select([notti >= min_stay, notti >= np.asarray(min_stay) - 1],
+                           [VERDE, GIALLO], ROSSO)
+    check_adr = np.select([tariffa >= soglia_bed, tariffa >= soglia_bed * 0.92],
+                          [VERDE, GIALLO], ROSSO)
+    check_disp = np.select([displacement > 0, displacement >= -0.05 * rev_alt],
+                           [VERDE, GIALLO], ROSSO)
+    esito = np.maximum(np.maximum(check_allot, check_mlos), np.maximum(check_adr, check_disp))
+
+    return {"pax": pax, "bed_nights": bed_nights, "rev_camere": rev_camere,
+            "rev_anc": rev_anc, "rev_totale": rev_totale,
+            "camere_allot": camere_allot, "camere_over": camere_over,
+            "rev_alt_allot": rev_alt_allot, "rev_alt_web": rev_alt_web, "rev_alt": rev_alt,
+            "displacement": displacement, "pct": pct, "soglia_bed": soglia_bed,
+            "tariffa_be": tariffa_be, "controproposta": controproposta,
+            "check_allot": check_allot, "check_mlos": check_mlos,
+            "check_adr": check_adr, "check_disp": check_disp, "esito": esito}
+
+
+# ------------------------------------------------------------------
+# VALUTAZIONE SINGOLA (API tipizzata)
+# ------------------------------------------------------------------
+@dataclass(slots=True)
+class RichiestaGruppo:
+    """Richiesta di un gruppo. Percentuali in 0–100; ``None`` = default dai periodi."""
+    check_in: date
+    check_out: date
+    camere: int
+    pax_cam: float = 2.25
+    tariffa: float = 0.0
+    ancillare: float = 0.0
+    allot_residuo: int | np.ndarray = 0     # scalare o per notte valida del soggiorno
+    occupancy: float | None = None
+    util_allot: float | None = None
+    pickup_web: float | None = None
+    nome: str = "Gruppo senza nome"
+    meal: str = "HB"
+
+
+@dataclass(slots=True)
+class Check:
+    stato: str
+    titolo: str
+    dettaglio: str
+
+    def __iter__(self):
+        return iter((self.stato, self.titolo, self.dettaglio))
+
+
+@dataclass(slots=True)
+class EsitoValutazione:
+    """Risultato completo di una valutazione, pronto per la vista o per il riepilogo."""
+    richiesta: RichiestaGruppo
+    soggiorno: Soggiorno
+    web: float
+    alpi: float
+    occupancy: float
+    util_allot: float
+    pickup_web: float
+    pax: float
+    bed_nights: float
+    rev_camere: float
+    rev_anc: float
+    rev_totale: float
+    camere_allot: int
+    camere_over: int
+    rev_alt_allot: float
+    rev_alt_web: float
+    rev_alt: float
+    displacement: float
+    pct: float
+    soglia_bed: float
+    tariffa_be: float
+    controproposta: int
+    checks: list = field(default_factory=list)
+    verdetto: str = ""
+    vcol: str = ""
+    autorizzazione: bool = False
+
+    @property
+    def adr_room(self):
+        return self.richiesta.tariffa * self.richiesta.pax_cam
+
+    def record(self):
+        """Riga per il riepilogo valutazioni."""
+        r = self.richiesta
+        return {"Gruppo": r.nome, "Check-in": r.check_in.strftime("%d/%m/%Y"),
+                "Check-out": r.check_out.strftime("%d/%m/%Y"), "Notti": self.soggiorno.notti,
+                "Camere": r.camere, "Pax/cam": r.pax_cam, "Pax": round(self.pax),
+                "Meal": r.meal, "ADR bed": round(r.tariffa, 2),
+                "Valore totale": round(self.rev_totale), "Displacement": round(self.displacement),
+                "Controproposta bed": self.controproposta, "Verdetto": self.verdetto}
+
+
+def _testi_check(v, codici, canale):
+    """Messaggi dei quattro check semaforo per un esito già calcolato."""
+    r, notti, min_eff = v.richiesta, v.soggiorno.notti, v.soggiorno.min_stay
+    camere, over = r.camere, v.camere_over
+    allot = int(np.min(r.allot_residuo))
+    critica = " nella notte più critica" if np.ndim(r.allot_residuo) else ""
+    stati = [str(STATI[c]) for c in codici]
+
+    c1 = {"verde": f"Le {camere} camere rientrano nell'allotment residuo ({allot}{critica}). "
+                   f"Nessuna erosione dell'inventario {canale}.",
+          "giallo": f"{over} camere oltre allotment ({allot} residue{critica}): "
+                    f"erosione contenuta dell'inventario {canale}, valutate a tariffa {canale}.",
+          "rosso": f"{over} camere oltre allotment ({allot} residue{critica}): "
+                   f"erosione significativa dell'inventario {canale} ad alto valore."}
+    c2 = {"verde": f"Soggiorno di {notti} notti ≥ MLOS del periodo ({min_eff}).",
+          "giallo": f"{notti} notti contro MLOS {min_eff}: deroga lieve, da autorizzare.",
+          "rosso": f"{notti} notti sotto il MLOS di {min_eff}: deroga importante."}
+    gap = r.tariffa - v.soglia_bed
+    c3 = {"verde": f"Tariffa {eur2(r.tariffa)} ≥ soglia {eur2(v.soglia_bed)} "
+                   f"({v.pct*100:.0f}% della {canale} con occupancy {v.occupancy:.0f}%).",
+          "giallo": f"Tariffa {eur2(r.tariffa)} di poco sotto la soglia {eur2(v.soglia_bed)} "
+                    f"(gap {eur2(gap)}/pax).",
+          "rosso": f"Tariffa {eur2(r.tariffa)} sotto la soglia {eur2(v.soglia_bed)} "
+                   f"(gap {eur2(gap)}/pax)."}
+    d = v.displacement
+    c4 = {"verde": f"Il gruppo genera {eur(d)} di valore incrementale "
+                   f"rispetto alla vendita alternativa attesa.",
+          "giallo": f"Displacement marginalmente negativo ({eur(d)}): "
+                    f"valore quasi equivalente all'alternativa.",
+          "rosso": f"Il gruppo distrugge {eur(abs(d))} di valore "
+                   f"rispetto alla vendita alternativa attesa."}
+    titoli = ["Allotment ALPI", "Minimum stay", "ADR bed vs soglia", "Displacement netto"]
+    return [Check(st_, t, m[st_]) for st_, t, m in zip(stati, titoli, (c1, c2, c3, c4))]
+
+
+def _per_notte(richiesta, soggiorno):
+    """Vero se l'allotment residuo è dato notte per notte (allineato alle notti valide)."""
+    if not np.ndim(richiesta.allot_residuo):
+        return False
+    if np.shape(richiesta.allot_residuo)[-1] != soggiorno.notti_valide:
+        raise ValueError("L'allotment residuo per notte non corrisponde alle notti del soggiorno.")
+    return True
+
+
+def _attesi(soggiorno, util, pickup, per_notte=False):
+    """€/bed-night attesi su allotment e WEB: medie del soggiorno o, ``per_notte``,
+    un valore per notte valida (la cui media coincide con quella del soggiorno)."""
+    m, v = soggiorno.medie, soggiorno.valori
+    if not per_notte:
+        return (valore_atteso(m["alpi"], util, m.get("alpi*util"), m.get("util")),
+                valore_atteso(m["web"], pickup, m.get("web*occ"), m.get("occ")))
+    util, pickup = np.asarray(util)[..., None], np.asarray(pickup)[..., None]
+    return (valore_atteso(v["alpi"], util, v.get("alpi*util"), m.get("util")),
+            valore_atteso(v["web"], pickup, v.get("web*occ"), m.get("occ")))
+
+
+def valuta_richiesta(richiesta, soggiorno, soglie, canale="WEB"):
+    """Valuta una richiesta già scomposta sui periodi.
+
+    Il soggiorno deve esporre le medie ``web`` e ``alpi`` (tariffe di riferimento
+    per inventario di casa e allotment) e, se la richiesta non le indica,
+    ``occ`` e ``util``. Solleva ``ValueError`` se nessuna notte ricade nei periodi.
+    """
+    r, sog = richiesta, soggiorno
+    if sog.notti <= 0:
+        raise ValueError("Il check-out deve essere successivo al check-in.")
+    if not sog.seg:
+        raise ValueError("Le date non rientrano in alcun periodo configurato.")
+    occ = r.occupancy if r.occupancy is not None else sog.medie.get("occ", 75.0)
+    util = r.util_allot if r.util_allot is not None else sog.medie.get("util", 50.0)
+    pickup = r.pickup_web if r.pickup_web is not None else occ
+    m = sog.medie
+    web, alpi = m["web"], m["alpi"]
+    per_notte = _per_notte(r, sog)
+    atteso_allot, atteso_web = _attesi(sog, util, pickup, per_notte)
+
+    x = valuta_displacement(r.camere, r.pax_cam, sog.notti, sog.notti_valide, sog.min_stay,
+                            r.tariffa, r.ancillare, r.allot_residuo, web,
+                            atteso_allot, atteso_web, occ, soglie, per_notte)
+    esito = int(x["esito"])
+    v = EsitoValutazione(
+        richiesta=r, soggiorno=sog, web=web, alpi=alpi, occupancy=float(occ),
+        util_allot=float(util), pickup_web=float(pickup),
+        pax=float(x["pax"]), bed_nights=float(x["bed_nights"]),
+        rev_camere=float(x["rev_camere"]), rev_anc=float(x["rev_anc"]),
+        rev_totale=float(x["rev_totale"]),
+        camere_allot=int(x["camere_allot"]), camere_over=int(x["camere_over"]),
+        rev_alt_allot=float(x["rev_alt_allot"]), rev_alt_web=float(x["rev_alt_web"]),
+        rev_alt=float(x["rev_alt"]), displacement=float(x["displacement"]),
+        pct=float(x["pct"]), soglia_bed=float(x["soglia_bed"]),
+        tariffa_be=float(x["tariffa_be"]), controproposta=int(x["controproposta"]),
+        verdetto=str(VERDETTI[esito]), vcol=str(STATI[esito]),
+        autorizzazione=bool(x["rev_totale"] > soglie["auth"]))
+    codici = [int(x[k]) for k in ("check_allot", "check_mlos", "check_adr", "check_disp")]
+    v.checks = _testi_check(v, codici, canale)
+    return v
+
+
+def valuta(indice, richiesta, soglie, colonne=COLONNE_SOGGIORNO, canale="WEB", calendario=None):
+    """Scompone il soggiorno sui periodi e valuta la richiesta in un'unica chiamata."""
+    sog = analizza_soggiorno(indice, richiesta.check_in, richiesta.check_out, colonne,
+                             calendario)
+    return valuta_richiesta(richiesta, sog, soglie, canale)
+
+
+# ------------------------------------------------------------------
+# SENSIBILITÀ TARIFFA × OCCUPANCY
+# ------------------------------------------------------------------
+def griglia_sensibilita(richiesta, soggiorno, soglie, tariffe, occupazioni, pickup):
+    """Displacement, break-even e verdetto su tutta la griglia in un solo broadcast.
+
+    ``tariffe`` (T) e ``occupazioni`` (O, 0–100) sono gli assi; ``pickup`` ha forma
+    (scenari, O) e dà il pick-up WEB di ogni scenario per ogni livello di
+    occupancy. Il resto della richiesta resta fisso. Ritorna il dict di
+    ``valuta_displacement`` con array di forma (scenari, O, T); ``tariffa_be`` e
+    ``soglia_bed`` non dipendono dalla tariffa.
+    """
+    r, sog, m = richiesta, soggiorno, soggiorno.medie
+    if sog.notti <= 0 or not sog.seg:
+        raise ValueError("Nessuna notte del soggiorno ricade nei periodi configurati.")
+    tariffe = np.asarray(tariffe, dtype=float)[None, None, :]
+    occ = np.asarray(occupazioni, dtype=float)[None, :, None]
+    pickup = np.asarray(pickup, dtype=float)[:, :, None]
+    util = r.util_allot if r.util_allot is not None else m.get("util", 50.0)
+    per_notte = _per_notte(r, sog)
+    atteso_allot, atteso_web = _attesi(sog, util, pickup, per_notte)
+    return valuta_displacement(r.camere, r.pax_cam, sog.notti, sog.notti_valide, sog.min_stay,
+                               tariffe, r.ancillare, r.allot_residuo, m["web"],
+                               atteso_allot, atteso_web, occ, soglie, per_notte)
+
+
+# ------------------------------------------------------------------
+# TABELLA CONTROPROPOSTE (forma chiusa)
+# ------------------------------------------------------------------
+PAX_CAMERA = np.round(np.arange(1.0, 4.0 + 1e-9, 0.05), 2)
+
+
+@dataclass(slots=True)
+class TabellaControproposte:
+    """Controproposte per meal plan × pax/camera × allotment residuo.
+
+    Break-even e controproposta bed non dipendono dal pax/camera (ricavo e
+    alternativa scalano entrambi con i letti): la dimensione pax serve solo per
+    la tariffa room. ``riepilogo`` e ``per_pax`` accettano il residuo come numero
+    o come array per notte valida del soggiorno.
+    """
+    meal: list
+    pax: np.ndarray             # P
+    allotment: np.ndarray       # L (0…camere: oltre, il break-even non cambia)
+    tariffa_be: np.ndarray      # M×L
+    soglia_bed: np.ndarray      # M
+    controproposta: np.ndarray  # M×L
+    room: np.ndarray            # M×P×L
+
+    def _al_residuo(self, allot_residuo):
+        """Break-even e controproposta bed per meal plan (M). Con il residuo notte per
+        notte il break-even è la media dei livelli delle singole notti, come nel
+        displacement notte per notte."""
+        j = np.clip(np.asarray(allot_residuo, dtype=np.int64), 0, self.allotment[-1])
+        if not j.ndim:
+            return self.tariffa_be[:, j], self.controproposta[:, j]
+        if not j.size:
+            raise ValueError("Allotment residuo per notte vuoto.")
+        be = self.tariffa_be[:, j].mean(axis=1)
+        return be, np.ceil(np.maximum(be, self.soglia_bed))
+
+    def riepilogo(self, allot_residuo):
+        """Una riga per meal plan al livello di allotment indicato (scalare o per notte)."""
+        be, contro = self._al_residuo(allot_residuo)
+        return pd.DataFrame({"Meal": self.meal, "Break-even bed": be.round(2),
+                             "Soglia ADR bed": self.soglia_bed.round(2),
+                             "Controproposta bed": contro})
+
+    def per_pax(self, allot_residuo):
+        """Controproposta room (€/camera) per pax/camera × meal plan."""
+        _, contro = self._al_residuo(allot_residuo)
+        return pd.DataFrame(contro[None, :] * self.pax[:, None], columns=self.meal,
+                            index=pd.Index(self.pax, name="Pax/cam"))
+
+    def frame(self):
+        """Tabella completa in formato lungo, per l'export."""
+        m, p, j = np.meshgrid(np.arange(len(self.meal)), np.arange(len(self.pax)),
+                              np.arange(len(self.allotment)), indexing="ij")
+        m, p, j = m.ravel(), p.ravel(), j.ravel()
+        return pd.DataFrame({"Meal": np.asarray(self.meal)[m], "Pax/cam": self.pax[p],
+                             "Allotment residuo": self.allotment[j],
+                             "Break-even bed": self.tariffa_be[m, j].round(2),
+                             "Soglia ADR bed": self.soglia_bed[m].round(2),
+                             "Controproposta bed": self.controproposta[m, j],
+                             "Controproposta room": self.room.ravel().round(2)})
+
+
+def tabella_controproposte(medie, camere, occupancy, util_allot, pickup_web, ancillare, soglie,
+                           pax=PAX_CAMERA):
+    """Tutte le controproposte in una chiamata, in forma chiusa.
+
+    ``medie`` mappa ogni meal plan sulle tariffe pesate del soggiorno
+    (``{"web": …, "alpi": …}``). Con A e W i €/bed-night attesi sui due livelli,
+    break-even bed = (min(camere, allot)·A + max(camere − allot, 0)·W) / camere −
+    ancillare, come in ``valuta_displacement``.
+    """
+    meal = list(medie)
+    web = np.array([medie[m]["web"] for m in meal], dtype=float)[:, None]
+    alpi = np.array([medie[m]["alpi"] for m in meal], dtype=float)[:, None]
+    allot = np.arange(int(camere) + 1)[None, :]
+    a, w = valore_atteso(alpi, util_allot), valore_atteso(web, pickup_web)
+    be = (np.minimum(camere, allot) * a + np.maximum(camere - allot, 0) * w) / camere - ancillare
+    soglia = web[:, 0] * pct_soglia(occupancy, soglie["low"], soglie["mid"], soglie["high"])
+    contro = np.ceil(np.maximum(be, soglia[:, None]))
+    pax = np.asarray(pax, dtype=float)
+    return TabellaControproposte(meal=meal, pax=pax, allotment=allot[0], tariffa_be=be,
+                                 soglia_bed=soglia, controproposta=contro,
+                                 room=contro[:, None, :] * pax[None, :, None])
+
+
+# ------------------------------------------------------------------
+# VALUTAZIONE BATCH (RFP)
+# ------------------------------------------------------------------
+BATCH_COLONNE = {
+    "Gruppo": ("gruppo", "group", "nome", "name"),
+    "Check-in": ("check-in", "checkin", "arrivo", "arrival"),
+    "Check-out": ("check-out", "checkout", "partenza", "departure"),
+    "Camere": ("camere", "rooms", "camere richieste"),
+    "Pax/cam": ("pax/cam", "pax/room", "pax per camera", "pax / camera"),
+    "ADR bed": ("adr bed", "tariffa", "rate", "tariffa proposta"),
+    "Ancillare": ("ancillare", "ancillary", "ricavo ancillare"),
+    "Allotment residuo": ("allotment residuo", "residual allotment", "allot_residuo"),
+    "Occupancy %": ("occupancy %", "occupancy"),
+    "Utilizzo allotment %": ("utilizzo allotment %", "utilizzo allotment"),
+    "Pick-up WEB %": ("pick-up web %", "pickup web %", "pick-up"),
+    "Prob. controproposta %": ("prob. controproposta %", "prob controproposta",
+                               "probabilità controproposta"),
+}
+BATCH_OBBLIGATORIE = ("Check-in", "Check-out", "Camere", "ADR bed")
+
+
+def _numero(serie):
+    """Numeri anche in formato italiano ("2,25") da CSV/Excel."""
+    if serie.dtype == object:
+        serie = serie.astype(str).str.strip().str.replace(",", ".", regex=False)
+    return pd.to_numeric(serie, errors="coerce")
+
+
+def normalizza_date(serie):
+    """Date ISO (``2026-07-11``) e italiane (``11/07/2026``) nella stessa colonna."""
+    iso = pd.to_datetime(serie, format="ISO8601", errors="coerce")
+    altre = pd.to_datetime(serie.where(iso.isna()), errors="coerce", dayfirst=True,
+                           format="mixed")
+    return iso.fillna(altre).dt.normalize()
+
+
+def _dal_libro(df, inventario):
+    """Allotment residuo (notte più critica) e occupazione già in casa di ogni riga
+    dal libro inventario, NaN dove il libro non copre il soggiorno."""
+    ci = df["Check-in"].to_numpy("datetime64[D]")
+    co = df["Check-out"].to_numpy("datetime64[D]")
+    ok = ~(np.isnat(ci) | np.isnat(co))
+    inizio = np.where(ok, ci.astype(np.int64), 0)
+    notti = np.where(ok, co.astype(np.int64) - inizio, 0)
+    return inventario.soggiorni(inizio, notti)
+
+
+def normalizza_richieste(df, inventario=None):
+    """Rinomina le intestazioni RFP sui nomi canonici e completa i default.
+
+    Con un ``inventario`` (vedi ``voi_inventario``) l'allotment residuo mancante
+    nella riga è quello della notte più critica del soggiorno nel libro notti e
+    la colonna «Occupancy OTB %» riporta l'occupazione già in casa.
+    """
+    alias = {a: k for k, v in BATCH_COLONNE.items() for a in (k.lower(),) + v}
+    df = df.rename(columns=lambda c: alias.get(str(c).strip().lower(), c))
+    mancanti = [c for c in BATCH_OBBLIGATORIE if c not in df.columns]
+    if mancanti:
+        raise ValueError(f"Colonne mancanti: {', '.join(mancanti)}")
+    df = df.reset_index(drop=True).copy()
+    if "Gruppo" not in df.columns:
+        df["Gruppo"] = [f"Richiesta {i + 1}" for i in range(len(df))]
+    for c in ("Check-in", "Check-out"):
+        df[c] = normalizza_date(df[c])
+    if inventario is not None:
+        libro = _dal_libro(df, inventario)
+        righe = _numero(df["Allotment residuo"]) if "Allotment residuo" in df.columns else np.nan
+        df["Allotment residuo"] = pd.Series(righe, index=df.index).fillna(
+            pd.Series(libro["residuo"], index=df.index))
+        df["Occupancy OTB %"] = libro["occupazione"]
+    for c, default in (("Pax/cam", 2.25), ("Ancillare", 0.0), ("Allotment residuo", 0)):
+        if c not in df.columns:
+            df[c] = default
+        df[c] = _numero(df[c]).fillna(default)
+    for c in ("Camere", "ADR bed", "Occupancy %", "Utilizzo allotment %", "Pick-up WEB %",
+              "Prob. controproposta %"):
+        if c in df.columns:
+            df[c] = _numero(df[c])
+    return df
+
+
+def valuta_batch(indice, richieste, soglie, calendario=None, inventario=None):
+    """Valuta in un passaggio colonnare tutte le richieste di un foglio RFP.
+
+    Occupancy, utilizzo allotment e pick-up WEB, se assenti o vuoti nella riga,
+    prendono il default pesato dai periodi (o dal calendario storico) come nella
+    pagina di valutazione; con un ``inventario`` l'allotment residuo viene dal libro
+    notti e l'occupancy di default non scende sotto l'occupazione già in casa.
+    """
+    df = normalizza_richieste(richieste, inventario)
+    ci = df["Check-in"].to_numpy("datetime64[D]")
+    co = df["Check-out"].to_numpy("datetime64[D]")
+    date_ok = ~(np.isnat(ci) | np.isnat(co))
+    inizio = np.where(date_ok, ci.astype(np.int64), 0)
+    notti = np.where(date_ok, (co.astype(np.int64) - inizio), 0)
+    notti = np.where(notti > 0, notti, 0)
+
+    sg = scomponi_soggiorni(indice, inizio, notti, COLONNE_SOGGIORNO, calendario)
+
+    def _o(col, default):
+        v = df[col].to_numpy(float) if col in df.columns else np.full(len(df), np.nan)
+        return np.where(np.isnan(v), default, v)
+
+    occ = _o("Occupancy %", np.fmax(sg["occ"], _o("Occupancy OTB %", np.nan)))
+    util = _o("Utilizzo allotment %", sg["util"])
+    pickup = _o("Pick-up WEB %", occ)
+    camere = df["Camere"].fillna(0).to_numpy(float)
+    tariffa = df["ADR bed"].fillna(0).to_numpy(float)
+    allot = df["Allotment residuo"].to_numpy(float)
+
+    atteso_allot = valore_atteso(sg["alpi"], util, sg["alpi*util"], sg["util"])
+    atteso_web = valore_atteso(sg["web"], pickup, sg["web*occ"], sg["occ"])
+    v = valuta_displacement(camere, df["Pax/cam"].to_numpy(float), notti, sg["nv"], sg["min"],
+                            tariffa, df["Ancillare"].to_numpy(float), allot,
+                            sg["web"], atteso_allot, atteso_web, occ, soglie)
+
+    valida = date_ok & (notti > 0) & (sg["nv"] > 0) & (camere > 0)
+    nota = np.select([~date_ok, notti <= 0, camere <= 0, sg["nv"] == 0, sg["nomatch"] > 0],
+                     ["Date non valide", "Check-out non successivo al check-in",
+                      "Camere non valide", "Date fuori da ogni periodo",
+                      np.char.add(sg["nomatch"].astype(str), " notti fuori periodo escluse")], "")
+
+    def _s(a):
+        return np.where(valida, STATI[a], "")
+
+    out = pd.DataFrame({
+        "Gruppo": df["Gruppo"], "Check-in": df["Check-in"].dt.date,
+        "Check-out": df["Check-out"].dt.date, "Notti": notti,
+        "Camere": camere.astype(int), "Pax/cam": df["Pax/cam"], "ADR bed": tariffa,
+        "Ancillare": df["Ancillare"], "Allotment residuo": allot.astype(int),
+        "Occupancy %": occ.round(1), "Utilizzo allotment %": util.round(1),
+        "Pick-up WEB %": pickup.round(1),
+        "ADR WEB pesata": sg["web"].round(2), "ADR Alpitour pesata": sg["alpi"].round(2),
+        "MLOS": sg["min"], "Camere oltre allotment": v["camere_over"].astype(int),
+        "Valore totale": v["rev_totale"].round(), "Alternativa attesa": v["rev_alt"].round(),
+        "Displacement": v["displacement"].round(), "Soglia ADR bed": v["soglia_bed"].round(2),
+        "Break-even bed": v["tariffa_be"].round(2), "Controproposta bed": v["controproposta"],
+        "Check allotment": _s(v["check_allot"]), "Check MLOS": _s(v["check_mlos"]),
+        "Check ADR bed": _s(v["check_adr"]), "Check displacement": _s(v["check_disp"]),
+        "Verdetto": np.where(valida, VERDETTI[v["esito"]], "NON VALUTABILE"),
+        "Autorizzazione direzione": valida & (v["rev_totale"] > soglie["auth"]),
+        "Note": nota,
+    })
+    num = ["Valore totale", "Alternativa attesa", "Displacement", "Soglia ADR bed",
+           "Break-even bed", "Controproposta bed"]
+    out.loc[~valida, num] = np.nan
+    return out
@@ -0,0 +1,104 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  export
+Export a memoria costante: Excel in modalità write-only scritto a
+blocchi di righe, CSV e Parquet (più fogli → archivio .zip).
+==================================================================
+"""
+
+import importlib.util
+import io
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+BLOCCO = 10_000     # righe convertite e scritte per volta
+
+MIME = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".csv": "text/csv",
+    ".parquet": "application/vnd.apache.parquet",
+    ".zip": "application/zip",
+}
+
+
+def formati():
+    """Formati offerti: Parquet solo con pyarrow installato."""
+    out = ["Excel", "CSV"]
+    if importlib.util.find_spec("pyarrow") is not None:
+        out.append("Parquet")
+    return out
+
+
+def _blocchi(df, blocco):
+    """Righe come tuple di valori Python (NaN/NaT → cella vuota), ``blocco`` alla volta."""
+    for i in range(0, len(df), blocco):
+        parte = df.iloc[i:i + blocco].astype(object)
+        yield parte.where(parte.notna(), None).itertuples(index=False, name=None)
+
+
+def to_excel_bytes(dfs: dict, blocco=BLOCCO):
+    """Workbook write-only: le celle vanno su file temporanei man mano, quindi la
+    memoria resta quella di un blocco di righe qualunque sia la dimensione."""
+    from openpyxl import Workbook    # caricato al primo export, non all'avvio
+
+    wb = Workbook(write_only=True)
+    for sheet, d in dfs.items():
+        ws = wb.create_sheet(sheet[:31])
+        ws.append([str(c) for c in d.columns])
+        for righe in _blocchi(d, blocco):
+            for r in righe:
+                ws.append(r)
+    if not dfs:
+        wb.create_sheet("Foglio1")
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def _csv(df, out, blocco):
+    # separatore e decimali all'italiana, BOM per l'apertura diretta in Excel
+    df.to_csv(out, sep=";", decimal=",", index=False, chunksize=blocco,
+              encoding="utf-8-sig", date_format="%Y-%m-%d")
+
+
+def _parquet(df, out, blocco):
+    df = df.copy()
+    for c in df.columns[df.dtypes == object]:
+        tipi = {type(x) for x in df[c].dropna()}
+        if len(tipi) > 1:       # colonne miste (es. date e testo) → testo
+            df[c] = df[c].map(lambda x: x if x is None or x != x else str(x))
+    df.columns = [str(c) for c in df.columns]
+    df.to_parquet(out, index=False, row_group_size=blocco)
+
+
+def _file(nome):
+    return re.sub(r"[^\w.-]+", "_", nome).strip("_") or "foglio"
+
+
+def esporta(dfs: dict, formato="Excel", nome="voi_export", blocco=BLOCCO):
+    """(byte, nome file, mime) nel formato scelto. CSV e Parquet hanno un file
+    per foglio: con più fogli vengono raccolti in un .zip."""
+    if formato == "Excel":
+        return to_excel_bytes(dfs, blocco), nome + ".xlsx", MIME[".xlsx"]
+    scrivi, est = {"CSV": (_csv, ".csv"), "Parquet": (_parquet, ".parquet")}[formato]
+    if len(dfs) == 1:
+        buf = io.BytesIO()
+        scrivi(next(iter(dfs.values())), buf, blocco)
+        return buf.getvalue(), nome + est, MIME[est]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for sheet, d in dfs.items():
+            with z.open(_file(sheet) + est, "w") as f:
+                scrivi(d, f, blocco)
+    return buf.getvalue(), nome + ".zip", MIME[".zip"]
+
+
+def impronta_fogli(dfs: dict):
+    """Hash del contenuto dei fogli, per non rigenerare l'export a ogni rerun."""
+    return tuple((k, d.shape, tuple(map(str, d.columns)),
+                  int(pd.util.hash_pandas_object(d.astype(str) if d.empty else d, index=False)
+                      .to_numpy(np.uint64).sum()))
+                 for k, d in dfs.items())
@@ -6,18 +6,26 @@ Metrica primaria: ADR bed  (ADR room derivato da pax/cam)
 ==================================================================
 """
 
-import io
-import math
-from datetime import date, timedelta
+from datetime import date
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 import streamlit as st
 
+from voi_app import aggiorna_da_sorgente, bottone_export, salva_valutazione
+from voi_engine import (GIORNI_SETTIMANA, TUTTE_LE_TARIFFE, IndicePeriodi, RichiestaGruppo,
+                        analizza_soggiorno, eur, eur2, impronta_periodi, leggi_periodi,
+                        tabella_controproposte, valuta_richiesta, variazioni_vuote)
+from voi_export import esporta, formati
+from voi_inventario import INVENTARIO
+from voi_perf import PERF
+from voi_registro import REGISTRO
+
 # ------------------------------------------------------------------
 # CONFIG
 # ------------------------------------------------------------------
+PERF.inizia_run()
 st.set_page_config(page_title="VOI Group Toolkit", page_icon="🏖️", layout="wide")
 
 PRIM = "#0F4C5C"      # teal mediterraneo
@@ -68,21 +76,6 @@ ICON = {"verde": "✅", "giallo": "⚠️", "rosso": "⛔"}
 # ------------------------------------------------------------------
 # HELPERS
 # ------------------------------------------------------------------
-def eur(x):
-    """Formato valuta italiano: 1.234 €"""
-    try:
-        return f"{x:,.0f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
-    except Exception:
-        return "—"
-
-
-def eur2(x):
-    try:
-        return f"{x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
-    except Exception:
-        return "—"
-
-
 def periodi_default():
     rows = [
         ("Apertura / Bassa",  date(2026, 5, 23), date(2026, 6, 6),  3,  58,  72,  86,  42,  52,  62, 25),
@@ -98,54 +91,56 @@ def periodi_default():
     df = pd.DataFrame(rows, columns=cols)
     df["Data inizio"] = pd.to_datetime(df["Data inizio"])
     df["Data fine"] = pd.to_datetime(df["Data fine"])
+    df.insert(0, "Stagione", "2026")
     return df
 
 
-def match_periodo(periodi, giorno):
-    g = pd.Timestamp(giorno)
-    for _, r in periodi.iterrows():
-        di, df_ = r["Data inizio"], r["Data fine"]
-        if pd.notna(di) and pd.notna(df_) and pd.Timestamp(di) <= g <= pd.Timestamp(df_):
-            return r
-    return None
-
-
-def analizza_soggiorno(periodi, check_in, check_out, meal):
-    """Assegna ogni notte al suo periodo. Ritorna notti, segmenti, notti senza periodo."""
-    notti = (check_out - check_in).days
-    seg = {}
-    nomatch = 0
-    for n in range(notti):
-        g = check_in + timedelta(days=n)
-        r = match_periodo(periodi, g)
-        if r is None:
-            nomatch += 1
-            continue
-        nome = r["Periodo"]
-        if nome not in seg:
-            seg[nome] = {"notti": 0,
-                         "fit": float(r[f"ADR bed FIT {meal}"]),
-                         "to": float(r[f"ADR bed TO {meal}"]),
-                         "min": int(r["Min stay"]),
-                         "allot": int(r["Allotment ALPI"])}
-        seg[nome]["notti"] += 1
-    return notti, seg, nomatch
-
-
-def pct_soglia(occ, low, mid, high):
-    if occ < 60:
-        return low
-    elif occ < 80:
-        return mid
-    return high
-
-
-def to_excel_bytes(dfs: dict):
-    buf = io.BytesIO()
-    with pd.ExcelWriter(buf, engine="openpyxl") as w:
-        for sheet, d in dfs.items():
-            d.to_excel(w, sheet_name=sheet[:31], index=False)
-    return buf.getvalue()
+def indice_periodi():
+    """Indice compilato dei periodi del Setup (con le variazioni per giorno della
+    settimana), ricostruito solo quando cambiano."""
+    per, var = st.session_state.periodi, st.session_state.variazioni
+    imp = impronta_periodi(per, var)
+    idx = st.session_state.get("indice_periodi")
+    if idx is None or idx.impronta != imp:
+        with PERF.fase("indice periodi"):
+            idx = st.session_state.indice_periodi = IndicePeriodi(per, imp, var)
+    return idx
+
+
+def colonne_meal(meal):
+    """Colonne dei periodi per il meal plan: FIT come tariffa di casa, TO come allotment."""
+    return {"web": f"ADR bed FIT {meal}", "alpi": f"ADR bed TO {meal}",
+            "min": "Min stay", "allot": "Allotment ALPI"}
+
+
+def controproposte(check_in, check_out, camere, occupancy, pickup, ancillare):
+    """Tabella controproposte di tutti i meal plan, memorizzata per griglia periodi,
+    soglie e parametri del soggiorno: cambiare meal, pax/cam o allotment residuo
+    è solo una lettura."""
+    s, indice = st.session_state.soglie, indice_periodi()
+    chiave = (indice.impronta, tuple(s.values()), check_in,
+              check_out, camere, occupancy, pickup, ancillare)
+    memo = st.session_state.setdefault("controproposte", {})
+    if chiave not in memo:
+        colonne = {f"{k} {m}": c for m in MEAL_PLANS
+                   for k, c in colonne_meal(m).items() if k in ("web", "alpi")}
+        with PERF.fase("match periodi"):
+            sog = analizza_soggiorno(indice, check_in, check_out, colonne)
+        if not sog.seg:
+            return None
+        medie = {m: {"web": sog.medie[f"web {m}"], "alpi": sog.medie[f"alpi {m}"]}
+                 for m in MEAL_PLANS}
+        if len(memo) >= 32:
+            memo.pop(next(iter(memo)))
+        with PERF.fase("controproposte"):
+            memo[chiave] = tabella_controproposte(medie, camere, occupancy, pickup, pickup,
+                                                  ancillare, s)
+    return memo[chiave]
+
+
+def grafico(fig):
+    with PERF.fase("grafici Plotly"):
+        st.plotly_chart(fig, use_container_width=True)
 
 
 # ------------------------------------------------------------------
@@ -153,8 +148,8 @@ def to_excel_bytes(dfs: dict):
 # ------------------------------------------------------------------
 if "periodi" not in st.session_state:
     st.session_state.periodi = periodi_default()
-if "valutazioni" not in st.session_state:
-    st.session_state.valutazioni = []
+if "variazioni" not in st.session_state:
+    st.session_state.variazioni = variazioni_vuote()
 if "soglie" not in st.session_state:
     st.session_state.soglie = {"low": 0.70, "mid": 0.85, "high": 0.95, "auth": 35000}
 
@@ -180,292 +175,294 @@ s["mid"] = st.sidebar.slider("Occupancy 60–80%", 0.40, 1.10, s["mid"], 0.01)
 s["high"] = st.sidebar.slider("Occupancy > 80%", 0.40, 1.20, s["high"], 0.01)
 s["auth"] = st.sidebar.number_input("Soglia autorizzazione direzione (€)",
                                     0, 1_000_000, int(s["auth"]), 5000)
+st.sidebar.divider()
+mostra_perf = st.sidebar.toggle("⏱ Performance", key="mostra_perf",
+                                help="Tempi per fase dell'ultimo rerun e percentili del processo.")
+pannello_perf = st.sidebar.container()
+
+
+try:
+    # ==================================================================
+    # PAGINA — SETUP PERIODI
+    # ==================================================================
+    if pagina == "⚙️ Setup periodi":
+        st.subheader("⚙️ Setup periodi tariffari")
+        st.caption("Anagrafica periodi della stagione. Le tariffe sono **ADR bed per "
+                   "pax/notte** per ciascun meal plan. La valutazione gruppo legge "
+                   "automaticamente questi dati.")
+
+        cfg = {
+            "Stagione": st.column_config.TextColumn("Stagione", width="small",
+                        help="Etichetta della stagione (es. 2026). "
+                             "Vuota = anno della data di inizio."),
+            "Periodo": st.column_config.TextColumn("Periodo", width="medium"),
+            "Data inizio": st.column_config.DateColumn("Inizio", format="DD/MM/YYYY"),
+            "Data fine": st.column_config.DateColumn("Fine", format="DD/MM/YYYY"),
+            "Min stay": st.column_config.NumberColumn("MLOS", min_value=1, max_value=21, step=1),
+            "ADR bed FIT BB": st.column_config.NumberColumn("FIT BB", format="%.0f €"),
+            "ADR bed FIT HB": st.column_config.NumberColumn("FIT HB", format="%.0f €"),
+            "ADR bed FIT FB": st.column_config.NumberColumn("FIT FB", format="%.0f €"),
+            "ADR bed TO BB": st.column_config.NumberColumn("TO BB", format="%.0f €"),
+            "ADR bed TO HB": st.column_config.NumberColumn("TO HB", format="%.0f €"),
+            "ADR bed TO FB": st.column_config.NumberColumn("TO FB", format="%.0f €"),
+            "Allotment ALPI": st.column_config.NumberColumn("Allot. ALPI", min_value=0, step=1),
+        }
+        edited = st.data_editor(st.session_state.periodi, column_config=cfg,
+                                num_rows="dynamic", use_container_width=True, hide_index=True)
+        st.session_state.periodi = edited
+        sov = indice_periodi().sovrapposizioni
+        if sov:
+            st.warning("Periodi sovrapposti: " + ", ".join(str(edited["Periodo"].iloc[i]) for i in sov) +
+                       ". Per le notti in comune vale il primo periodo in tabella.")
+
+        st.markdown("##### Variazioni per giorno della settimana")
+        st.caption("Differenziali per giorno (es. sabato +10% sulle tariffe): su tutte le "
+                   "stagioni, su una stagione, su un periodo o su entrambi; vale la riga più "
+                   "specifica (a parità, la prima in tabella). «Valore», se indicato, "
+                   "sostituisce la cifra del periodo.")
+        numeriche = [c for c in edited.columns
+                     if c not in ("Stagione", "Periodo", "Data inizio", "Data fine")]
+        cfg_var = {
+            "Stagione": st.column_config.TextColumn("Stagione", help="Vuota = tutte le stagioni."),
+            "Periodo": st.column_config.SelectboxColumn(
+                "Periodo", options=sorted(edited["Periodo"].dropna().astype(str).unique()),
+                help="Vuoto = tutti i periodi della stagione."),
+            "Giorni": st.column_config.TextColumn(
+                "Giorni", help=f"Es. «Sab», «Ven,Sab», «Lun-Gio» ({', '.join(GIORNI_SETTIMANA)})."),
+            "Colonna": st.column_config.SelectboxColumn(
+                "Colonna", options=[TUTTE_LE_TARIFFE] + numeriche),
+            "Variazione %": st.column_config.NumberColumn("Variazione %", format="%+.1f"),
+            "Valore": st.column_config.NumberColumn("Valore", help="Sostituisce il valore del periodo."),
+        }
+        st.session_state.variazioni = st.data_editor(
+            st.session_state.variazioni, column_config=cfg_var, num_rows="dynamic",
+            use_container_width=True, hide_index=True)
+        indice = indice_periodi()
+        if indice.scartate:
+            st.warning("Variazioni ignorate (giorni, colonna o periodo non validi): righe " +
+                       ", ".join(str(i + 1) for i in indice.scartate) + ".")
+        if indice.variazioni and len(edited):
+            with st.expander("📅 Anteprima calendario tariffe"):
+                tariffe = [c for c in numeriche if str(c).startswith("ADR bed")]
+                cal = indice.tariffe(pd.to_datetime(edited["Data inizio"]).min(),
+                                     pd.to_datetime(edited["Data fine"]).max(), tariffe)
+                fig = go.Figure([go.Scatter(x=cal["Notte"], y=cal[c], name=c, mode="lines",
+                                            line_shape="hv") for c in tariffe])
+                fig.update_layout(height=320, margin=dict(t=20, b=10, l=10, r=10),
+                                  yaxis_title="€/pax/notte", legend=dict(orientation="h", y=-0.2))
+                grafico(fig)
 
-
-# ==================================================================
-# PAGINA — SETUP PERIODI
-# ==================================================================
-if pagina == "⚙️ Setup periodi":
-    st.subheader("⚙️ Setup periodi tariffari")
-    st.caption("Anagrafica periodi della stagione. Le tariffe sono **ADR bed per pax/notte** "
-               "per ciascun meal plan. La valutazione gruppo legge automaticamente questi dati.")
-
-    cfg = {
-        "Periodo": st.column_config.TextColumn("Periodo", width="medium"),
-        "Data inizio": st.column_config.DateColumn("Inizio", format="DD/MM/YYYY"),
-        "Data fine": st.column_config.DateColumn("Fine", format="DD/MM/YYYY"),
-        "Min stay": st.column_config.NumberColumn("MLOS", min_value=1, max_value=21, step=1),
-        "ADR bed FIT BB": st.column_config.NumberColumn("FIT BB", format="%.0f €"),
-        "ADR bed FIT HB": st.column_config.NumberColumn("FIT HB", format="%.0f €"),
-        "ADR bed FIT FB": st.column_config.NumberColumn("FIT FB", format="%.0f €"),
-        "ADR bed TO BB": st.column_config.NumberColumn("TO BB", format="%.0f €"),
-        "ADR bed TO HB": st.column_config.NumberColumn("TO HB", format="%.0f €"),
-        "ADR bed TO FB": st.column_config.NumberColumn("TO FB", format="%.0f €"),
-        "Allotment ALPI": st.column_config.NumberColumn("Allot. ALPI", min_value=0, step=1),
-    }
-    edited = st.data_editor(st.session_state.periodi, column_config=cfg,
-                            num_rows="dynamic", use_container_width=True, hide_index=True)
-    st.session_state.periodi = edited
-
-    c1, c2, c3 = st.columns(3)
-    with c1:
-        st.download_button("⬇️ Esporta periodi (Excel)",
-                           to_excel_bytes({"Periodi": edited}),
-                           "voi_periodi.xlsx",
-                           "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                           use_container_width=True)
-    with c2:
-        up = st.file_uploader("⬆️ Importa periodi", type=["xlsx"], label_visibility="collapsed")
-        if up is not None:
-            try:
-                imp = pd.read_excel(up)
-                imp["Data inizio"] = pd.to_datetime(imp["Data inizio"])
-                imp["Data fine"] = pd.to_datetime(imp["Data fine"])
-                st.session_state.periodi = imp
-                st.success("Periodi importati.")
-                st.rerun()
-            except Exception as e:
-                st.error(f"Import non riuscito: {e}")
-    with c3:
-        if st.button("↺ Ripristina periodi demo", use_container_width=True):
-            st.session_state.periodi = periodi_default()
-            st.rerun()
-
-    st.info("**FIT** = tariffa bed di riferimento per la vendita diretta/individuale. "
-            "**TO** = tariffa bed netta contrattualizzata Alpitour. "
-            "Il displacement usa la FIT per le camere oltre allotment e la TO per quelle entro allotment.")
-
-
-# ==================================================================
-# PAGINA — RIEPILOGO
-# ==================================================================
-elif pagina == "📋 Riepilogo valutazioni":
-    st.subheader("📋 Riepilogo valutazioni")
-    if not st.session_state.valutazioni:
-        st.info("Nessuna valutazione salvata in questa sessione. "
-                "Vai su «Valutazione gruppo» e usa **Salva valutazione**.")
-    else:
-        df = pd.DataFrame(st.session_state.valutazioni)
-        st.dataframe(df, use_container_width=True, hide_index=True)
-        c1, c2 = st.columns([1, 1])
+        c1, c2, c3 = st.columns(3)
         with c1:
-            st.download_button("⬇️ Esporta riepilogo (Excel)",
-                               to_excel_bytes({"Valutazioni": df}),
-                               "voi_valutazioni_gruppi.xlsx",
-                               "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                               use_container_width=True)
+            # sempre Excel: è il formato che «Importa periodi» rilegge
+            bottone_export("⬇️ Esporta periodi (Excel)", {"Periodi": edited,
+                                                         "Variazioni": st.session_state.variazioni},
+                           "voi_periodi", "periodi", ["Excel"])
         with c2:
-            if st.button("🗑️ Svuota riepilogo", use_container_width=True):
-                st.session_state.valutazioni = []
+            up = st.file_uploader("⬆️ Importa periodi", type=["xlsx"],
+                                  label_visibility="collapsed")
+            # importa una volta per file: al rerun il file resta nell'uploader
+            if up is not None and st.session_state.get("periodi_importati") != (up.name, up.size):
+                try:
+                    with PERF.fase("lettura Excel"):
+                        st.session_state.periodi, st.session_state.variazioni = leggi_periodi(up)
+                    st.session_state.periodi_importati = (up.name, up.size)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"Import non riuscito: {e}")
+        with c3:
+            if st.button("↺ Ripristina periodi demo", use_container_width=True):
+                st.session_state.periodi = periodi_default()
+                st.session_state.variazioni = variazioni_vuote()
                 st.rerun()
 
+        st.info("**FIT** = tariffa bed di riferimento per la vendita diretta/individuale. "
+                "**TO** = tariffa bed netta contrattualizzata Alpitour. "
+                "Il displacement usa la FIT per le camere oltre allotment e la TO per quelle entro allotment.")
 
-# ==================================================================
-# PAGINA — VALUTAZIONE GRUPPO
-# ==================================================================
-else:
-    periodi = st.session_state.periodi
-    st.subheader("🧮 Valutazione richiesta gruppo")
 
-    # ---------- INPUT ----------
-    with st.container():
-        c1, c2, c3 = st.columns(3)
-        with c1:
-            nome_gruppo = st.text_input("Nome / riferimento gruppo", "Gruppo senza nome")
-            check_in = st.date_input("Check-in", date(2026, 7, 11), format="DD/MM/YYYY")
-            check_out = st.date_input("Check-out", date(2026, 7, 14), format="DD/MM/YYYY")
-        with c2:
-            camere = st.number_input("Camere richieste", 1, 500, 30, 1)
-            pax_cam = st.number_input("Pax / camera", 1.0, 4.0, 2.25, 0.05,
-                                      help="Default gruppi leisure = 2,25. Sovrascrivi con il dato reale "
-                                           "della richiesta (colonna pax/cam).")
-            meal = st.selectbox("Meal plan", MEAL_PLANS,
-                                index=1, format_func=lambda m: f"{m} — {MEAL_LABEL[m]}")
-        with c3:
-            tariffa = st.number_input("Tariffa proposta — ADR bed (€/pax/notte)",
-                                      0.0, 1000.0, 95.0, 1.0)
-            ancillare = st.number_input("Ricavo ancillare extra (€/pax/notte)",
-                                        0.0, 500.0, 0.0, 1.0,
-                                        help="F&B extra, escursioni, spa ecc. non inclusi nel meal plan.")
-
-    st.markdown('<div class="vt-card">', unsafe_allow_html=True)
-    c4, c5, c6 = st.columns(3)
-    with c4:
-        allot_residuo = st.number_input("Allotment ALPI residuo sulle date (da Scrigno)",
-                                        0, 500, 20, 1,
-                                        help="Camere ancora disponibili nell'allotment Alpitour per il "
-                                             "periodo. Verifica manualmente su Scrigno. Se il soggiorno "
-                                             "scavalca più periodi, inserisci il valore del periodo più critico.")
-    with c5:
-        occupancy = st.slider("Occupancy attesa nel periodo (%)", 0, 100, 75, 1)
-    with c6:
-        pickup = st.slider("Probabilità pick-up alternativo (%)", 0, 100, 75, 1,
-                           help="Probabilità che le camere vengano comunque vendute se NON si accetta "
-                                "il gruppo. Default ≈ occupancy attesa; correggi in base alla forza "
-                                "della domanda OTB.")
-    st.markdown('</div>', unsafe_allow_html=True)
-
-    valuta = st.button("▶️  Valuta richiesta", type="primary", use_container_width=True)
-
-    # ---------- ELABORAZIONE ----------
-    if valuta:
-        if check_out <= check_in:
-            st.error("Il check-out deve essere successivo al check-in.")
-            st.stop()
-        if periodi.empty:
-            st.error("Nessun periodo configurato. Vai su «Setup periodi».")
-            st.stop()
-
-        notti, seg, nomatch = analizza_soggiorno(periodi, check_in, check_out, meal)
-        if not seg:
-            st.error("Le date selezionate non rientrano in nessun periodo configurato.")
-            st.stop()
-        if nomatch > 0:
-            st.warning(f"⚠️ {nomatch} notti su {notti} non rientrano in alcun periodo configurato "
-                       f"e sono escluse dal calcolo.")
-
-        notti_valide = sum(v["notti"] for v in seg.values())
-        fit_w = sum(v["notti"] * v["fit"] for v in seg.values()) / notti_valide
-        to_w = sum(v["notti"] * v["to"] for v in seg.values()) / notti_valide
-        min_stay_eff = max(v["min"] for v in seg.values())
-
-        # --- volumi gruppo ---
-        pax = camere * pax_cam
-        bed_nights = pax * notti_valide
-        room_nights = camere * notti_valide
-        rev_camere = bed_nights * tariffa
-        rev_anc = bed_nights * ancillare
-        rev_totale = rev_camere + rev_anc
-        adr_room_gruppo = tariffa * pax_cam
-
-        # --- alternativa / displacement ---
-        camere_allot = min(camere, allot_residuo)
-        camere_over = max(0, camere - allot_residuo)
-        rev_alt_lordo = (camere_allot * pax_cam * to_w +
-                         camere_over * pax_cam * fit_w) * notti_valide
-        rev_alt_atteso = rev_alt_lordo * (pickup / 100)
-        displacement = rev_totale - rev_alt_atteso
-
-        # --- soglia ADR bed ---
-        pct = pct_soglia(occupancy, s["low"], s["mid"], s["high"])
-        soglia_bed = fit_w * pct
-
-        # --- controproposta ---
-        denom = camere * pax_cam * notti_valide
-        tariffa_be = (rev_alt_atteso - rev_anc) / denom if denom else 0
-        tariffa_target = max(tariffa_be, soglia_bed)
-        controproposta = math.ceil(tariffa_target)
-
-        # =================== CHECK 1 — ALLOTMENT ===================
-        if camere_over == 0:
-            c1r = ("verde", "Allotment ALPI",
-                   f"Le {camere} camere rientrano nell'allotment residuo ({allot_residuo}). "
-                   f"Nessuna erosione dell'inventario FIT.")
-        elif camere_over <= max(2, 0.15 * camere):
-            c1r = ("giallo", "Allotment ALPI",
-                   f"{camere_over} camere oltre allotment ({allot_residuo} residue): "
-                   f"erosione contenuta dell'inventario diretto.")
+    # ==================================================================
+    # PAGINA — RIEPILOGO
+    # ==================================================================
+    elif pagina == "📋 Riepilogo valutazioni":
+        st.subheader("📋 Riepilogo valutazioni")
+        totale = REGISTRO.conta("v1")
+        if not totale:
+            st.info("Nessuna valutazione nel registro. "
+                    "Vai su «Valutazione gruppo» e usa **Salva valutazione**.")
         else:
-            c1r = ("rosso", "Allotment ALPI",
-                   f"{camere_over} camere oltre allotment ({allot_residuo} residue): "
-                   f"erosione significativa dell'inventario FIT diretto.")
-
-        # =================== CHECK 2 — MIN STAY ===================
-        if notti >= min_stay_eff:
-            c2r = ("verde", "Minimum stay",
-                   f"Soggiorno di {notti} notti ≥ MLOS del periodo ({min_stay_eff}).")
-        elif notti >= min_stay_eff - 1:
-            c2r = ("giallo", "Minimum stay",
-                   f"Soggiorno di {notti} notti contro MLOS {min_stay_eff}: "
-                   f"deroga lieve, da autorizzare.")
-        else:
-            c2r = ("rosso", "Minimum stay",
-                   f"Soggiorno di {notti} notti sotto il MLOS di {min_stay_eff}: "
-                   f"deroga importante sulla durata minima.")
-
-        # =================== CHECK 3 — ADR BED ===================
-        gap = tariffa - soglia_bed
-        if tariffa >= soglia_bed:
-            c3r = ("verde", "ADR bed vs soglia",
-                   f"Tariffa {eur2(tariffa)} ≥ soglia {eur2(soglia_bed)} "
-                   f"({pct*100:.0f}% della FIT bed con occupancy {occupancy}%).")
-        elif tariffa >= soglia_bed * 0.92:
-            c3r = ("giallo", "ADR bed vs soglia",
-                   f"Tariffa {eur2(tariffa)} di poco sotto la soglia {eur2(soglia_bed)} "
-                   f"(gap {eur2(gap)}/pax).")
-        else:
-            c3r = ("rosso", "ADR bed vs soglia",
-                   f"Tariffa {eur2(tariffa)} sotto la soglia {eur2(soglia_bed)} "
-                   f"(gap {eur2(gap)}/pax).")
-
-        # =================== CHECK 4 — DISPLACEMENT ===================
-        if displacement > 0:
-            c4r = ("verde", "Displacement netto",
-                   f"Il gruppo genera {eur(displacement)} di valore incrementale "
-                   f"rispetto alla vendita alternativa attesa.")
-        elif displacement >= -0.05 * rev_alt_atteso:
-            c4r = ("giallo", "Displacement netto",
-                   f"Displacement marginalmente negativo ({eur(displacement)}): "
-                   f"valore quasi equivalente all'alternativa.")
-        else:
-            c4r = ("rosso", "Displacement netto",
-                   f"Il gruppo distrugge {eur(abs(displacement))} di valore "
-                   f"rispetto alla vendita alternativa attesa.")
-
-        checks = [c1r, c2r, c3r, c4r]
-        stati = [c[0] for c in checks]
-
-        # =================== VERDETTO ===================
-        if "rosso" in stati:
-            verdetto, vcol = "RIFIUTARE O RINEGOZIARE", "rosso"
-        elif "giallo" in stati:
-            verdetto, vcol = "VALUTARE — CONTROPROPOSTA CONSIGLIATA", "giallo"
-        else:
-            verdetto, vcol = "ACCETTARE", "verde"
-
-        # ---------- OUTPUT ----------
-        st.divider()
-
-        # metriche gruppo
-        m1, m2, m3, m4 = st.columns(4)
-        m1.metric("Pax totali", f"{pax:.0f}", help=f"{camere} camere × {pax_cam} pax/cam")
-        m2.metric("Bed nights", f"{bed_nights:.0f}")
-        m3.metric("ADR bed gruppo", eur2(tariffa))
-        m4.metric("ADR room gruppo", eur2(adr_room_gruppo))
-
-        m5, m6, m7, m8 = st.columns(4)
-        m5.metric("Ricavo camere", eur(rev_camere))
-        m6.metric("Ricavo ancillare", eur(rev_anc))
-        m7.metric("Valore totale gruppo", eur(rev_totale))
-        m8.metric("Displacement netto", eur(displacement),
-                  delta=f"{displacement/rev_alt_atteso*100:+.1f}% vs alternativa"
-                  if rev_alt_atteso else None)
-
-        # verdetto
-        st.markdown(f"""
+            f1, f2, f3, f4 = st.columns([1, 1, 1.3, 2])
+            filtri = {"dal": f1.date_input("Check-in dal", None, format="DD/MM/YYYY"),
+                      "al": f2.date_input("Check-in al", None, format="DD/MM/YYYY"),
+                      "gruppo": f3.text_input("Gruppo (inizia con)").strip(),
+                      "verdetti": f4.multiselect("Verdetto", REGISTRO.verdetti("v1"))}
+            trovate = REGISTRO.conta("v1", **filtri)
+            p1, p2, p3 = st.columns([1, 1, 3])
+            righe = p1.selectbox("Righe per pagina", [25, 50, 100, 250], index=1)
+            pagine = max(1, -(-trovate // righe))
+            n = p2.number_input("Pagina", 1, pagine, 1)
+            p3.caption(f"{trovate} valutazioni su {totale} nel registro · "
+                       f"pagina {n} di {pagine}")
+            st.dataframe(REGISTRO.pagina("v1", n - 1, righe, **filtri),
+                         use_container_width=True, hide_index=True)
+            c1, c2 = st.columns(2)
+            with c1:
+                formato = st.selectbox("Formato export", formati())
+                if st.button("⬇️ Prepara export (righe filtrate)", use_container_width=True):
+                    with PERF.fase("export"):
+                        dati = esporta({"Valutazioni": REGISTRO.esporta("v1", **filtri)},
+                                       formato, "voi_valutazioni_gruppi")
+                    st.download_button(f"⬇️ Esporta riepilogo ({formato})", *dati,
+                                       use_container_width=True)
+            with c2:
+                conferma = st.checkbox("Confermo di voler cancellare tutto il registro")
+                if st.button("🗑️ Svuota registro", use_container_width=True, disabled=not conferma):
+                    REGISTRO.svuota("v1")
+                    st.rerun()
+
+
+    # ==================================================================
+    # PAGINA — VALUTAZIONE GRUPPO
+    # ==================================================================
+    else:
+        st.subheader("🧮 Valutazione richiesta gruppo")
+
+        # ---------- INPUT ----------
+        with st.container():
+            c1, c2, c3 = st.columns(3)
+            with c1:
+                nome_gruppo = st.text_input("Nome / riferimento gruppo", "Gruppo senza nome")
+                check_in = st.date_input("Check-in", date(2026, 7, 11), format="DD/MM/YYYY")
+                check_out = st.date_input("Check-out", date(2026, 7, 14), format="DD/MM/YYYY")
+            with c2:
+                camere = st.number_input("Camere richieste", 1, 500, 30, 1)
+                pax_cam = st.number_input("Pax / camera", 1.0, 4.0, 2.25, 0.05,
+                                          help="Default gruppi leisure = 2,25. Sovrascrivi con il dato reale "
+                                               "della richiesta (colonna pax/cam).")
+                meal = st.selectbox("Meal plan", MEAL_PLANS,
+                                    index=1, format_func=lambda m: f"{m} — {MEAL_LABEL[m]}")
+            with c3:
+                tariffa = st.number_input("Tariffa proposta — ADR bed (€/pax/notte)",
+                                          0.0, 1000.0, 95.0, 1.0)
+                ancillare = st.number_input("Ricavo ancillare extra (€/pax/notte)",
+                                            0.0, 500.0, 0.0, 1.0,
+                                            help="F&B extra, escursioni, spa ecc. non inclusi nel meal plan.")
+
+        st.markdown('<div class="vt-card">', unsafe_allow_html=True)
+        c4, c5, c6 = st.columns(3)
+        with c4:
+            disp = None
+            if check_out > check_in:
+                aggiorna_da_sorgente(check_in, check_out)
+                with PERF.fase("inventario"):
+                    disp = INVENTARIO.soggiorno(check_in, check_out)
+            dal_libro = disp is not None and disp.completa
+            da_inventario = dal_libro and st.toggle(
+                "Allotment residuo dall'inventario", True,
+                help="Residuo notte per notte dal libro notti (sezione «Inventario»), "
+                     "al netto dei gruppi già bloccati.")
+            if da_inventario:
+                st.caption(f"📦 Allotment ALPI residuo: {disp.residuo_allot.min()}–"
+                           f"{disp.residuo_allot.max()} camere per notte.")
+                # solo le notti valutate (quelle nei periodi), nell'ordine del soggiorno
+                allot_residuo = disp.residuo_allot[indice_periodi().cerca(disp.giorni) >= 0]
+            else:
+                allot_residuo = st.number_input("Allotment ALPI residuo (da Scrigno)",
+                                                0, 500, 20, 1,
+                                                help="Camere ancora libere nell'allotment "
+                                                     "Alpitour per le date. Verifica "
+                                                     "manualmente su Scrigno.")
+        with c5:
+            # mai sotto l'occupazione già in casa (venduto e gruppi) del libro notti
+            occ_def = max(75, round(float(disp.occupazione.mean()))) if dal_libro else 75
+            occupancy = st.slider("Occupancy attesa nel periodo (%)", 0, 100, occ_def, 1)
+        with c6:
+            pickup = st.slider("Probabilità pick-up alternativo (%)", 0, 100, 75, 1,
+                               help="Probabilità che le camere vengano comunque vendute se NON si accetta "
+                                    "il gruppo. Default ≈ occupancy attesa; correggi in base alla forza "
+                                    "della domanda OTB.")
+        st.markdown('</div>', unsafe_allow_html=True)
+
+        valuta = st.button("▶️  Valuta richiesta", type="primary", use_container_width=True)
+
+        # ---------- ELABORAZIONE ----------
+        if valuta:
+            if check_out <= check_in:
+                st.error("Il check-out deve essere successivo al check-in.")
+                st.stop()
+            if st.session_state.periodi.empty:
+                st.error("Nessun periodo configurato. Vai su «Setup periodi».")
+                st.stop()
+
+            indice = indice_periodi()
+            with PERF.fase("match periodi"):
+                sog = analizza_soggiorno(indice, check_in, check_out, colonne_meal(meal))
+            notti, seg, nomatch = sog.notti, sog.seg, sog.nomatch
+            if not seg:
+                st.error("Le date selezionate non rientrano in nessun periodo configurato.")
+                st.stop()
+            if nomatch > 0:
+                st.warning(f"⚠️ {nomatch} notti su {notti} non rientrano in alcun periodo configurato "
+                           f"e sono escluse dal calcolo.")
+
+            # displacement a un livello: stessa probabilità di pick-up per allotment e FIT
+            richiesta = RichiestaGruppo(check_in=check_in, check_out=check_out, camere=camere,
+                                        pax_cam=pax_cam, tariffa=tariffa, ancillare=ancillare,
+                                        allot_residuo=allot_residuo, occupancy=occupancy,
+                                        util_allot=pickup, pickup_web=pickup,
+                                        nome=nome_gruppo, meal=meal)
+            with PERF.fase("valutazione"):
+                v = valuta_richiesta(richiesta, sog, s, canale="FIT")
+            fit_w, to_w, min_stay_eff = v.web, v.alpi, sog.min_stay
+            pax, bed_nights, rev_camere, rev_anc, rev_totale = (
+                v.pax, v.bed_nights, v.rev_camere, v.rev_anc, v.rev_totale)
+            rev_alt_atteso, displacement, soglia_bed = v.rev_alt, v.displacement, v.soglia_bed
+            tariffa_be, controproposta, adr_room_gruppo = v.tariffa_be, v.controproposta, v.adr_room
+            checks, verdetto, vcol = v.checks, v.verdetto, v.vcol
+
+            # ---------- OUTPUT ----------
+            st.divider()
+
+            # metriche gruppo
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Pax totali", f"{pax:.0f}", help=f"{camere} camere × {pax_cam} pax/cam")
+            m2.metric("Bed nights", f"{bed_nights:.0f}")
+            m3.metric("ADR bed gruppo", eur2(tariffa))
+            m4.metric("ADR room gruppo", eur2(adr_room_gruppo))
+
+            m5, m6, m7, m8 = st.columns(4)
+            m5.metric("Ricavo camere", eur(rev_camere))
+            m6.metric("Ricavo ancillare", eur(rev_anc))
+            m7.metric("Valore totale gruppo", eur(rev_totale))
+            m8.metric("Displacement netto", eur(displacement),
+                      delta=f"{displacement/rev_alt_atteso*100:+.1f}% vs alternativa"
+                      if rev_alt_atteso else None)
+
+            # verdetto
+            st.markdown(f"""
         <div class="vt-verdict" style="background:{COLOR[vcol]}">
           <h2>{ICON[vcol]}  {verdetto}</h2>
           <p>{nome_gruppo} · {check_in.strftime('%d/%m/%Y')} → {check_out.strftime('%d/%m/%Y')}
              · {notti} notti · {camere} camere · meal {meal}</p>
         </div>""", unsafe_allow_html=True)
 
-        # check semaforo
-        cL, cR = st.columns([3, 2])
-        with cL:
-            st.markdown("##### Esito controlli")
-            for stato, titolo, dett in checks:
-                st.markdown(f"""
+            # check semaforo
+            cL, cR = st.columns([3, 2])
+            with cL:
+                st.markdown("##### Esito controlli")
+                for stato, titolo, dett in checks:
+                    st.markdown(f"""
                 <div class="vt-check" style="background:{COLOR[stato]}">
                   <b>{ICON[stato]} {titolo}</b><br>{dett}
                 </div>""", unsafe_allow_html=True)
 
-            if rev_totale > s["auth"]:
-                st.warning(f"📨 Valore totale {eur(rev_totale)} oltre la soglia di "
-                           f"{eur(s['auth'])}: **richiede autorizzazione della direzione**.")
+                if v.autorizzazione:
+                    st.warning(f"📨 Valore totale {eur(rev_totale)} oltre la soglia di "
+                               f"{eur(s['auth'])}: **richiede autorizzazione della direzione**.")
 
-        with cR:
-            st.markdown("##### Controproposta")
-            st.markdown(f"""
+            with cR:
+                st.markdown("##### Controproposta")
+                st.markdown(f"""
             <div class="vt-card">
               <p style="margin:0 0 6px;font-size:.86rem;color:#555">
                  Tariffa bed di <b>break-even</b> (displacement = 0)</p>
@@ -483,57 +480,76 @@ else:
                  ≈ {eur(controproposta*pax_cam)}/camera ADR room</p>
             </div>""", unsafe_allow_html=True)
 
-        # --- grafici ---
-        g1, g2 = st.columns(2)
-        with g1:
-            fig = go.Figure()
-            fig.add_bar(name="Ricavo camere", x=["Gruppo"], y=[rev_camere], marker_color=PRIM)
-            fig.add_bar(name="Ricavo ancillare", x=["Gruppo"], y=[rev_anc], marker_color=ACCENT)
-            fig.add_bar(name="Vendita alternativa attesa", x=["Alternativa"],
-                        y=[rev_alt_atteso], marker_color="#9AA7AD")
-            fig.update_layout(barmode="stack", title="Valore gruppo vs alternativa",
-                              height=340, margin=dict(t=46, b=10, l=10, r=10),
-                              legend=dict(orientation="h", y=-0.18))
-            st.plotly_chart(fig, use_container_width=True)
-        with g2:
-            fig2 = go.Figure(go.Bar(
-                x=["Proposta gruppo", "Soglia ADR", "FIT bed", "TO netto bed"],
-                y=[tariffa, soglia_bed, fit_w, to_w],
-                marker_color=[ACCENT, GIALLO, PRIM, "#9AA7AD"],
-                text=[eur2(v) for v in [tariffa, soglia_bed, fit_w, to_w]],
-                textposition="outside"))
-            fig2.update_layout(title="ADR bed — confronto (€/pax/notte)",
-                               height=340, margin=dict(t=46, b=10, l=10, r=10),
-                               yaxis_title="€/pax/notte")
-            st.plotly_chart(fig2, use_container_width=True)
-
-        # --- dettaglio periodi ---
-        with st.expander("🔎 Dettaglio periodi del soggiorno"):
-            det = pd.DataFrame([
-                {"Periodo": k, "Notti": v["notti"],
-                 f"FIT bed {meal}": eur2(v["fit"]), f"TO bed {meal}": eur2(v["to"]),
-                 "MLOS": v["min"], "Allotment periodo": v["allot"]}
-                for k, v in seg.items()])
-            st.dataframe(det, use_container_width=True, hide_index=True)
-            st.caption(f"Tariffe pesate sul soggiorno → FIT bed {eur2(fit_w)} · "
-                       f"TO bed {eur2(to_w)} · MLOS effettivo (più restrittivo) {min_stay_eff}.")
-
-        # --- salva ---
-        record = {
-            "Gruppo": nome_gruppo, "Check-in": check_in.strftime("%d/%m/%Y"),
-            "Check-out": check_out.strftime("%d/%m/%Y"), "Notti": notti,
-            "Camere": camere, "Pax/cam": pax_cam, "Pax": round(pax),
-            "Meal": meal, "ADR bed": round(tariffa, 2),
-            "Valore totale": round(rev_totale), "Displacement": round(displacement),
-            "Controproposta bed": controproposta, "Verdetto": verdetto,
-        }
-        if st.button("💾 Salva valutazione nel riepilogo", use_container_width=True):
-            st.session_state.valutazioni.append(record)
-            st.success("Valutazione salvata. La trovi nella sezione «Riepilogo valutazioni».")
-
-    # ---------- METODOLOGIA ----------
-    with st.expander("ℹ️ Metodologia di calcolo"):
-        st.markdown("""
+            # --- grafici ---
+            g1, g2 = st.columns(2)
+            with g1:
+                fig = go.Figure()
+                fig.add_bar(name="Ricavo camere", x=["Gruppo"], y=[rev_camere], marker_color=PRIM)
+                fig.add_bar(name="Ricavo ancillare", x=["Gruppo"], y=[rev_anc], marker_color=ACCENT)
+                fig.add_bar(name="Vendita alternativa attesa", x=["Alternativa"],
+                            y=[rev_alt_atteso], marker_color="#9AA7AD")
+                fig.update_layout(barmode="stack", title="Valore gruppo vs alternativa",
+                                  height=340, margin=dict(t=46, b=10, l=10, r=10),
+                                  legend=dict(orientation="h", y=-0.18))
+                grafico(fig)
+            with g2:
+                fig2 = go.Figure(go.Bar(
+                    x=["Proposta gruppo", "Soglia ADR", "FIT bed", "TO netto bed"],
+                    y=[tariffa, soglia_bed, fit_w, to_w],
+                    marker_color=[ACCENT, GIALLO, PRIM, "#9AA7AD"],
+                    text=[eur2(v) for v in [tariffa, soglia_bed, fit_w, to_w]],
+                    textposition="outside"))
+                fig2.update_layout(title="ADR bed — confronto (€/pax/notte)",
+                                   height=340, margin=dict(t=46, b=10, l=10, r=10),
+                                   yaxis_title="€/pax/notte")
+                grafico(fig2)
+
+            # --- dettaglio periodi ---
+            with st.expander("🔎 Dettaglio periodi del soggiorno"):
+                det = pd.DataFrame([
+                    {"Periodo": k, "Notti": x["notti"],
+                     f"FIT bed {meal}": eur2(x["web"]), f"TO bed {meal}": eur2(x["alpi"]),
+                     "MLOS": x["min"], "Allotment periodo": x["allot"]}
+                    for k, x in seg.items()])
+                st.dataframe(det, use_container_width=True, hide_index=True)
+                st.caption(f"Tariffe pesate sul soggiorno → FIT bed {eur2(fit_w)} · "
+                           f"TO bed {eur2(to_w)} · MLOS effettivo (più restrittivo) "
+                           f"{min_stay_eff}.")
+
+            # --- salva ---
+            st.button("💾 Salva valutazione nel riepilogo", use_container_width=True,
+                      on_click=salva_valutazione,
+                      args=(v, "v1", "Valutazione salvata. La trovi nella sezione «Riepilogo "
+                                       "valutazioni»."))
+
+        # ---------- CONTROPROPOSTE PER MEAL PLAN E PAX ----------
+        tab = (controproposte(check_in, check_out, camere, occupancy, pickup, ancillare)
+               if check_out > check_in and not st.session_state.periodi.empty else None)
+        if tab is not None:
+            with st.expander("📋 Controproposte per meal plan e pax/camera"):
+                if np.ndim(allot_residuo):
+                    residuo = (f"{min(allot_residuo.min(), camere)}–"
+                               f"{min(allot_residuo.max(), camere)} per notte")
+                else:
+                    residuo = f"{min(allot_residuo, camere)}"
+                st.caption(f"Allotment residuo {residuo} · occupancy {occupancy}% "
+                           f"· pick-up {pickup}%. Il break-even bed non dipende dal pax/camera; "
+                           "la tariffa room sì.")
+                st.dataframe(tab.riepilogo(allot_residuo), hide_index=True,
+                             use_container_width=True)
+                room = tab.per_pax(allot_residuo)
+                st.dataframe(room.style.format("{:,.0f} €").highlight_between(
+                                 subset=pd.IndexSlice[[round(pax_cam, 2)], [meal]]
+                                 if round(pax_cam, 2) in room.index else pd.IndexSlice[[], []],
+                                 color="#F3D9C4"),
+                             use_container_width=True, height=280)
+                bottone_export("⬇️ Esporta tabella completa (meal × pax × allotment)",
+                               {"Controproposte": tab.frame()}, "voi_controproposte",
+                               "controproposte")
+
+        # ---------- METODOLOGIA ----------
+        with st.expander("ℹ️ Metodologia di calcolo"):
+            st.markdown("""
 **Logica di valutazione**
 
 - **ADR bed** è la metrica primaria: tariffa per pax/notte. L'**ADR room** è derivato moltiplicando per il rapporto pax/cam (default 2,25 per i gruppi leisure).
@@ -545,3 +561,24 @@ else:
 - La **soglia ADR bed** è una percentuale della tariffa FIT bed del periodo, crescente con l'occupancy attesa (configurabile nella barra laterale).
 - La **controproposta** suggerita è la più alta tra la tariffa di break-even (displacement nullo) e la soglia ADR.
 """)
+finally:
+    # anche i rerun interrotti da st.stop() / st.rerun() finiscono nelle metriche
+    ripartizione = PERF.chiudi_run()
+
+
+# ------------------------------------------------------------------
+# PANNELLO PRESTAZIONI
+# ------------------------------------------------------------------
+if mostra_perf:
+    with pannello_perf:
+        if not PERF.attivo:
+            st.caption("Cronometri disattivati (VOI_PERF=0).")
+        else:
+            st.caption(f"Ultimo rerun · {pagina}")
+            st.dataframe(ripartizione, hide_index=True, use_container_width=True,
+                         column_config={"Chiamate": st.column_config.NumberColumn(format="%d"),
+                                        "ms": st.column_config.NumberColumn(format="%.1f")})
+            st.caption(f"Processo · p50/p95 sugli ultimi campioni · {PERF.percorso.name}")
+            st.dataframe(PERF.riepilogo(), hide_index=True, use_container_width=True,
+                         column_config={c: st.column_config.NumberColumn(format="%.1f")
+                                        for c in ("p50 ms", "p95 ms", "max ms")})
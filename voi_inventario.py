@@ -0,0 +1,297 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  inventario
+Libro notti persistente (SQLite): capacità della casa, allotment
+Alpitour, venduto e camere trattenute dai gruppi, notte per notte.
+Allotment residuo e sforamento calcolati per notte su array.
+==================================================================
+"""
+
+import sqlite3
+import threading
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from voi_engine import notti_soggiorno
+from voi_storico import DATA_DIR
+
+# colonna SQL -> intestazione delle tabelle notte per notte
+COLONNE_NOTTI = {"capacita": "Capacità", "allotment": "Allotment ALPI",
+                 "venduto_alpi": "Venduto ALPI", "venduto": "Venduto casa"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notti (
+    giorno INTEGER PRIMARY KEY,
+    capacita INTEGER NOT NULL,
+    allotment INTEGER NOT NULL DEFAULT 0,
+    venduto_alpi INTEGER NOT NULL DEFAULT 0,
+    venduto INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blocchi (
+    id INTEGER PRIMARY KEY,
+    registrato TEXT NOT NULL,
+    app TEXT NOT NULL,
+    gruppo TEXT NOT NULL,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    camere INTEGER NOT NULL,
+    valutazione INTEGER
+);
+CREATE TABLE IF NOT EXISTS impegni (
+    blocco INTEGER NOT NULL,
+    giorno INTEGER NOT NULL,
+    allot INTEGER NOT NULL,
+    casa INTEGER NOT NULL,
+    PRIMARY KEY (blocco, giorno)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_impegni_giorno ON impegni (giorno, allot, casa);
+"""
+
+_RANGE = """
+SELECT n.giorno, n.capacita, n.allotment, n.venduto_alpi, n.venduto,
+       COALESCE(SUM(i.allot), 0), COALESCE(SUM(i.casa), 0)
+FROM notti n LEFT JOIN impegni i ON i.giorno = n.giorno
+WHERE n.giorno BETWEEN ? AND ?
+GROUP BY n.giorno ORDER BY n.giorno
+"""
+
+
+@dataclass(slots=True)
+class Disponibilita:
+    """Stato dell'inventario su un insieme di notti (array allineati a ``giorni``).
+
+    Le notti assenti dal libro hanno ``noto`` falso e valori a zero.
+    """
+    giorni: np.ndarray
+    capacita: np.ndarray
+    allotment: np.ndarray
+    venduto_alpi: np.ndarray
+    venduto: np.ndarray
+    gruppi_allot: np.ndarray
+    gruppi_casa: np.ndarray
+    noto: np.ndarray
+
+    @property
+    def libere(self):
+        """Camere fisicamente libere (venduto e gruppi tolti dalla capacità)."""
+        occupate = self.venduto_alpi + self.venduto + self.gruppi_allot + self.gruppi_casa
+        return np.maximum(self.capacita - occupate, 0)
+
+    @property
+    def residuo_allot(self):
+        """Camere ancora libere nell'allotment Alpitour, entro le camere libere."""
+        return np.minimum(np.maximum(self.allotment - self.venduto_alpi - self.gruppi_allot, 0),
+                          self.libere)
+
+    @property
+    def libere_casa(self):
+        """Camere di casa vendibili oltre l'allotment (il residuo resta ad Alpitour)."""
+        return self.libere - self.residuo_allot
+
+    @property
+    def occupazione(self):
+        """Occupazione già in casa (venduto e gruppi) in % della capacità."""
+        occupate = self.venduto_alpi + self.venduto + self.gruppi_allot + self.gruppi_casa
+        return np.where(self.capacita > 0, 100 * occupate / np.maximum(self.capacita, 1), 0.0)
+
+    @property
+    def completa(self):
+        return bool(len(self.giorni)) and bool(self.noto.all())
+
+    def per_gruppo(self, camere):
+        """Ripartizione di un gruppo di ``camere`` notte per notte: entro allotment,
+        oltre allotment (inventario di casa) e sforamento della capacità."""
+        entro = np.minimum(camere, self.residuo_allot)
+        oltre = camere - entro
+        return {"entro": entro, "oltre": oltre,
+                "sforamento": np.maximum(oltre - self.libere_casa, 0)}
+
+    def tabella(self, camere=None):
+        """Una riga per notte, con la ripartizione del gruppo se indicato."""
+        df = pd.DataFrame({"Notte": self.giorni.astype("datetime64[D]"),
+                           "Capacità": self.capacita, "Allotment ALPI": self.allotment,
+                           "Venduto ALPI": self.venduto_alpi, "Venduto casa": self.venduto,
+                           "Gruppi in allotment": self.gruppi_allot,
+                           "Gruppi su casa": self.gruppi_casa,
+                           "Allotment residuo": self.residuo_allot,
+                           "Casa libera": self.libere_casa})
+        if camere is not None:
+            g = self.per_gruppo(camere)
+            df["Gruppo entro allotment"] = g["entro"]
+            df["Gruppo oltre allotment"] = g["oltre"]
+            df["Sforamento"] = g["sforamento"]
+        return df[self.noto].reset_index(drop=True)
+
+
+class RegistroInventario:
+    """Libro notti in ``<radice>/inventario.sqlite``, condiviso da v1 e v2.
+
+    Le notti sono ordinali giorno (come nel motore). Un gruppo bloccato trattiene
+    per ogni notte le camere entro l'allotment residuo e il resto sulla casa;
+    lettura del residuo e scrittura degli impegni avvengono nella stessa
+    transazione ``BEGIN IMMEDIATE``, quindi due analisti che bloccano gruppi
+    sovrapposti vengono serializzati e il secondo vede gli impegni del primo.
+    """
+
+    def __init__(self, radice=DATA_DIR):
+        self.percorso = Path(radice) / "inventario.sqlite"
+        self._pronto = False
+        self._lock = threading.Lock()
+
+    def _connetti(self):
+        if not self._pronto:
+            with self._lock:
+                self.percorso.parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.percorso)) as con:
+                    con.execute("PRAGMA journal_mode=WAL")
+                    con.executescript(_SCHEMA)
+                self._pronto = True
+        return closing(sqlite3.connect(self.percorso, timeout=10, isolation_level=None))
+
+    @staticmethod
+    def _leggi(con, giorni):
+        giorni = np.asarray(giorni, dtype=np.int64)
+        righe = con.execute(_RANGE, [int(giorni.min()), int(giorni.max())]).fetchall() \
+            if len(giorni) else []
+        tab = np.array(righe, dtype=np.int64).reshape(-1, 7)
+        k = np.clip(np.searchsorted(tab[:, 0], giorni), 0, max(len(tab) - 1, 0))
+        noto = tab[k, 0] == giorni if len(tab) else np.zeros(len(giorni), dtype=bool)
+        col = [np.where(noto, tab[k, j], 0) if len(tab) else np.zeros(len(giorni), np.int64)
+               for j in range(1, 7)]
+        return Disponibilita(giorni, *col, noto=noto)
+
+    # ---------- letture ----------
+    def disponibilita(self, giorni):
+        """Stato delle notti indicate (array di ordinali, anche non contigui)."""
+        with self._connetti() as con:
+            return self._leggi(con, giorni)
+
+    def soggiorno(self, check_in, check_out):
+        return self.disponibilita(notti_soggiorno(check_in, check_out))
+
+    def soggiorni(self, inizio, notti):
+        """Per ogni soggiorno (ordinale del check-in, notti): allotment residuo della
+        notte più critica (``residuo``) e occupazione media già in casa in %
+        (``occupazione``); NaN se il soggiorno ha notti fuori dal libro."""
+        inizio = np.asarray(inizio, dtype=np.int64)
+        notti = np.clip(np.asarray(notti, dtype=np.int64), 0, None)
+        riga = np.repeat(np.arange(len(inizio)), notti)
+        primo = np.cumsum(notti) - notti
+        giorni = inizio[riga] + (np.arange(len(riga)) - np.repeat(primo, notti))
+        d = self.disponibilita(giorni)
+        out = {"residuo": np.full(len(inizio), np.nan), "occupazione": np.full(len(inizio), np.nan)}
+        if len(giorni):
+            piene = notti > 0
+            res = np.where(d.noto, d.residuo_allot, np.nan)
+            occ = np.where(d.noto, d.occupazione, np.nan)
+            out["residuo"][piene] = np.minimum.reduceat(res, primo[piene])
+            out["occupazione"][piene] = np.add.reduceat(occ, primo[piene]) / notti[piene]
+        return out
+
+    def intervallo(self, dal, al):
+        """Stato delle notti fra due date, incluse."""
+        return self.disponibilita(notti_soggiorno(dal, pd.Timestamp(al) + pd.Timedelta(days=1)))
+
+    def periodo(self, dal, al):
+        """Serie per data (allotment residuo, casa libera) delle notti note fra due
+        date incluse, nel formato atteso da ``ottimizza_portafoglio``."""
+        d = self.intervallo(dal, al)
+        date = pd.to_datetime(d.giorni[d.noto].astype("datetime64[D]"))
+        return (pd.Series(d.residuo_allot[d.noto], index=date, dtype=float),
+                pd.Series(d.libere_casa[d.noto], index=date, dtype=float))
+
+    def blocchi(self, app=None):
+        sql = "SELECT id, registrato, app, gruppo, check_in, check_out, camere FROM blocchi"
+        par = []
+        if app is not None:
+            sql += " WHERE app = ?"
+            par.append(app)
+        with self._connetti() as con:
+            df = pd.read_sql_query(sql + " ORDER BY check_in, id", con, params=par)
+        for c in ("check_in", "check_out"):
+            df[c] = pd.to_datetime(df[c]).dt.strftime("%d/%m/%Y")
+        df["registrato"] = pd.to_datetime(df["registrato"]).dt.strftime("%d/%m/%Y %H:%M")
+        return df.rename(columns={"id": "Blocco", "registrato": "Registrato", "app": "App",
+                                  "gruppo": "Gruppo", "check_in": "Check-in",
+                                  "check_out": "Check-out", "camere": "Camere"})
+
+    # ---------- scritture ----------
+    def imposta_notti(self, notti):
+        """Inserisce o aggiorna le notti di un DataFrame con «Notte» e le colonne di
+        ``COLONNE_NOTTI`` (quelle assenti restano invariate, o a zero se nuove)."""
+        df = notti.dropna(subset=["Notte"])
+        giorni = (pd.to_datetime(df["Notte"]).to_numpy("datetime64[D]").astype(np.int64)).tolist()
+        colonne = [c for c, h in COLONNE_NOTTI.items() if h in df.columns]
+        if "capacita" not in colonne:
+            raise ValueError("Manca la colonna «Capacità».")
+        valori = [pd.to_numeric(df[COLONNE_NOTTI[c]], errors="coerce").fillna(0)
+                  .clip(lower=0).astype(int).tolist() for c in colonne]
+        sql = (f"INSERT INTO notti (giorno, {', '.join(colonne)}) "
+               f"VALUES (?, {', '.join('?' * len(colonne))}) ON CONFLICT (giorno) DO UPDATE SET "
+               + ", ".join(f"{c} = excluded.{c}" for c in colonne))
+        with self._connetti() as con:
+            con.execute("BEGIN IMMEDIATE")
+            con.executemany(sql, zip(giorni, *valori))
+            con.execute("COMMIT")
+        return len(giorni)
+
+    def notti_da_periodi(self, indice, dal, al, capacita):
+        """Notti fra due date (incluse) con l'allotment dei periodi e una capacità
+        unica per la casa; il venduto già registrato non viene toccato."""
+        cal = indice.tariffe(dal, al, ["Allotment ALPI"])
+        df = pd.DataFrame({"Notte": cal["Notte"], "Capacità": capacita,
+                           "Allotment ALPI": cal["Allotment ALPI"]})
+        return self.imposta_notti(df)
+
+    def blocca(self, gruppo, check_in, check_out, camere, app, valutazione=None,
+               consenti_sforamento=False):
+        """Trattiene le camere di un gruppo notte per notte; ritorna l'id del blocco.
+
+        Solleva ``ValueError`` se qualche notte manca dal libro o, salvo
+        ``consenti_sforamento``, se la casa non ha camere sufficienti.
+        """
+        giorni = notti_soggiorno(check_in, check_out)
+        if not len(giorni) or camere <= 0:
+            raise ValueError("Soggiorno o camere non validi.")
+        with self._connetti() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                d = self._leggi(con, giorni)
+                if not d.noto.all():
+                    raise ValueError(f"{int((~d.noto).sum())} notti del soggiorno non sono "
+                                     "nell'inventario.")
+                g = d.per_gruppo(int(camere))
+                if g["sforamento"].any() and not consenti_sforamento:
+                    raise ValueError(f"Capacità superata di {int(g['sforamento'].max())} camere "
+                                     "nella notte più critica.")
+                cur = con.execute(
+                    "INSERT INTO blocchi (registrato, app, gruppo, check_in, check_out, camere, "
+                    "valutazione) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [datetime.now().isoformat(timespec="seconds"), app, gruppo,
+                     check_in.isoformat(), check_out.isoformat(), int(camere), valutazione])
+                blocco = cur.lastrowid
+                con.executemany("INSERT INTO impegni VALUES (?, ?, ?, ?)",
+                                zip([blocco] * len(giorni), giorni.tolist(),
+                                    g["entro"].tolist(), g["oltre"].tolist()))
+            except BaseException:
+                con.execute("ROLLBACK")
+                raise
+            con.execute("COMMIT")
+            return blocco
+
+    def rilascia(self, blocco):
+        """Libera le camere di un blocco; ritorna le notti liberate."""
+        with self._connetti() as con:
+            con.execute("BEGIN IMMEDIATE")
+            n = con.execute("DELETE FROM impegni WHERE blocco = ?", [blocco]).rowcount
+            con.execute("DELETE FROM blocchi WHERE id = ?", [blocco])
+            con.execute("COMMIT")
+            return n
+
+
+INVENTARIO = RegistroInventario()
@@ -0,0 +1,39 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  processo lettore degli storici
+Entry point dei worker di ``voi_storico.leggi_storici``: riceve i
+byte di un workbook su stdin e restituisce l'esito su stdout, un
+file per volta, finché il processo padre non chiude la pipe.
+==================================================================
+"""
+
+import os
+import pickle
+import sys
+
+from voi_storico import _leggi_bytes
+
+
+def servi(entrata, uscita):
+    """Ciclo del worker: ``(True, esito)`` o ``(False, eccezione)`` per ogni richiesta."""
+    while True:
+        try:
+            dati = pickle.load(entrata)
+        except EOFError:
+            return
+        try:
+            risposta = pickle.dumps((True, _leggi_bytes(dati)))
+        except Exception as e:
+            try:
+                risposta = pickle.dumps((False, e))
+            except Exception:
+                risposta = pickle.dumps((False, RuntimeError(f"{type(e).__name__}: {e}")))
+        uscita.write(risposta)
+        uscita.flush()
+
+
+if __name__ == "__main__":
+    # stdout è il canale delle risposte: eventuali print delle librerie vanno su stderr
+    risposte = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    servi(sys.stdin.buffer, risposte)
@@ -0,0 +1,122 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  prestazioni
+Cronometri per fase sui percorsi caldi (lettura Excel, match
+periodi, aggregazione, grafici, export): ripartizione del rerun
+corrente e file di metriche a finestra mobile (p50/p95 per fase).
+==================================================================
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from voi_storico import DATA_DIR
+
+ATTIVO = os.environ.get("VOI_PERF", "1") != "0"     # VOI_PERF=0 → cronometri spenti
+FINESTRA = 500           # ultimi campioni per fase su cui si calcolano i percentili
+INTERVALLO_FILE = 10.0   # secondi minimi fra due scritture del file metriche
+RERUN = "rerun"          # fase che misura l'intero script
+
+
+class Cronometri:
+    """Tempi per fase, per processo (file metriche) e per rerun (pannello).
+
+    ``fase`` è un context manager; da spento ritorna sempre lo stesso
+    ``nullcontext``, quindi il costo è un attributo letto. La ripartizione del
+    rerun è per thread: Streamlit esegue lo script di ogni sessione sul proprio.
+    """
+
+    def __init__(self, percorso=DATA_DIR / "metriche_perf.json", attivo=ATTIVO):
+        self.percorso = Path(percorso)
+        self.attivo = attivo
+        self._campioni = {}      # fase -> deque dei tempi (ms)
+        self._conteggi = {}      # fase -> misure dall'avvio del processo
+        self._lock = threading.Lock()
+        self._run = threading.local()
+        self._scritto = 0.0
+        self._nullo = nullcontext()
+
+    def fase(self, nome):
+        return self._misura(nome) if self.attivo else self._nullo
+
+    @contextmanager
+    def _misura(self, nome):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registra(nome, time.perf_counter() - t0)
+
+    def registra(self, nome, secondi):
+        ms = secondi * 1000
+        with self._lock:
+            self._campioni.setdefault(nome, deque(maxlen=FINESTRA)).append(ms)
+            self._conteggi[nome] = self._conteggi.get(nome, 0) + 1
+        run = getattr(self._run, "fasi", None)
+        if run is not None:
+            run.append((nome, ms))
+
+    # ---------- rerun ----------
+    def inizia_run(self):
+        if self.attivo:
+            self._run.fasi, self._run.t0 = [], time.perf_counter()
+
+    def chiudi_run(self):
+        """Ripartizione del rerun (fase, chiamate, ms), con la quota non cronometrata
+        (widget e layout) e il totale; aggiorna il file metriche se è il momento."""
+        fasi = getattr(self._run, "fasi", None)
+        if not self.attivo or fasi is None:
+            return pd.DataFrame(columns=["Fase", "Chiamate", "ms"])
+        totale = (time.perf_counter() - self._run.t0) * 1000
+        self._run.fasi = None
+        self.registra(RERUN, totale / 1000)
+        df = (pd.DataFrame(fasi, columns=["Fase", "ms"]).groupby("Fase", sort=False)["ms"]
+              .agg(Chiamate="size", ms="sum").reset_index())
+        altro = max(totale - df["ms"].sum(), 0.0)
+        # righe di riepilogo senza chiamate: Chiamate in float, così NaN non cambia il dtype
+        df = df.astype({"Chiamate": float, "ms": float})
+        df.loc[len(df)] = ("altro (widget e layout)", np.nan, altro)
+        df.loc[len(df)] = ("totale rerun", np.nan, totale)
+        if time.monotonic() - self._scritto >= INTERVALLO_FILE:
+            self.scrivi()
+        return df
+
+    # ---------- metriche ----------
+    def riepilogo(self):
+        """Per fase: misure dall'avvio e p50/p95/max sugli ultimi ``FINESTRA`` campioni."""
+        with self._lock:
+            dati = {k: (self._conteggi[k], np.fromiter(v, float)) for k, v in self._campioni.items()}
+        return pd.DataFrame([{"Fase": k, "Misure": n, "p50 ms": np.percentile(x, 50),
+                              "p95 ms": np.percentile(x, 95), "max ms": x.max()}
+                             for k, (n, x) in dati.items()],
+                            columns=["Fase", "Misure", "p50 ms", "p95 ms", "max ms"])
+
+    def scrivi(self):
+        """Riepilogo in JSON, scritto su file temporaneo e poi rinominato (chi lo
+        legge non trova mai un file a metà)."""
+        self._scritto = time.monotonic()
+        r = self.riepilogo()
+        dati = {"aggiornato": datetime.now().isoformat(timespec="seconds"), "pid": os.getpid(),
+                "finestra": FINESTRA,
+                "fasi": {f: {"conteggio": int(n), "p50_ms": round(p50, 2),
+                             "p95_ms": round(p95, 2), "max_ms": round(mx, 2)}
+                         for f, n, p50, p95, mx in r.itertuples(index=False, name=None)}}
+        try:
+            self.percorso.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.percorso.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(dati, indent=1, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.percorso)
+        except OSError:
+            pass        # le metriche non devono mai fermare l'app
+
+
+PERF = Cronometri()
@@ -0,0 +1,373 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  ottimizzazione portafoglio gruppi
+Scelta del sottoinsieme di richieste (con eventuale controproposta)
+che massimizza il valore netto del displacement a due livelli,
+rispettando allotment ALPI e camere di casa notte per notte.
+==================================================================
+"""
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from voi_engine import (COLONNE_SOGGIORNO, VERDETTI, normalizza_richieste, scomponi_soggiorno,
+                        valuta_batch)
+
+RIFIUTA, ACCETTA, CONTROPROPOSTA = 0, 1, 2
+SCELTE = np.array(["Rifiutare", "Accettare", "Controproposta"])
+N_ESATTO = 20          # oltre questo numero di richieste valide si passa all'euristica
+COLONNE_NOTTE = {k: COLONNE_SOGGIORNO[k] for k in ("web", "alpi", "occ", "util")}
+
+
+# ------------------------------------------------------------------
+# MODELLO
+# ------------------------------------------------------------------
+def costo_notti(camere, letti, allot, atteso_allot, atteso_web):
+    """€ attesi dall'alternativa notte per notte per le camere occupate dai gruppi.
+
+    Le camere entrano prima nell'allotment residuo (valore Alpitour × utilizzo),
+    il resto erode l'inventario WEB (valore WEB × pick-up); i letti sono ripartiti
+    in proporzione alle camere. Con un solo gruppo coincide con ``valuta_displacement``.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        quota = np.where(camere > 0, np.minimum(camere, allot) / camere, 0.0)
+    return letti * (quota * atteso_allot + (1 - quota) * atteso_web)
+
+
+@dataclass(slots=True)
+class _Problema:
+    occupa: np.ndarray      # G×N bool: il gruppo occupa la notte
+    camere: np.ndarray      # G
+    letti: np.ndarray       # G (camere × pax)
+    ricavi: np.ndarray      # G×3 valore atteso di ogni scelta (nan = non disponibile)
+    allot: np.ndarray       # N
+    capacita: np.ndarray    # N camere vendibili ai gruppi (allotment + casa)
+    atteso_allot: np.ndarray
+    atteso_web: np.ndarray
+
+    def carichi(self, scelte):
+        dentro = scelte > 0
+        return (self.camere[dentro] @ self.occupa[dentro],
+                self.letti[dentro] @ self.occupa[dentro])
+
+    def costo(self, camere, letti):
+        return costo_notti(camere, letti, self.allot, self.atteso_allot,
+                           self.atteso_web).sum(axis=-1)
+
+    def valore(self, scelte):
+        ric = self.ricavi[np.arange(len(scelte)), scelte]
+        return float(np.nansum(ric) - self.costo(*self.carichi(scelte)))
+
+
+# ------------------------------------------------------------------
+# RISOLUTORI
+# ------------------------------------------------------------------
+class _Scaduto(Exception):
+    pass
+
+
+def _esatto(p, scadenza, incumbent):
+    """Branch & bound sulle scelte di ogni gruppo; ottimo garantito se finisce in tempo.
+
+    Il limite superiore usa, per ogni notte, il più basso dei due valori attesi
+    (allotment o WEB): nessun sottoinsieme può costare meno di così.
+    """
+    g_tot, n = p.occupa.shape
+    minimo = p.occupa @ np.minimum(p.atteso_allot, p.atteso_web)
+    netti = np.where(np.isnan(p.ricavi), -np.inf, p.ricavi - (p.letti * minimo)[:, None])
+    netti[:, RIFIUTA] = 0.0
+    ottimista = netti.max(axis=1)
+    resto = np.concatenate([np.cumsum(ottimista[::-1])[::-1], [0.0]])
+    opzioni = [np.argsort(-netti[g], kind="stable") for g in range(g_tot)]
+
+    migliore = [p.valore(incumbent), incumbent.copy()]
+    scelte = np.zeros(g_tot, dtype=np.int64)
+    nodi = 0
+
+    def visita(i, camere, letti, ricavo, parziale):
+        nonlocal nodi
+        nodi += 1
+        if not nodi % 512 and time.perf_counter() > scadenza:
+            raise _Scaduto
+        val = ricavo - p.costo(camere, letti)
+        if val > migliore[0] + 1e-6:
+            migliore[0], migliore[1] = val, scelte.copy()
+        if i == g_tot or parziale + resto[i] <= migliore[0] + 1e-6:
+            return
+        m = p.occupa[i]
+        for k in opzioni[i]:
+            if not np.isfinite(netti[i, k]):
+                continue
+            if k == RIFIUTA:
+                visita(i + 1, camere, letti, ricavo, parziale)
+                continue
+            nuove = camere + p.camere[i] * m
+            if (nuove[m] > p.capacita[m]).any():
+                continue
+            scelte[i] = k
+            visita(i + 1, nuove, letti + p.letti[i] * m, ricavo + p.ricavi[i, k],
+                   parziale + netti[i, k])
+            scelte[i] = RIFIUTA
+
+    try:
+        visita(0, np.zeros(n), np.zeros(n), 0.0, 0.0)
+        completo = True
+    except _Scaduto:
+        completo = False
+    return migliore[1], completo, nodi
+
+
+def _riempi(p, scelte, scadenza, esclusi=None):
+    """Greedy: aggiunge la scelta con il guadagno marginale più alto finché conviene."""
+    camere, letti = p.carichi(scelte)
+    dc = p.camere[:, None] * p.occupa
+    dl = p.letti[:, None] * p.occupa
+    mosse = 0
+    while time.perf_counter() < scadenza:
+        nuove = camere + dc
+        fattibile = (scelte == RIFIUTA) & ~((nuove > p.capacita) & p.occupa).any(axis=1)
+        if esclusi is not None:
+            fattibile &= ~esclusi
+        delta_costo = p.costo(nuove, letti + dl) - p.costo(camere, letti)
+        guadagno = np.where(fattibile[:, None], p.ricavi - delta_costo[:, None], np.nan)
+        guadagno[:, RIFIUTA] = np.nan
+        if np.isnan(guadagno).all() or np.nanmax(guadagno) <= 1e-6:
+            break
+        g, k = np.unravel_index(np.nanargmax(guadagno), guadagno.shape)
+        scelte[g] = k
+        camere, letti = camere + dc[g], letti + dl[g]
+        mosse += 1
+    return scelte, mosse
+
+
+def _migliora(p, scelte, scadenza):
+    """Ricerca locale: cambio di scelta di un gruppo, poi scambio accettato/rifiutato."""
+    g_tot = len(scelte)
+    dc = p.camere[:, None] * p.occupa
+    dl = p.letti[:, None] * p.occupa
+    valore = p.valore(scelte)
+    mosse = 0
+    migliora = True
+    while migliora and time.perf_counter() < scadenza:
+        migliora = False
+        for g in range(g_tot):
+            for k in (RIFIUTA, ACCETTA, CONTROPROPOSTA):
+                if k == scelte[g] or np.isnan(p.ricavi[g, k]):
+                    continue
+                prova = scelte.copy()
+                prova[g] = k
+                c, _ = p.carichi(prova)
+                if (c > p.capacita).any():
+                    continue
+                v = p.valore(prova)
+                if v > valore + 1e-6:
+                    scelte, valore, migliora = prova, v, True
+                    mosse += 1
+            if time.perf_counter() > scadenza:
+                break
+        if migliora:
+            continue
+        # scambio: fuori un gruppo accettato, dentro il miglior rifiutato che ora entra
+        for g in np.flatnonzero(scelte > 0):
+            base = scelte.copy()
+            base[g] = RIFIUTA
+            c0, l0 = p.carichi(base)
+            nuove = c0 + dc
+            fattibile = (base == RIFIUTA) & ~((nuove > p.capacita) & p.occupa).any(axis=1)
+            fattibile[g] = False
+            if not fattibile.any():
+                continue
+            ric0 = float(np.nansum(p.ricavi[np.arange(g_tot), base]))
+            delta = p.costo(nuove, l0 + dl)
+            for k in (ACCETTA, CONTROPROPOSTA):
+                v = np.where(fattibile & ~np.isnan(p.ricavi[:, k]), ric0 + p.ricavi[:, k] - delta,
+                             -np.inf)
+                j = int(np.argmax(v))
+                if v[j] > valore + 1e-6:
+                    scelte = base
+                    scelte[j] = k
+                    valore, migliora = float(v[j]), True
+                    mosse += 1
+                    break
+            if migliora or time.perf_counter() > scadenza:
+                break
+    return scelte, valore, mosse
+
+
+def _euristico(p, scadenza, seme=0, pazienza=30):
+    """Greedy + ricerca locale, poi perturbazioni: toglie a caso un quarto dei gruppi
+    accettati, riempie senza di loro e rilancia la ricerca locale (che può
+    riprenderli). Si ferma a tempo scaduto o dopo ``pazienza`` tentativi a vuoto."""
+    rng = np.random.default_rng(seme)
+    scelte, mosse = _riempi(p, np.zeros(len(p.camere), dtype=np.int64), scadenza)
+    scelte, valore, m = _migliora(p, scelte, scadenza)
+    mosse += m
+    dentro = np.flatnonzero(scelte > 0)
+    senza = 0
+    while len(dentro) and senza < pazienza and time.perf_counter() < scadenza:
+        prova = scelte.copy()
+        tolti = np.zeros(len(scelte), dtype=bool)
+        tolti[rng.choice(dentro, max(1, len(dentro) // 4), replace=False)] = True
+        prova[tolti] = RIFIUTA
+        prova, m1 = _riempi(p, prova, scadenza, tolti)
+        prova, v, m2 = _migliora(p, prova, scadenza)
+        mosse += m1 + m2
+        if v > valore + 1e-6:
+            scelte, valore, senza = prova, v, 0
+            dentro = np.flatnonzero(scelte > 0)
+        else:
+            senza += 1
+    return scelte, mosse
+
+
+# ------------------------------------------------------------------
+# API
+# ------------------------------------------------------------------
+@dataclass(slots=True)
+class EsitoPortafoglio:
+    richieste: pd.DataFrame     # valutazione batch + scelta ottimale per riga
+    notti: pd.DataFrame         # carico per notte del portafoglio scelto
+    ricavo: float
+    alternativa: float
+    displacement: float
+    riferimento: float          # displacement accettando tutte le richieste «ACCETTARE»
+    metodo: str
+    ottimo: bool
+    iterazioni: int
+    secondi: float
+
+
+def _per_notte(valore, giorni, default):
+    """Scalare, Series/dict indicizzati per data oppure None (→ ``default``)."""
+    if valore is None:
+        return default
+    if np.isscalar(valore):
+        return np.full(len(giorni), float(valore))
+    s = pd.Series(valore)
+    s.index = pd.to_datetime(s.index).normalize()
+    date = pd.to_datetime(giorni.astype("datetime64[D]"))
+    return s.reindex(date).to_numpy(float)
+
+
+def ottimizza_portafoglio(indice, richieste, soglie, camere_casa=None, allotment=None,
+                          controproposte=True, prob_controproposta=50.0, calendario=None,
+                          tempo_max=5.0, inventario=None):
+    """Sceglie quali richieste accettare (e a quale tariffa) per massimizzare il valore netto.
+
+    Ogni richiesta valida può essere rifiutata, accettata alla tariffa proposta o,
+    se ``controproposte``, rilanciata alla controproposta del motore: in quel caso
+    il ricavo è pesato per la probabilità che il gruppo accetti (colonna
+    «Prob. controproposta %» o ``prob_controproposta``) e le camere restano
+    bloccate. Il costo è il displacement a due livelli calcolato sul carico
+    complessivo di ogni notte, con occupancy e utilizzo dai periodi (o dal
+    calendario storico); gli override di riga del foglio valgono solo per la
+    valutazione singola.
+
+    ``allotment`` (allotment ALPI residuo per notte) e ``camere_casa`` (camere di
+    casa vendibili ai gruppi oltre l'allotment) sono scalari, Series per data o
+    None: senza allotment vale, per ogni notte, il massimo «Allotment residuo»
+    delle righe che la coprono; senza ``camere_casa`` la casa non ha limite. Le
+    notti assenti da una Series seguono la stessa regola. ``inventario`` completa
+    l'allotment residuo delle righe come in ``valuta_batch``.
+    Fino a ``N_ESATTO`` richieste valide si usa un branch & bound esatto, oltre
+    (o se il tempo scade) un greedy con ricerca locale; ``tempo_max`` in secondi.
+    """
+    t0 = time.perf_counter()
+    scadenza = t0 + tempo_max
+    df = normalizza_richieste(richieste, inventario)
+    ris = valuta_batch(indice, df, soglie, calendario)
+    valida = (ris["Verdetto"] != "NON VALUTABILE").to_numpy()
+    righe = np.flatnonzero(valida)
+
+    inizio = df["Check-in"].to_numpy("datetime64[D]").astype(np.int64)
+    notti = ris["Notti"].to_numpy(np.int64)
+    if len(righe):
+        primo = int(inizio[righe].min())
+        giorni = np.arange(primo, int((inizio + notti)[righe].max()), dtype=np.int64)
+    else:
+        primo, giorni = 0, np.empty(0, dtype=np.int64)
+    n = len(giorni)
+
+    occupa = np.zeros((len(righe), n), dtype=bool)
+    for j, r in enumerate(righe):
+        occupa[j, inizio[r] - primo:inizio[r] - primo + notti[r]] = True
+
+    sog = scomponi_soggiorno(indice, giorni, COLONNE_NOTTE, calendario)
+    pos = sog.giorni - primo
+    atteso_allot, atteso_web = np.zeros(n), np.zeros(n)
+    atteso_allot[pos] = sog.valori["alpi*util"] / 100
+    atteso_web[pos] = sog.valori["web*occ"] / 100
+    in_periodo = np.zeros(n, dtype=bool)
+    in_periodo[pos] = True
+
+    residuo = df["Allotment residuo"].to_numpy(float)[righe]
+    dalle_righe = np.where(occupa, residuo[:, None], 0).max(axis=0, initial=0)
+    allot = _per_notte(allotment, giorni, dalle_righe)
+    allot = np.where(np.isnan(allot), dalle_righe, allot)
+    casa = _per_notte(camere_casa, giorni, np.full(n, np.inf))
+    casa = np.where(np.isnan(casa), np.inf, casa)
+
+    camere = ris["Camere"].to_numpy(float)[righe]
+    letti = camere * ris["Pax/cam"].to_numpy(float)[righe]
+    nv = (occupa & in_periodo).sum(axis=1)
+    anc = ris["Ancillare"].to_numpy(float)[righe]
+    tariffa = ris["ADR bed"].to_numpy(float)[righe]
+    contro = ris["Controproposta bed"].to_numpy(float)[righe]
+    if "Prob. controproposta %" in df.columns:
+        prob = df["Prob. controproposta %"].to_numpy(float)[righe]
+        prob = np.where(np.isnan(prob), prob_controproposta, prob)
+    else:
+        prob = np.full(len(righe), float(prob_controproposta))
+
+    ricavi = np.full((len(righe), 3), np.nan)
+    ricavi[:, RIFIUTA] = 0.0
+    ricavi[:, ACCETTA] = letti * nv * (tariffa + anc)
+    if controproposte:
+        rilancio = contro > tariffa
+        ricavi[rilancio, CONTROPROPOSTA] = (letti * nv * (contro + anc) * prob / 100)[rilancio]
+
+    p = _Problema(occupa=occupa, camere=camere, letti=letti, ricavi=ricavi, allot=allot,
+                  capacita=allot + casa, atteso_allot=atteso_allot, atteso_web=atteso_web)
+    if len(righe) <= N_ESATTO:
+        partenza, _ = _euristico(p, min(scadenza, t0 + tempo_max / 10))
+        scelte, ottimo, iterazioni = _esatto(p, scadenza, partenza)
+        metodo = "branch & bound" if ottimo else "branch & bound (interrotto al limite di tempo)"
+    else:
+        scelte, iterazioni = _euristico(p, scadenza)
+        ottimo, metodo = False, "euristico (greedy + ricerca locale)"
+
+    carico_c, carico_l = p.carichi(scelte)
+    alt_notte = costo_notti(carico_c, carico_l, allot, atteso_allot, atteso_web)
+    ricavo = float(np.nansum(ricavi[np.arange(len(righe)), scelte]))
+    alternativa = float(alt_notte.sum())
+
+    base = (ris["Verdetto"].to_numpy()[righe] == VERDETTI[0]).astype(np.int64)
+    riferimento = p.valore(base) if len(righe) else 0.0
+
+    scelta = np.full(len(ris), "Non valutabile", dtype=object)
+    scelta[righe] = SCELTE[scelte]
+    applicata = np.full(len(ris), np.nan)
+    applicata[righe] = np.select([scelte == ACCETTA, scelte == CONTROPROPOSTA],
+                                 [tariffa, contro], np.nan)
+    atteso = np.full(len(ris), np.nan)
+    atteso[righe] = ricavi[np.arange(len(righe)), scelte]
+    out = ris.assign(**{"Scelta portafoglio": scelta, "Tariffa applicata": applicata,
+                        "Ricavo atteso": atteso.round()})
+
+    in_allot = np.minimum(carico_c, allot)
+    per_notte = pd.DataFrame({
+        "Notte": pd.to_datetime(giorni.astype("datetime64[D]")).date,
+        "Camere gruppi": carico_c.astype(int), "Allotment residuo": allot.astype(int),
+        "Entro allotment": in_allot.astype(int),
+        "Oltre allotment": (carico_c - in_allot).astype(int),
+        "Capacità": np.where(np.isinf(p.capacita), np.nan, p.capacita),
+        "Alternativa attesa": alt_notte.round(),
+    })
+    return EsitoPortafoglio(richieste=out, notti=per_notte, ricavo=ricavo,
+                            alternativa=alternativa, displacement=ricavo - alternativa,
+                            riferimento=riferimento, metodo=metodo, ottimo=ottimo,
+                            iterazioni=int(iterazioni), secondi=time.perf_counter() - t0)
+
@@ -0,0 +1,135 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  registro valutazioni
+Storico persistente (SQLite) delle valutazioni salvate, con filtri
+indicizzati per check-in, gruppo e verdetto e lettura a pagine.
+==================================================================
+"""
+
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from voi_storico import DATA_DIR
+
+# colonna SQL -> intestazione del riepilogo (stesso ordine di EsitoValutazione.record)
+COLONNE_REGISTRO = {
+    "gruppo": "Gruppo", "check_in": "Check-in", "check_out": "Check-out", "notti": "Notti",
+    "camere": "Camere", "pax_cam": "Pax/cam", "pax": "Pax", "meal": "Meal",
+    "adr_bed": "ADR bed", "valore": "Valore totale", "displacement": "Displacement",
+    "controproposta": "Controproposta bed", "verdetto": "Verdetto",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS valutazioni (
+    id INTEGER PRIMARY KEY,
+    salvata TEXT NOT NULL,
+    app TEXT NOT NULL,
+    gruppo TEXT NOT NULL COLLATE NOCASE,
+    check_in TEXT NOT NULL,
+    check_out TEXT NOT NULL,
+    notti INTEGER, camere INTEGER, pax_cam REAL, pax INTEGER, meal TEXT,
+    adr_bed REAL, valore REAL, displacement REAL, controproposta REAL,
+    verdetto TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_valutazioni_check_in ON valutazioni (app, check_in);
+CREATE INDEX IF NOT EXISTS ix_valutazioni_gruppo ON valutazioni (app, gruppo);
+CREATE INDEX IF NOT EXISTS ix_valutazioni_verdetto ON valutazioni (app, verdetto);
+"""
+
+
+def _like(prefisso):
+    return prefisso.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class RegistroValutazioni:
+    """Registro append-only delle valutazioni in ``<radice>/valutazioni.sqlite``.
+
+    Ogni app scrive con la propria etichetta (``app``); le letture filtrano
+    sempre per app, così v1 e v2 condividono il file senza mescolare i riepiloghi.
+    Una connessione per operazione (Streamlit serve le sessioni su thread diversi),
+    WAL per lasciare le letture libere durante una scrittura.
+    """
+
+    def __init__(self, radice=DATA_DIR):
+        self.percorso = Path(radice) / "valutazioni.sqlite"
+        self._pronto = False
+        self._lock = threading.Lock()
+
+    def _connetti(self):
+        if not self._pronto:
+            with self._lock:
+                self.percorso.parent.mkdir(parents=True, exist_ok=True)
+                with closing(sqlite3.connect(self.percorso)) as con:
+                    con.execute("PRAGMA journal_mode=WAL")
+                    con.executescript(_SCHEMA)
+                self._pronto = True
+        return closing(sqlite3.connect(self.percorso, timeout=10))
+
+    def registra(self, esito, app):
+        """Aggiunge un ``EsitoValutazione`` in un'unica transazione; ritorna l'id."""
+        r, rec = esito.richiesta, esito.record()
+        valori = {c: rec[h] for c, h in COLONNE_REGISTRO.items()}
+        valori.update(check_in=r.check_in.isoformat(), check_out=r.check_out.isoformat(),
+                      salvata=datetime.now().isoformat(timespec="seconds"), app=app)
+        with self._connetti() as con, con:
+            cur = con.execute(f"INSERT INTO valutazioni ({', '.join(valori)}) "
+                              f"VALUES ({', '.join('?' * len(valori))})", list(valori.values()))
+            return cur.lastrowid
+
+    @staticmethod
+    def _where(app, dal=None, al=None, gruppo="", verdetti=None):
+        cond, par = ["app = ?"], [app]
+        if dal is not None:
+            cond.append("check_in >= ?")
+            par.append(dal.isoformat())
+        if al is not None:
+            cond.append("check_in <= ?")
+            par.append(al.isoformat())
+        if gruppo:
+            cond.append("gruppo LIKE ? ESCAPE '\\'")
+            par.append(_like(gruppo))
+        if verdetti:
+            cond.append(f"verdetto IN ({', '.join('?' * len(verdetti))})")
+            par.extend(verdetti)
+        return " AND ".join(cond), par
+
+    def conta(self, app, **filtri):
+        where, par = self._where(app, **filtri)
+        with self._connetti() as con:
+            return con.execute(f"SELECT COUNT(*) FROM valutazioni WHERE {where}", par).fetchone()[0]
+
+    def verdetti(self, app):
+        with self._connetti() as con:
+            return [v for (v,) in con.execute(
+                "SELECT DISTINCT verdetto FROM valutazioni WHERE app = ? ORDER BY verdetto", [app])]
+
+    def pagina(self, app, pagina=0, righe=50, **filtri):
+        """Una pagina del riepilogo (più recenti prima), con le intestazioni di ``record``."""
+        where, par = self._where(app, **filtri)
+        sql = (f"SELECT salvata, {', '.join(COLONNE_REGISTRO)} FROM valutazioni WHERE {where} "
+               "ORDER BY id DESC")
+        if righe is not None:
+            sql += " LIMIT ? OFFSET ?"
+            par = par + [righe, pagina * righe]
+        with self._connetti() as con:
+            df = pd.read_sql_query(sql, con, params=par)
+        for c in ("check_in", "check_out"):
+            df[c] = pd.to_datetime(df[c]).dt.strftime("%d/%m/%Y")
+        df["salvata"] = pd.to_datetime(df["salvata"]).dt.strftime("%d/%m/%Y %H:%M")
+        return df.rename(columns={"salvata": "Salvata il", **COLONNE_REGISTRO})
+
+    def esporta(self, app, **filtri):
+        """Tutte le righe che rispettano i filtri (per l'export Excel)."""
+        return self.pagina(app, righe=None, **filtri)
+
+    def svuota(self, app):
+        with self._connetti() as con, con:
+            return con.execute("DELETE FROM valutazioni WHERE app = ?", [app]).rowcount
+
+
+REGISTRO = RegistroValutazioni()
@@ -0,0 +1,182 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  rischio displacement (Monte Carlo)
+Distribuzione del displacement a due livelli campionando domanda
+WEB e utilizzo allotment notte per notte dai consuntivi storici.
+==================================================================
+"""
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from voi_engine import valuta_displacement
+from voi_storico import allotment_giorni, giorno_stagione
+
+CONC_MIN, CONC_MAX = 4.0, 400.0
+CONC_DEFAULT = 30.0        # concentrazione Beta senza storico (dev. std ≈ 8 pt a 50%)
+CELLE_BLOCCO = 2_000_000   # scenari × notti elaborati per blocco
+
+
+# ------------------------------------------------------------------
+# MODELLO DOMANDA
+# ------------------------------------------------------------------
+@dataclass(slots=True)
+class ModelloDomanda:
+    """Domanda storica per anno e giorno-stagione, frazioni 0–1 (NaN = nessun dato).
+
+    ``occ`` e ``util`` sono Y×367 (profilo ±raggio giorni di ciascun anno);
+    ``conc_*`` è la concentrazione della Beta per giorno-stagione, stimata
+    dalla variabilità giornaliera attorno al profilo.
+    """
+    anni: np.ndarray
+    occ: np.ndarray
+    util: np.ndarray
+    conc_occ: np.ndarray
+    conc_util: np.ndarray
+
+
+def _per_anno(df, valori, raggio):
+    """Media e varianza per (anno, giorno-stagione) su una finestra di ±raggio giorni."""
+    gs = df["gs"].to_numpy() if "gs" in df.columns else giorno_stagione(df["dt"])
+    scarti = np.arange(-raggio, raggio + 1)
+    g = (gs[:, None] + scarti).ravel()
+    a = np.repeat(df["dt"].dt.year.to_numpy(), len(scarti))
+    v = np.repeat(np.asarray(valori, dtype=float), len(scarti))
+    ok = (g >= 1) & (g <= 366) & ~np.isnan(v)
+    return (pd.DataFrame({"anno": a[ok], "gs": g[ok], "v": v[ok]})
+            .groupby(["anno", "gs"])["v"].agg(["mean", "var"]))
+
+
+def _concentrazione(media, varianza):
+    """Concentrazione Beta col metodo dei momenti: m(1−m)/var − 1, limitata."""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        k = media * (1 - media) / varianza - 1
+    return np.where(np.isfinite(k), np.clip(k, CONC_MIN, CONC_MAX), CONC_DEFAULT)
+
+
+def modello_domanda(storico, periodi, raggio=3):
+    """Stima il modello dai giornalieri: occupancy del set Totale, utilizzo
+    allotment = room nights Alpitour / allotment del periodo del giorno."""
+    parti = {}
+    tot = storico.get("Totale")
+    if tot is not None and not tot.empty:
+        parti["occ"] = _per_anno(tot, tot["% Occ."], raggio)
+    alp = storico.get("Alpitour individuali")
+    if alp is not None and not alp.empty:
+        gs = alp["gs"].to_numpy() if "gs" in alp.columns else giorno_stagione(alp["dt"])
+        util = alp["Room nights"].to_numpy(float) / allotment_giorni(periodi)[gs]
+        parti["util"] = _per_anno(alp, np.clip(util, 0, 1), raggio)
+
+    anni = np.unique(np.concatenate([a.index.get_level_values(0) for a in parti.values()]
+                                    or [np.empty(0, dtype=int)]))
+    out = {}
+    for k in ("occ", "util"):
+        medie, varianze = np.full((len(anni), 367), np.nan), np.full((len(anni), 367), np.nan)
+        if k in parti:
+            agg = parti[k]
+            ia = np.searchsorted(anni, agg.index.get_level_values(0))
+            ig = agg.index.get_level_values(1).to_numpy()
+            medie[ia, ig], varianze[ia, ig] = agg["mean"].to_numpy(), agg["var"].to_numpy()
+        out[k] = medie
+        with np.errstate(invalid="ignore"):
+            media = np.nanmean(medie, axis=0) if len(anni) else np.full(367, np.nan)
+            varianza = np.nanmean(varianze, axis=0) if len(anni) else np.full(367, np.nan)
+        out["conc_" + k] = _concentrazione(media, varianza)
+    return ModelloDomanda(anni=anni, **out)
+
+
+# ------------------------------------------------------------------
+# SIMULAZIONE
+# ------------------------------------------------------------------
+@dataclass(slots=True)
+class DistribuzioneDisplacement:
+    campioni: np.ndarray
+    media: float
+    p5: float
+    p50: float
+    p95: float
+    prob_distruzione: float     # P(displacement < 0)
+    scenari: int
+    anni: int                   # anni storici campionati (0 = solo valori di periodo)
+    seme: int
+    secondi: float
+
+
+def _medie_scenario(base, storico_anni, anno):
+    """Probabilità medie notte per notte di ogni scenario (S×N)."""
+    if storico_anni is None:
+        return np.broadcast_to(base, (len(anno), len(base)))
+    m = storico_anni[anno]
+    return np.where(np.isnan(m), base, m)
+
+
+def _beta(rng, media, conc):
+    m = np.clip(media, 1e-3, 1 - 1e-3)
+    return rng.beta(m * conc, (1 - m) * conc)
+
+
+def simula_displacement(richiesta, soggiorno, soglie, modello=None, scenari=100_000, seme=0):
+    """Distribuzione del displacement su ``scenari`` scenari di domanda.
+
+    Ogni scenario estrae un anno storico (la correlazione fra notti vicine e fra
+    WEB e allotment resta quella osservata), poi per ogni notte una Beta attorno
+    al profilo di quell'anno. Dove lo storico manca, o senza ``modello``, la
+    media è il valore di periodo del soggiorno. Se l'analista ha modificato
+    pick-up o utilizzo, le probabilità sono riscalate sul valore inserito come
+    in ``valore_atteso`` (in proporzione, senza tagliarle a 1), così la media
+    degli scenari resta quella della valutazione deterministica. Con l'allotment residuo per notte ogni notte conta per
+    le camere che mette su ciascun livello. Le tariffe restano quelle dei periodi;
+    generatore seminato, quindi stesso ``seme`` → stessi risultati.
+    """
+    t0 = time.perf_counter()
+    r, sog, v = richiesta, soggiorno, soggiorno.valori
+    if not len(sog.giorni):
+        raise ValueError("Nessuna notte del soggiorno ricade nei periodi configurati.")
+    rng = np.random.default_rng(seme)
+    n = len(sog.giorni)
+    occ_base, util_base = v["occ"] / 100, v["util"] / 100
+    pickup = r.pickup_web if r.pickup_web is not None else r.occupancy
+    scala_web = pickup / 100 / occ_base.mean() if pickup is not None and occ_base.mean() else 1.0
+    scala_allot = (r.util_allot / 100 / util_base.mean()
+                   if r.util_allot is not None and util_base.mean() else 1.0)
+
+    y = len(modello.anni) if modello is not None else 0
+    if y:
+        gs = giorno_stagione(sog.giorni.astype("datetime64[D]"))
+        occ_anni, util_anni = modello.occ[:, gs], modello.util[:, gs]
+        conc_occ, conc_util = modello.conc_occ[gs], modello.conc_util[gs]
+    else:
+        occ_anni = util_anni = None
+        conc_occ = conc_util = np.full(n, CONC_DEFAULT)
+
+    # allotment residuo per notte: ogni notte pesa per le camere che mette su ciascun
+    # livello, così il valore atteso medio per camera resta esatto (pesi 1 se scalare)
+    entro = np.minimum(r.camere, np.broadcast_to(r.allot_residuo, n)).astype(float)
+    oltre = r.camere - entro
+    peso_allot = entro / entro.mean() if entro.mean() else np.ones(n)
+    peso_web = oltre / oltre.mean() if oltre.mean() else np.ones(n)
+    tariffa_web, tariffa_allot = v["web"] * peso_web, v["alpi"] * peso_allot
+
+    atteso_web, atteso_allot = np.empty(scenari), np.empty(scenari)
+    blocco = max(1, CELLE_BLOCCO // n)
+    for i in range(0, scenari, blocco):
+        k = min(blocco, scenari - i)
+        anno = rng.integers(y, size=k) if y else np.zeros(k, dtype=np.int64)
+        p_web = _beta(rng, _medie_scenario(occ_base, occ_anni, anno), conc_occ)
+        p_allot = _beta(rng, _medie_scenario(util_base, util_anni, anno), conc_util)
+        atteso_web[i:i + k] = (p_web * scala_web) @ tariffa_web / n
+        atteso_allot[i:i + k] = (p_allot * scala_allot) @ tariffa_allot / n
+
+    occ = r.occupancy if r.occupancy is not None else sog.medie["occ"]
+    x = valuta_displacement(r.camere, r.pax_cam, sog.notti, sog.notti_valide, sog.min_stay,
+                            r.tariffa, r.ancillare, entro.mean(), sog.medie["web"],
+                            atteso_allot, atteso_web, occ, soglie)
+    d = x["displacement"]
+    p5, p50, p95 = np.percentile(d, [5, 50, 95])
+    return DistribuzioneDisplacement(campioni=d, media=float(d.mean()), p5=float(p5),
+                                     p50=float(p50), p95=float(p95),
+                                     prob_distruzione=float((d < 0).mean()), scenari=scenari,
+                                     anni=y, seme=seme, secondi=time.perf_counter() - t0)
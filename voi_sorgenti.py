@@ -0,0 +1,313 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  sorgenti dati
+Adattatori verso PMS / channel manager per capacità, allotment e
+venduto notte per notte: file locale o servizio HTTP, letture a
+intervalli di date, cache con scadenza e ultimo snapshot di riserva.
+==================================================================
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from voi_engine import normalizza_date
+from voi_inventario import COLONNE_NOTTI
+from voi_storico import DATA_DIR
+
+TTL = float(os.environ.get("VOI_SORGENTE_TTL", 300))   # secondi di validità di una lettura
+RIPROVA = 30.0           # dopo un errore, secondi prima di ritentare la sorgente
+GIORNI_PER_CHIAMATA = 92
+MAX_CHIAVI = 64          # intervalli tenuti in cache
+
+# intestazione canonica -> alias accettati dai file e dai servizi
+ALIAS_NOTTI = {
+    "Notte": ("notte", "data", "date", "night", "giorno"),
+    "Capacità": ("capacita", "capacità", "capacity", "camere casa", "rooms"),
+    "Allotment ALPI": ("allotment", "allotment alpi", "allotment_alpi"),
+    "Venduto ALPI": ("venduto alpi", "venduto_alpi", "sold_allotment", "pickup alpi"),
+    "Venduto casa": ("venduto", "venduto casa", "venduto_casa", "sold", "otb"),
+}
+
+
+def normalizza_notti(df):
+    """Intestazioni sui nomi del libro notti, date normalizzate, una riga per notte
+    (vale l'ultima); le colonne sconosciute sono scartate."""
+    alias = {a: k for k, v in ALIAS_NOTTI.items() for a in (k.lower(),) + v}
+    df = df.rename(columns=lambda c: alias.get(str(c).strip().lower(), c))
+    if "Notte" not in df.columns or "Capacità" not in df.columns:
+        raise ValueError("La sorgente deve indicare almeno «Notte» e «Capacità».")
+    df = df[[c for c in ("Notte", *COLONNE_NOTTI.values()) if c in df.columns]].copy()
+    # date ISO dai servizi, italiane (gg/mm/aaaa) dagli export
+    df["Notte"] = normalizza_date(df["Notte"])
+    for c in df.columns[1:]:
+        df[c] = pd.to_numeric(df[c], errors="coerce")
+    return (df.dropna(subset=["Notte", "Capacità"]).drop_duplicates("Notte", keep="last")
+            .sort_values("Notte").reset_index(drop=True))
+
+
+def _mesi(dal, al):
+    """Intervallo allargato ai mesi interi: soggiorni vicini condividono la lettura."""
+    dal, al = pd.Timestamp(dal), pd.Timestamp(al)
+    return dal.replace(day=1).date(), (al + pd.offsets.MonthEnd(0)).date()
+
+
+# ------------------------------------------------------------------
+# ADATTATORI
+# ------------------------------------------------------------------
+class Sorgente(ABC):
+    """Interfaccia: ``leggi(dal, al)`` ritorna le notti fra due date incluse, con
+    le intestazioni di ``ALIAS_NOTTI``, in una sola lettura per intervallo."""
+
+    nome = "sorgente"
+
+    @abstractmethod
+    def leggi(self, dal: date, al: date) -> pd.DataFrame:
+        ...
+
+
+class SorgenteFile(Sorgente):
+    """Export locale (CSV, Excel o JSON) di PMS/Scrigno; riletto solo se cambia."""
+
+    def __init__(self, percorso):
+        self.percorso = Path(percorso)
+        self.nome = f"file {self.percorso.name}"
+        self._letto = (None, None)
+
+    def _tutto(self):
+        mt = self.percorso.stat().st_mtime
+        if self._letto[0] != mt:
+            est = self.percorso.suffix.lower()
+            if est == ".json":
+                dati = json.loads(self.percorso.read_text(encoding="utf-8"))
+                df = pd.DataFrame(dati.get("notti", dati) if isinstance(dati, dict) else dati)
+            elif est in (".xlsx", ".xls"):
+                df = pd.read_excel(self.percorso)
+            else:
+                df = pd.read_csv(self.percorso, sep=None, engine="python")
+            self._letto = (mt, normalizza_notti(df))
+        return self._letto[1]
+
+    def leggi(self, dal, al):
+        df = self._tutto()
+        return df[df["Notte"].between(pd.Timestamp(dal), pd.Timestamp(al))]
+
+
+class SorgenteHTTP(Sorgente):
+    """Servizio HTTP: ``GET <url>?dal=AAAA-MM-GG&al=AAAA-MM-GG`` → JSON (lista di notti
+    o ``{"notti": [...]}``). Una ``requests.Session`` con pool di connessioni e
+    retry sugli errori transitori; intervalli lunghi spezzati in blocchi."""
+
+    def __init__(self, url, token=None, timeout=10.0, giorni=GIORNI_PER_CHIAMATA):
+        self.url, self.token, self.timeout, self.giorni = url, token, timeout, giorni
+        self.nome = f"HTTP {urlparse(url).netloc}"
+        self._sessione = None
+        self._lock = threading.Lock()
+
+    def _session(self):
+        """Sessione creata alla prima lettura; il lock serve solo alla creazione, le
+        chiamate delle varie sessioni Streamlit girano in parallelo sul pool."""
+        with self._lock:
+            if self._sessione is None:
+                self._sessione = self._nuova_sessione()
+        return self._sessione
+
+    def _nuova_sessione(self):
+        import requests     # caricato alla prima lettura, non all'avvio
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        s = requests.Session()
+        adattatore = HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=Retry(
+            total=2, backoff_factor=0.3, status_forcelist=(502, 503, 504),
+            allowed_methods=("GET",)))
+        s.mount("http://", adattatore)
+        s.mount("https://", adattatore)
+        if self.token:
+            s.headers["Authorization"] = f"Bearer {self.token}"
+        return s
+
+    def leggi(self, dal, al):
+        inizi = pd.date_range(dal, al, freq=f"{self.giorni}D")
+        parti = []
+        s = self._session()
+        for inizio in inizi:
+            fine = min(inizio + pd.Timedelta(days=self.giorni - 1), pd.Timestamp(al))
+            r = s.get(self.url, timeout=self.timeout,
+                      params={"dal": inizio.date().isoformat(), "al": fine.date().isoformat()})
+            r.raise_for_status()
+            dati = r.json()
+            parti.append(pd.DataFrame(dati.get("notti", []) if isinstance(dati, dict) else dati))
+        if not parti:
+            return pd.DataFrame(columns=["Notte", *COLONNE_NOTTI.values()])
+        return normalizza_notti(pd.concat(parti, ignore_index=True))
+
+
+# ------------------------------------------------------------------
+# CACHE E SNAPSHOT
+# ------------------------------------------------------------------
+@dataclass(slots=True)
+class Lettura:
+    notti: pd.DataFrame
+    aggiornato: datetime | None     # quando la sorgente ha risposto l'ultima volta
+    nuova: bool                     # dati appena letti dalla sorgente
+    errore: str = ""                # sorgente non raggiungibile → dati dallo snapshot
+
+
+class CacheSorgente:
+    """Cache con scadenza davanti a una ``Sorgente``, per intervallo di mesi interi.
+
+    Condivisa da tutte le sessioni del processo, quindi i rerun non interrogano la
+    sorgente. Ogni lettura riuscita aggiorna lo snapshot su disco
+    (``<radice>/sorgente_snapshot.parquet``); se la sorgente non risponde si usano
+    le notti dello snapshot e si ritenta dopo ``RIPROVA`` secondi.
+    """
+
+    def __init__(self, sorgente, ttl=TTL, radice=DATA_DIR):
+        self.sorgente, self.ttl = sorgente, ttl
+        self.snapshot = Path(radice) / "sorgente_snapshot.parquet"
+        self._cache = {}        # (dal, al) -> (scadenza monotonic, Lettura)
+        self._lock = threading.Lock()
+
+    @property
+    def nome(self):
+        return self.sorgente.nome
+
+    def invalida(self):
+        with self._lock:
+            self._cache.clear()
+
+    def leggi(self, dal, al):
+        """Notti fra due date (incluse) dalla cache, dalla sorgente o dallo snapshot."""
+        chiave = _mesi(dal, al)
+        with self._lock:
+            hit = self._cache.get(chiave)
+        if hit is not None and hit[0] > time.monotonic():
+            lettura = hit[1]
+            return Lettura(lettura.notti, lettura.aggiornato, False, lettura.errore)
+        try:
+            notti = normalizza_notti(self.sorgente.leggi(*chiave))
+            lettura = Lettura(notti, datetime.now(), True)
+            self._salva_snapshot(notti, chiave)
+            scadenza = time.monotonic() + self.ttl
+        except Exception as e:      # rete, HTTP, file o formato: si ripiega sullo snapshot
+            notti, aggiornato = self._leggi_snapshot(chiave)
+            lettura = Lettura(notti, aggiornato, False, f"{type(e).__name__}: {e}")
+            scadenza = time.monotonic() + RIPROVA
+        with self._lock:
+            if len(self._cache) >= MAX_CHIAVI:
+                self._cache.pop(min(self._cache, key=lambda k: self._cache[k][0]))
+            self._cache[chiave] = (scadenza, lettura)
+        return lettura
+
+    def _salva_snapshot(self, notti, chiave):
+        with self._lock:    # due letture concluse insieme non si sovrascrivono lo snapshot
+            self._scrivi_snapshot(notti, chiave)
+
+    def _scrivi_snapshot(self, notti, chiave):
+        vecchie = self._leggi_snapshot()[0]
+        dentro = vecchie["Notte"].between(pd.Timestamp(chiave[0]), pd.Timestamp(chiave[1]))
+        tutte = notti.assign(Letto=pd.Timestamp.now())
+        if (~dentro).any():
+            tutte = pd.concat([vecchie[~dentro], tutte], ignore_index=True).sort_values("Notte")
+        try:
+            self.snapshot.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.snapshot.with_suffix(f".{os.getpid()}.tmp")
+            tutte.to_parquet(tmp, index=False)
+            os.replace(tmp, self.snapshot)
+        except OSError:
+            pass        # senza snapshot si perde solo la riserva
+
+    def _leggi_snapshot(self, chiave=None):
+        vuoto = pd.DataFrame(columns=["Notte", *COLONNE_NOTTI.values(), "Letto"])
+        try:
+            df = pd.read_parquet(self.snapshot) if self.snapshot.exists() else vuoto
+        except (OSError, ValueError):
+            df = vuoto
+        df["Notte"] = pd.to_datetime(df["Notte"])
+        if chiave is None:
+            return df, None
+        df = df[df["Notte"].between(pd.Timestamp(chiave[0]), pd.Timestamp(chiave[1]))]
+        letto = pd.to_datetime(df["Letto"]).min() if len(df) else None
+        return (df.drop(columns="Letto").reset_index(drop=True),
+                letto.to_pydatetime() if letto is not None else None)
+
+
+def sincronizza(inventario, dal, al, sorgente):
+    """Porta nel libro notti le notti lette dalla sorgente (solo se appena lette:
+    i rerun serviti dalla cache non scrivono). Ritorna la ``Lettura`` o None."""
+    if sorgente is None:
+        return None
+    lettura = sorgente.leggi(dal, al)
+    if lettura.nuova and len(lettura.notti):
+        inventario.imposta_notti(lettura.notti)
+    return lettura
+
+
+def sorgente_configurata(valore=None):
+    """Sorgente da ``VOI_SORGENTE`` (URL http/https o percorso di un file), con il
+    token opzionale in ``VOI_SORGENTE_TOKEN``; None se non configurata."""
+    valore = os.environ.get("VOI_SORGENTE", "") if valore is None else valore
+    if not valore:
+        return None
+    if valore.startswith(("http://", "https://")):
+        s = SorgenteHTTP(valore, os.environ.get("VOI_SORGENTE_TOKEN") or None)
+    else:
+        s = SorgenteFile(valore)
+    return CacheSorgente(s)
+
+
+SORGENTE = sorgente_configurata()
+
+
+# ------------------------------------------------------------------
+# SERVIZIO DI PROVA
+# ------------------------------------------------------------------
+def servizio_prova(percorso, porta=8765):
+    """Espone un export locale con il contratto di ``SorgenteHTTP`` (per le prove)."""
+    fonte = SorgenteFile(percorso)
+
+    class Gestore(BaseHTTPRequestHandler):
+        def do_GET(self):
+            q = parse_qs(urlparse(self.path).query)
+            try:
+                df = fonte.leggi(q["dal"][0], q["al"][0])
+            except (KeyError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+            corpo = df.assign(Notte=df["Notte"].dt.strftime("%Y-%m-%d")).to_json(
+                orient="records", force_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+    return ThreadingHTTPServer(("127.0.0.1", porta), Gestore)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Servizio HTTP di prova per le sorgenti dati.")
+    ap.add_argument("file", help="Export notte per notte (CSV, Excel o JSON).")
+    ap.add_argument("--porta", type=int, default=8765)
+    a = ap.parse_args(argv)
+    server = servizio_prova(a.file, a.porta)
+    print(f"VOI_SORGENTE=http://127.0.0.1:{a.porta}/notti  (Ctrl+C per fermare)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
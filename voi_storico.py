@@ -0,0 +1,873 @@
+"""
+==================================================================
+VOI GROUP TOOLKIT  ·  dati storici
+Lettura degli export Scrigno, classificazione per set, pulizia e
+selezione delle righe per periodo. Nessuna dipendenza da Streamlit.
+==================================================================
+"""
+
+import hashlib
+import importlib.util
+import io
+import os
+import pickle
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SETS = ["Totale", "Individuali (no Alpitour)", "Alpitour individuali"]
+DATA_DIR = Path(os.environ.get("VOI_DATA_DIR", Path(__file__).resolve().with_name(".voi_data")))
+
+
+COLONNE_SCRIGNO = ["Giorno", "Segmento", "ADR Bed", "% Occ.", "Room nights"]
+MESI_STAGIONE = (4, 10)
+
+
+def _filtra_righe(righe):
+    """Righe del primo foglio (testata compresa) → frame delle sole colonne di
+    ``COLONNE_SCRIGNO``. Con la colonna Segmento tiene solo le righe «Total»
+    mentre legge; i segmenti visti sono raccolti per ``indovina_set``."""
+    testata = [str(c).strip() if c is not None else "" for c in next(righe, ())]
+    pos = {c: testata.index(c) for c in COLONNE_SCRIGNO if c in testata}
+    if "Giorno" not in pos:
+        raise KeyError("Giorno")
+    cols = list(pos)
+    idx = [pos[c] for c in cols]
+    iseg = pos.get("Segmento")
+    dati, segmenti = [], set()
+    for r in righe:
+        if iseg is not None:
+            seg = r[iseg] if iseg < len(r) else None
+            if seg is None or seg == "":
+                continue
+            segmenti.add(seg)
+            if seg != "Total":
+                continue
+        dati.append(tuple(r[i] if i < len(r) else None for i in idx))
+    return pd.DataFrame.from_records(dati, columns=cols), segmenti
+
+
+def _righe_scrigno(file):
+    """python-calamine se installato (parser Rust, molto più rapido), altrimenti
+    openpyxl read-only; in entrambi i casi il foglio è letto in streaming."""
+    if importlib.util.find_spec("python_calamine") is not None:
+        from python_calamine import CalamineWorkbook
+
+        wb = CalamineWorkbook.from_filelike(file)
+        return _filtra_righe(iter(wb.get_sheet_by_index(0).iter_rows()))
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        return _filtra_righe(wb.worksheets[0].iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def _date_giorno(giorno):
+    """«Lun 01/04/2024» → data, con un solo parsing a formato fisso; celle già data
+    (export salvati da Excel) passano così come sono."""
+    g = pd.Series(giorno, dtype=object)
+    date = pd.to_datetime(g.astype(str).str.rsplit(" ", n=1).str[-1], format="%d/%m/%Y",
+                          errors="coerce")
+    gia_date = g.map(lambda x: hasattr(x, "year")).to_numpy(bool)
+    if gia_date.any():
+        date[gia_date] = pd.to_datetime(g[gia_date])
+    return date
+
+
+def leggi_file_storico(file):
+    """Export giornaliero Scrigno → righe «Total» aprile–ottobre, anno prevalente, segmenti.
+
+    Legge solo le colonne usate dal toolkit, filtra «Total» durante la lettura e
+    applica la finestra di stagione sulle date prima di costruire il frame. Le righe
+    con un «Giorno» compilato ma illeggibile restano, con data ``NaT``: le scarta
+    ``valida_storico`` con la regola ``DATA_NON_VALIDA``.
+    """
+    df, seg_block = _righe_scrigno(file)
+    giorno = pd.Series(df["Giorno"].to_numpy(object), dtype=object)
+    dt = _date_giorno(giorno.to_numpy(object))
+    mese = dt.dt.month.to_numpy()
+    illeggibili = (dt.isna() & giorno.notna() & (giorno.astype(str).str.strip() != "")).to_numpy()
+    tieni = ((mese >= MESI_STAGIONE[0]) & (mese <= MESI_STAGIONE[1])) | illeggibili
+    daily = pd.DataFrame({"dt": dt[tieni].reset_index(drop=True)})
+    for c in ("ADR Bed", "% Occ.", "Room nights"):
+        if c in df.columns:
+            daily[c] = pd.to_numeric(df[c].to_numpy()[tieni], errors="coerce")
+    prevalente = daily["dt"].dt.year.mode()
+    anno = int(prevalente.iloc[0]) if len(prevalente) else None
+    return daily, anno, seg_block
+
+
+# ------------------------------------------------------------------
+# CLASSIFICAZIONE E QUALITÀ DATI
+# ------------------------------------------------------------------
+# (set, almeno uno di, nessuno di): la prima regola soddisfatta decide,
+# sottostringhe sui nomi segmento in maiuscolo; nessuna regola → "Totale"
+REGOLE_SET = [
+    ("Totale", ("GRUPPI",), ()),
+    ("Alpitour individuali", ("ALPITOUR INDIVIDUALI",), ("DIRETTI",)),
+    ("Individuali (no Alpitour)", ("DIRETTI", "WEB PORTALI"), ()),
+]
+
+
+def _contiene(segmenti, parole):
+    if not parole or not len(segmenti):
+        return False
+    return bool(segmenti.str.contains("|".join(map(re.escape, parole)), regex=True).any())
+
+
+def indovina_set(seg_block, regole=REGOLE_SET):
+    s = pd.Series(sorted(str(x) for x in seg_block), dtype=object).str.upper()
+    for set_name, almeno, nessuno in regole:
+        if _contiene(s, almeno) and not _contiene(s, nessuno):
+            return set_name
+    return "Totale"
+
+
+@dataclass(slots=True)
+class RegoleQualita:
+    adr_min: float = 25.0
+    adr_max: float = 260.0
+    occ_min: float = 0.0
+    occ_max: float = 1.05       # tolleranza sopra il 100% per overbooking/arrotondamenti
+
+
+# codice → descrizione; l'ordine è quello dei bit nella maschera delle anomalie
+CODICI_QUALITA = {
+    "DATA_NON_VALIDA": "Giorno senza data leggibile",
+    "ADR_FUORI": "ADR bed mancante o fuori intervallo",
+    "OCC_FUORI": "Occupancy mancante o fuori intervallo (es. oltre il 100%)",
+    "DUPLICATO": "Giorno ripetuto più avanti, nello stesso file o in uno successivo "
+                 "(vale l'ultimo)",
+}
+
+
+@dataclass(slots=True)
+class EsitoQualita:
+    pulito: pd.DataFrame        # righe valide, indicizzate per giorno-stagione
+    scartate: pd.DataFrame      # righe escluse, con file e codici regola
+    report: pd.DataFrame        # regola × file: righe scartate (più colonna Totale)
+    mancanti: pd.DataFrame      # giorni aprile–ottobre assenti, per anno
+
+
+def _giorni_mancanti(dt):
+    """Giorni della finestra di stagione senza una riga valida, per anno coperto."""
+    dt = dt.dropna()
+    if dt.empty:
+        return pd.DataFrame(columns=["Anno", "Giorni mancanti", "Primo mancante"])
+    anni = np.unique(dt.dt.year.to_numpy())
+    attesi = np.concatenate([pd.date_range(f"{a}-{MESI_STAGIONE[0]:02d}-01",
+                                           pd.Timestamp(f"{a}-{MESI_STAGIONE[1]:02d}-01")
+                                           + pd.offsets.MonthEnd(0)).to_numpy()
+                             for a in anni])
+    assenti = pd.DatetimeIndex(np.setdiff1d(attesi, dt.dt.normalize().to_numpy()))
+    out = (pd.Series(assenti, dtype="datetime64[ns]").groupby(assenti.year)
+           .agg(["size", "min"]).reindex(anni, fill_value=0))
+    out = out.reset_index()
+    out.columns = ["Anno", "Giorni mancanti", "Primo mancante"]
+    return out[out["Giorni mancanti"] > 0].reset_index(drop=True)
+
+
+def valida_storico(frames, regole=None):
+    """Validazione in un solo passaggio sul frame unito di più file.
+
+    ``frames``: nome file → giornalieri (in ordine di caricamento). Ogni regola è
+    una maschera vettoriale; una riga può violarne più d'una e il report le conta
+    tutte. I duplicati sono cercati solo fra le righe altrimenti valide, così un
+    giorno corretto non è scartato a favore di uno anomalo.
+    """
+    regole = regole or RegoleQualita()
+    nomi = list(frames)
+    df = pd.concat([frames[n] for n in nomi], ignore_index=True) if nomi else pd.DataFrame(
+        columns=["dt", "ADR Bed", "% Occ."])
+    file = np.repeat(np.arange(len(nomi)), [len(frames[n]) for n in nomi])
+    dt = pd.to_datetime(df["dt"])
+    adr = pd.to_numeric(df["ADR Bed"], errors="coerce").to_numpy(float)
+    occ = pd.to_numeric(df["% Occ."], errors="coerce").to_numpy(float)
+
+    maschere = {
+        "DATA_NON_VALIDA": dt.isna().to_numpy(),
+        "ADR_FUORI": ~((adr >= regole.adr_min) & (adr <= regole.adr_max)),
+        "OCC_FUORI": ~((occ >= regole.occ_min) & (occ <= regole.occ_max)),
+    }
+    valide = ~np.logical_or.reduce(list(maschere.values())) if len(df) else np.zeros(0, bool)
+    dup = np.zeros(len(df), dtype=bool)
+    dup[valide] = dt[valide].duplicated(keep="last").to_numpy()
+    maschere["DUPLICATO"] = dup
+    bit = np.zeros(len(df), dtype=np.uint8)
+    for i, m in enumerate(maschere.values()):
+        bit |= m.astype(np.uint8) << i
+    tieni = bit == 0
+
+    conta = np.stack([np.bincount(file[m], minlength=len(nomi)) for m in maschere.values()]) \
+        if len(nomi) else np.zeros((len(maschere), 0), dtype=int)
+    report = pd.DataFrame(conta, index=pd.Index(list(CODICI_QUALITA), name="Regola"),
+                          columns=nomi)
+    report.insert(0, "Descrizione", list(CODICI_QUALITA.values()))
+    report["Totale"] = conta.sum(axis=1)
+
+    scartate = df[~tieni].copy()
+    scartate.insert(0, "File", np.asarray(nomi, dtype=object)[file[~tieni]]
+                    if nomi else np.empty(0, dtype=object))
+    codici = np.array(list(CODICI_QUALITA))
+    scartate["Regole"] = [", ".join(codici[(b >> np.arange(len(codici))) & 1 == 1])
+                          for b in bit[~tieni]]
+    return EsitoQualita(pulito=indicizza_stagione(df[tieni]), scartate=scartate,
+                        report=report.reset_index(), mancanti=_giorni_mancanti(dt[tieni]))
+
+
+def pulisci_storico(df, regole=None):
+    """Righe valide di un frame già unito e numero di righe scartate."""
+    esito = valida_storico({"": df}, regole)
+    return esito.pulito, len(esito.scartate)
+
+
+# ------------------------------------------------------------------
+# GIORNO-STAGIONE
+# ------------------------------------------------------------------
+def giorno_stagione(date):
+    """Ordinale 1–366 del giorno sul calendario bisestile di riferimento.
+
+    Le stesse date cadono sullo stesso ordinale in ogni anno: il 1° marzo vale
+    sempre 61, il 29 febbraio 60 (che esiste solo negli anni bisestili).
+    """
+    d = pd.DatetimeIndex(pd.to_datetime(pd.Series(date), errors="coerce"))
+    doy = d.dayofyear.to_numpy()
+    return doy + ((~d.is_leap_year) & (d.month > 2)).astype(int)
+
+
+def indicizza_stagione(df):
+    """Ordina per data e aggiunge la colonna ``gs`` (giorno-stagione)."""
+    df = df.sort_values("dt", kind="stable", ignore_index=True)
+    df["gs"] = giorno_stagione(df["dt"]).astype(np.int16)
+    return df
+
+
+def finestre_stagione(di, dfine):
+    """Finestre [inizio, fine] di giorno-stagione per l'intervallo mese/giorno di un periodo.
+
+    - periodo che scavalca il 31/12 (es. 20/12/2026 → 06/01/2027): due finestre,
+      coda e inizio dell'anno, prese in ogni anno dello storico;
+    - periodo di un anno o più: l'intero anno;
+    - estremo al 29/02: negli anni non bisestili la finestra parte dal 1° marzo
+      (se è l'inizio) o si ferma al 28 febbraio (se è la fine);
+    - fine precedente all'inizio: nessuna finestra.
+    """
+    di, dfine = pd.Timestamp(di), pd.Timestamp(dfine)
+    if dfine < di:
+        return []
+    if (dfine - di).days >= 365:
+        return [(1, 366)]
+    s, e = giorno_stagione([di, dfine])
+    return [(s, e)] if e >= s else [(s, 366), (1, e)]
+
+
+def righe_periodo(df, di, dfine):
+    """Righe storiche che cadono nello stesso intervallo mese/giorno, per ogni anno.
+
+    Con il frame ordinato per data e indicizzato per giorno-stagione ogni anno è
+    un blocco contiguo con ``gs`` crescente: la finestra è una coppia di
+    ``searchsorted`` per anno.
+    """
+    if df is None or df.empty:
+        return df
+    if "gs" not in df.columns or not df["dt"].is_monotonic_increasing:
+        df = indicizza_stagione(df)
+    dt = df["dt"].to_numpy("datetime64[ns]")
+    a0, a1 = dt[0].astype("datetime64[Y]"), dt[-1].astype("datetime64[Y]")
+    capodanni = np.arange(a0, a1 + 2).astype("datetime64[ns]")
+    inizi = np.searchsorted(dt, capodanni)
+    gs = df["gs"].to_numpy()
+    pezzi = [np.empty(0, dtype=np.int64)]
+    for a, b in zip(inizi[:-1], inizi[1:]):
+        for s, e in finestre_stagione(di, dfine):
+            lo = a + np.searchsorted(gs[a:b], s, side="left")
+            hi = a + np.searchsorted(gs[a:b], e, side="right")
+            pezzi.append(np.arange(lo, hi))
+    return df.iloc[np.sort(np.concatenate(pezzi))]
+
+
+# ------------------------------------------------------------------
+# CACHE DI PARSING
+# ------------------------------------------------------------------
+class CacheLRU:
+    """Cache LRU limitata e thread-safe (una per processo, condivisa fra i rerun)."""
+
+    def __init__(self, max_voci=32):
+        self.max_voci = max_voci
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+        self.hit = self.miss = 0
+
+    def get(self, chiave):
+        with self._lock:
+            if chiave in self._voci:
+                self._voci.move_to_end(chiave)
+                self.hit += 1
+                return self._voci[chiave]
+            self.miss += 1
+            return None
+
+    def put(self, chiave, valore):
+        with self._lock:
+            self._voci[chiave] = valore
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+
+    def __len__(self):
+        return len(self._voci)
+
+
+CACHE_STORICO = CacheLRU(max_voci=48)
+
+
+def impronta_file(dati):
+    """Hash del contenuto del file: stessa chiave per lo stesso export, qualunque nome."""
+    return hashlib.blake2b(dati, digest_size=16).hexdigest()
+
+
+def leggi_storico(dati):
+    """``leggi_file_storico`` con cache per contenuto: ogni workbook è letto una volta sola.
+
+    Il frame restituito è condiviso fra i rerun e non va modificato sul posto.
+    """
+    chiave = impronta_file(dati)
+    esito = CACHE_STORICO.get(chiave)
+    if esito is None:
+        esito = leggi_file_storico(io.BytesIO(dati))
+        CACHE_STORICO.put(chiave, esito)
+    return esito
+
+
+def _leggi_bytes(dati):
+    return leggi_file_storico(io.BytesIO(dati))
+
+
+class _Lettore:
+    """Un worker: processo ``voi_lettore.py`` avviato una volta e riusato fra i rerun.
+
+    Interprete nuovo come con ``spawn`` (nessun thread del server Streamlit
+    ereditato), ma con un proprio entry point: lo script dell'app non viene
+    rieseguito nel figlio e ``__main__`` del server non va toccato.
+    """
+
+    def __init__(self):
+        script = Path(__file__).with_name("voi_lettore.py")
+        self.processo = subprocess.Popen([sys.executable, str(script)],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def leggi(self, dati):
+        try:
+            pickle.dump(dati, self.processo.stdin)
+            self.processo.stdin.flush()
+            ok, valore = pickle.load(self.processo.stdout)
+        except (EOFError, OSError, pickle.UnpicklingError) as e:
+            raise BrokenProcessPool(f"worker di lettura terminato: {e}") from e
+        if not ok:
+            raise valore
+        return valore
+
+    def chiudi(self):
+        for pipe in (self.processo.stdin, self.processo.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        self.processo.kill()
+        self.processo.wait()
+
+
+class _PoolLettori:
+    """``n`` processi lettori serviti da altrettanti thread: ``submit`` restituisce
+    future come ``ProcessPoolExecutor``, e ogni workbook va al primo lettore libero."""
+
+    def __init__(self, n):
+        self.lettori = []
+        try:
+            for _ in range(n):
+                self.lettori.append(_Lettore())
+        except BaseException:
+            self.shutdown()
+            raise
+        self.liberi = queue.SimpleQueue()
+        for lettore in self.lettori:
+            self.liberi.put(lettore)
+        self.thread = ThreadPoolExecutor(max_workers=n, thread_name_prefix="voi-lettore")
+
+    def _leggi(self, dati):
+        lettore = self.liberi.get()
+        try:
+            return lettore.leggi(dati)
+        finally:
+            self.liberi.put(lettore)
+
+    def submit(self, dati):
+        return self.thread.submit(self._leggi, dati)
+
+    def shutdown(self):
+        if hasattr(self, "thread"):
+            self.thread.shutdown(wait=False, cancel_futures=True)
+        for lettore in self.lettori:
+            lettore.chiudi()
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _pool():
+    """Pool di lettori condiviso fra i rerun (avviato alla prima lettura multipla).
+
+    Tutti i processi partono qui, una volta sola e sotto il lock.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = _PoolLettori(max(1, min(8, os.cpu_count() or 1)))
+        return _POOL
+
+
+def _chiudi_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown()
+        _POOL = None
+
+
+def leggi_storici(files, avanzamento=None):
+    """Legge più export in parallelo, un workbook per processo.
+
+    ``files``: nome → byte. Ritorna ``(esiti, errori)``: nome → (daily, anno, segmenti)
+    come ``leggi_storico``, e nome → messaggio per i file illeggibili (un file
+    corrotto non blocca gli altri). ``avanzamento(fatti, totale, nome)`` è chiamato
+    a ogni file completato. I file già in cache non passano dal pool.
+    """
+    esiti, errori, da_leggere = {}, {}, {}
+    totale = len(files)
+
+    def fatto(nome, chiave, esito=None, errore=None):
+        if errore is None:
+            esiti[nome] = esito
+            if chiave is not None:
+                CACHE_STORICO.put(chiave, esito)
+        else:
+            errori[nome] = errore
+        if avanzamento is not None:
+            avanzamento(len(esiti) + len(errori), totale, nome)
+
+    for nome, dati in files.items():
+        chiave = impronta_file(dati)
+        esito = CACHE_STORICO.get(chiave)
+        if esito is not None:
+            fatto(nome, None, esito)
+        else:
+            da_leggere[nome] = (chiave, dati)
+
+    def in_serie(voci):
+        for nome, (chiave, dati) in voci:
+            try:
+                fatto(nome, chiave, _leggi_bytes(dati))
+            except Exception as e:
+                fatto(nome, None, errore=f"{type(e).__name__}: {e}")
+
+    if len(da_leggere) < 2:
+        in_serie(da_leggere.items())
+        return esiti, errori
+    try:
+        pool = _pool()
+        futuri = {pool.submit(dati): nome for nome, (_, dati) in da_leggere.items()}
+        for f in as_completed(futuri):
+            nome = futuri[f]
+            try:
+                fatto(nome, da_leggere[nome][0], f.result())
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                fatto(nome, None, errore=f"{type(e).__name__}: {e}")
+    except (BrokenProcessPool, OSError):
+        # pool non disponibile o worker terminato male: si completa in serie
+        _chiudi_pool()
+        in_serie((n, v) for n, v in da_leggere.items() if n not in esiti and n not in errori)
+    return esiti, errori
+
+
+# ------------------------------------------------------------------
+# AGGREGAZIONE SUI PERIODI
+# ------------------------------------------------------------------
+def etichetta_periodi(chiavi, ini, fin):
+    """Coppie (riga, periodo) per ogni riga che cade in una finestra [ini, fin].
+
+    Le finestre sono ridotte a tratti elementari fra confini ordinati; ogni riga
+    trova il suo tratto con ``searchsorted`` e riceve tutti i periodi che lo
+    coprono (più d'uno se i periodi si sovrappongono). Costo lineare nelle righe.
+    """
+    chiavi = np.asarray(chiavi)
+    if not len(ini) or not len(chiavi):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    confini = np.unique(np.concatenate([ini, fin + 1]))
+    copre = (ini[:, None] <= confini[None, :]) & (fin[:, None] >= confini[None, :])
+    tratti, coperto_da = np.nonzero(copre.T)     # coppie ordinate per tratto
+    conta = np.bincount(tratti, minlength=len(confini))
+    primo = np.cumsum(conta) - conta
+
+    tratto = np.searchsorted(confini, chiavi, side="right") - 1
+    n = np.where(tratto >= 0, conta[np.clip(tratto, 0, None)], 0)
+    riga = np.repeat(np.arange(len(chiavi)), n)
+    offs = np.arange(len(riga)) - np.repeat(np.cumsum(n) - n, n)
+    periodo = coperto_da[primo[tratto[riga]] + offs]
+    return riga, periodo
+
+
+def finestre_periodi(periodi):
+    """Finestre di giorno-stagione di tutti i periodi: (posizione periodo, inizio, fine).
+
+    Stesse regole di ``finestre_stagione``; un periodo a cavallo del 31/12
+    compare due volte.
+    """
+    di = pd.to_datetime(periodi["Data inizio"], errors="coerce")
+    dfi = pd.to_datetime(periodi["Data fine"], errors="coerce")
+    ok = (di.notna() & dfi.notna()).to_numpy()
+    pos = np.flatnonzero(ok)
+    di, dfi = di[ok], dfi[ok]
+    s, e = giorno_stagione(di), giorno_stagione(dfi)
+    durata = (dfi - di).dt.days.to_numpy()
+    anno = durata >= 365
+    s, e = np.where(anno, 1, s), np.where(anno, 366, e)
+    salto = e < s
+    valide = durata >= 0
+    pos = np.concatenate([pos[valide], pos[salto & valide]])
+    ini = np.concatenate([s[valide], np.ones((salto & valide).sum(), dtype=s.dtype)])
+    fin = np.concatenate([np.where(salto, 366, e)[valide], e[salto & valide]])
+    return pos, ini, fin
+
+
+def aggrega_storico(periodi, storico):
+    """Aggregati storici di tutti i periodi in un solo ``groupby``.
+
+    Ogni riga di ogni set è etichettata con i periodi che ne contengono il
+    giorno-stagione (stesse date in tutti gli anni, come ``righe_periodo``); poi un
+    unico raggruppamento (set, periodo) dà occupancy media, ADR bed mediana e
+    room nights medie. Ritorna un DataFrame indicizzato per (set, posizione periodo).
+    """
+    pos, ini, fin = finestre_periodi(periodi)
+    parti = []
+    for set_name, df in storico.items():
+        if df is None or df.empty:
+            continue
+        gs = df["gs"].to_numpy() if "gs" in df.columns else giorno_stagione(df["dt"])
+        riga, p = etichetta_periodi(gs, ini, fin)
+        parti.append(pd.DataFrame({
+            "set": set_name, "periodo": pos[p],
+            "occ": df["% Occ."].to_numpy()[riga], "adr": df["ADR Bed"].to_numpy()[riga],
+            "rn": df["Room nights"].to_numpy()[riga] if "Room nights" in df.columns else np.nan}))
+    if not parti:
+        return pd.DataFrame(columns=["occ", "adr", "rn"])
+    return (pd.concat(parti, ignore_index=True)
+            .groupby(["set", "periodo"])
+            .agg(occ=("occ", "mean"), adr=("adr", "median"), rn=("rn", "mean")))
+
+
+# set → (colonna periodi, valore dagli aggregati, allotment del periodo)
+SCRITTURE_STORICO = [
+    ("Totale", "Occupancy attesa %", lambda a, allot: a["occ"] * 100),
+    ("Individuali (no Alpitour)", "ADR bed WEB", lambda a, allot: a["adr"]),
+    ("Alpitour individuali", "ADR bed Alpitour", lambda a, allot: a["adr"]),
+    ("Alpitour individuali", "Utilizzo allotment %", lambda a, allot: a["rn"] / allot * 100),
+]
+
+
+def impronta_set(df):
+    """Hash del contenuto di un set storico (giorno-stagione e misure aggregate)."""
+    cols = [c for c in ("gs", "% Occ.", "ADR Bed", "Room nights") if c in df.columns]
+    return int(pd.util.hash_pandas_object(df[cols], index=False).to_numpy(np.uint64).sum())
+
+
+def _chiavi_righe(periodi):
+    """Identità stabile delle righe: (stagione, periodo, n-esima occorrenza)."""
+    nome = periodi["Periodo"].astype(str).str.strip()
+    stag = (periodi["Stagione"].astype(str).str.strip() if "Stagione" in periodi.columns
+            else pd.Series("", index=periodi.index))
+    occ = pd.DataFrame({"s": stag, "p": nome}).groupby(["s", "p"]).cumcount()
+    return list(zip(stag, nome, occ))
+
+
+class AggregatoreStorico:
+    """Applicazione incrementale dello storico ai periodi.
+
+    Gli aggregati sono ricordati per (set, contenuto del set, finestre del
+    periodo): a ogni applicazione si ricalcolano solo le finestre nuove o quelle
+    dei set il cui contenuto è cambiato. Ricorda anche il valore scritto in ogni
+    cella: se l'analista l'ha poi modificato, la cella è un override manuale e
+    non viene più sovrascritta.
+    """
+
+    def __init__(self):
+        self._agg = {}           # set -> (impronta, {finestre: (occ, adr, rn)})
+        self.scritti = {}        # (chiave riga, colonna) -> ultimo valore scritto
+        self.finestre = {}       # chiave riga -> finestre all'ultima applicazione
+        self.ricalcolate = 0     # finestre aggregate all'ultima applicazione
+        self.modificate = 0      # celle cambiate dall'ultima applicazione
+
+    def _aggregati(self, set_name, df, finestre):
+        impronta = impronta_set(df)
+        voce = self._agg.get(set_name)
+        if voce is None or voce[0] != impronta:
+            voce = self._agg[set_name] = (impronta, {})
+        memo = voce[1]
+        nuove = [f for f in dict.fromkeys(finestre) if f not in memo]
+        if nuove:
+            fid = np.repeat(np.arange(len(nuove)), [len(f) for f in nuove])
+            ini = np.array([a for f in nuove for a, _ in f], dtype=np.int64)
+            fin = np.array([b for f in nuove for _, b in f], dtype=np.int64)
+            gs = df["gs"].to_numpy() if "gs" in df.columns else giorno_stagione(df["dt"])
+            riga, w = etichetta_periodi(gs, ini, fin)
+            rn = df["Room nights"].to_numpy()[riga] if "Room nights" in df.columns else np.nan
+            agg = (pd.DataFrame({"f": fid[w], "occ": df["% Occ."].to_numpy()[riga],
+                                 "adr": df["ADR Bed"].to_numpy()[riga], "rn": rn})
+                   .groupby("f").agg(occ=("occ", "mean"), adr=("adr", "median"),
+                                     rn=("rn", "mean")))
+            for i, f in enumerate(nuove):
+                memo[f] = (tuple(agg.loc[i]) if i in agg.index else None)
+            self.ricalcolate += len(nuove)
+        return [memo[f] for f in finestre]
+
+    def applica(self, periodi, storico, solo_cambiate=False):
+        """Come ``applica_storico``; ritorna (periodi, periodi applicati, celle mantenute).
+
+        Con ``solo_cambiate`` scrive solo le righe nuove o con le date cambiate
+        dall'ultima applicazione (modifica di una riga nel Setup).
+        """
+        per = periodi.copy()
+        pos, ini, fin = finestre_periodi(per)
+        per_pos = {}
+        for p, a, b in zip(pos, ini, fin):
+            per_pos.setdefault(int(p), []).append((int(a), int(b)))
+        righe = sorted(per_pos)
+        finestre = [tuple(sorted(per_pos[p])) for p in righe]
+        chiavi = _chiavi_righe(per)
+        allot = per["Allotment ALPI"].replace(0, 200).to_numpy(float)
+        if solo_cambiate:
+            cambiate = [i for i, p in enumerate(righe)
+                        if self.finestre.get(chiavi[p]) != finestre[i]]
+            righe, finestre = [righe[i] for i in cambiate], [finestre[i] for i in cambiate]
+        self.ricalcolate, self.modificate, mantenute = 0, 0, 0
+
+        valori = {}
+        for set_name in {w[0] for w in SCRITTURE_STORICO}:
+            df = storico.get(set_name)
+            if df is None or df.empty or not righe:
+                continue
+            agg = self._aggregati(set_name, df, finestre)
+            ok = [i for i, x in enumerate(agg) if x is not None]
+            valori[set_name] = pd.DataFrame([agg[i] for i in ok], columns=["occ", "adr", "rn"],
+                                            index=[righe[i] for i in ok])
+
+        for set_name, colonna, calcola in SCRITTURE_STORICO:
+            a = valori.get(set_name)
+            if a is None or a.empty:
+                continue
+            nuovi = np.round(calcola(a, allot[a.index]).to_numpy(float), 1)
+            per[colonna] = per[colonna].astype(float)
+            attuali = per[colonna].to_numpy()
+            scrivi = []
+            for r, v in zip(a.index, nuovi):
+                k = (chiavi[r], colonna)
+                prima = self.scritti.get(k)
+                if prima is not None and not np.isclose(attuali[r], prima, atol=0.05,
+                                                        equal_nan=True):
+                    mantenute += 1         # override manuale: resta com'è
+                    continue
+                self.scritti[k] = v
+                if not np.isclose(attuali[r], v, atol=1e-9, equal_nan=True):
+                    self.modificate += 1
+                scrivi.append((r, v))
+            if scrivi:
+                r, v = zip(*scrivi)
+                per.loc[per.index[list(r)], colonna] = v
+        self.finestre.update((chiavi[p], f) for p, f in zip(righe, finestre))
+        date_ok = (pd.to_datetime(per["Data inizio"], errors="coerce").notna() &
+                   pd.to_datetime(per["Data fine"], errors="coerce").notna())
+        return per, int(date_ok.sum()), mantenute
+
+
+def applica_storico(periodi, storico):
+    """Pre-compila occupancy, ADR WEB/Alpitour e utilizzo allotment di ogni periodo.
+
+    Ritorna la copia aggiornata dei periodi e il numero di periodi applicati.
+    """
+    per, applicati, _ = AggregatoreStorico().applica(periodi, storico)
+    return per, applicati
+
+
+# ------------------------------------------------------------------
+# CALENDARIO DOMANDA NOTTE PER NOTTE
+# ------------------------------------------------------------------
+@dataclass(slots=True)
+class CalendarioDomanda:
+    """Domanda attesa per ogni giorno-stagione (indice 1–366; NaN = nessun dato).
+
+    ``occ`` e ``util`` in 0–100, ``web`` e ``alpi`` ADR bed in €. Le chiavi sono
+    quelle di ``voi_engine.COLONNE_SOGGIORNO``; il motore sovrappone notte per notte
+    ai valori di periodo solo la domanda (``voi_engine.CHIAVI_DOMANDA``).
+    """
+    occ: np.ndarray
+    web: np.ndarray
+    alpi: np.ndarray
+    util: np.ndarray
+
+    def per_notte(self, giorni):
+        """Valori per un array di notti (ordinali giorno dal 1970-01-01)."""
+        gs = giorno_stagione(np.asarray(giorni, dtype="datetime64[D]"))
+        return {"occ": self.occ[gs], "web": self.web[gs],
+                "alpi": self.alpi[gs], "util": self.util[gs]}
+
+
+def _profilo(df, colonna, funzione, raggio):
+    """Statistica per giorno-stagione su una finestra mobile di ±raggio giorni, tutti gli anni."""
+    out = np.full(367, np.nan)
+    if df is None or df.empty or colonna not in df.columns:
+        return out
+    gs = df["gs"].to_numpy() if "gs" in df.columns else giorno_stagione(df["dt"])
+    scarti = np.arange(-raggio, raggio + 1)
+    g = (gs[:, None] + scarti).ravel()
+    v = np.repeat(df[colonna].to_numpy(float), len(scarti))
+    dentro = (g >= 1) & (g <= 366)
+    agg = pd.Series(v[dentro]).groupby(g[dentro]).agg(funzione)
+    out[agg.index.to_numpy()] = agg.to_numpy()
+    return out
+
+
+def calendario_domanda(storico, periodi, raggio=3):
+    """Calendario notte per notte dai giornalieri storici.
+
+    Occupancy media (set Totale), ADR bed mediana WEB e Alpitour, utilizzo
+    allotment = room nights Alpitour medie / allotment del periodo che contiene
+    il giorno (200 se nullo, come in ``applica_storico``). Ogni giorno usa una
+    finestra di ±``raggio`` giorni su tutti gli anni per smorzare il rumore.
+    """
+    occ = _profilo(storico.get("Totale"), "% Occ.", "mean", raggio) * 100
+    web = _profilo(storico.get("Individuali (no Alpitour)"), "ADR Bed", "median", raggio)
+    alp = storico.get("Alpitour individuali")
+    alpi = _profilo(alp, "ADR Bed", "median", raggio)
+    rn = _profilo(alp, "Room nights", "mean", raggio)
+    return CalendarioDomanda(occ=occ, web=web, alpi=alpi,
+                             util=rn / allotment_giorni(periodi) * 100)
+
+
+def allotment_giorni(periodi):
+    """Allotment ALPI per giorno-stagione (indice 1–366) dal primo periodo che lo
+    contiene; 0 vale 200 come in ``applica_storico``, NaN fuori dai periodi."""
+    pos, ini, fin = finestre_periodi(periodi)
+    giorno, p = etichetta_periodi(np.arange(1, 367), ini, fin)
+    primo = np.full(367, np.iinfo(np.int64).max)
+    np.minimum.at(primo, giorno + 1, pos[p])
+    allot = np.full(367, np.nan)
+    coperti = primo < np.iinfo(np.int64).max
+    allot[coperti] = (periodi["Allotment ALPI"].replace(0, 200)
+                      .to_numpy(float)[primo[coperti]])
+    return allot
+
+
+# ------------------------------------------------------------------
+# ARCHIVIO SU DISCO
+# ------------------------------------------------------------------
+COLONNE_ARCHIVIO = ["dt", "gs", "ADR Bed", "% Occ.", "Room nights"]
+
+
+def _slug(nome):
+    return re.sub(r"[^a-z0-9]+", "_", nome.lower()).strip("_")
+
+
+class ArchivioStorico:
+    """Archivio colonnare (Parquet) dei giornalieri puliti, partizionato per set e anno.
+
+    Layout: ``<radice>/storico/<set>/anno=YYYY.parquet``. Le partizioni lette
+    restano in memoria finché il file su disco non cambia.
+    """
+
+    def __init__(self, radice=DATA_DIR):
+        self.radice = Path(radice) / "storico"
+        self._parti = {}       # percorso -> (mtime_ns, DataFrame)
+        self._set = {}         # set -> (firma partizioni, DataFrame concatenato)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def disponibile():
+        return importlib.util.find_spec("pyarrow") is not None
+
+    def _dir(self, set_name):
+        return self.radice / _slug(set_name)
+
+    def _leggi(self, path):
+        mt = path.stat().st_mtime_ns
+        hit = self._parti.get(path)
+        if hit is None or hit[0] != mt:
+            hit = self._parti[path] = (mt, pd.read_parquet(path))
+        return hit[1]
+
+    def salva(self, set_name, df):
+        """Upsert per data: le righe nuove sostituiscono quelle dello stesso giorno.
+
+        Ritorna il numero di partizioni (anni) scritte.
+        """
+        df = df[[c for c in COLONNE_ARCHIVIO if c in df.columns]]
+        scritte = 0
+        with self._lock:
+            for anno, parte in df.groupby(df["dt"].dt.year):
+                path = self._dir(set_name) / f"anno={int(anno)}.parquet"
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if path.exists():
+                    parte = pd.concat([self._leggi(path), parte], ignore_index=True)
+                parte = indicizza_stagione(parte.drop_duplicates("dt", keep="last"))
+                tmp = path.with_suffix(".tmp")
+                parte.to_parquet(tmp, index=False)
+                tmp.replace(path)
+                scritte += 1
+        return scritte
+
+    def carica(self):
+        """Set → DataFrame di tutti gli anni archiviati (vuoto se l'archivio non c'è)."""
+        out = {}
+        with self._lock:
+            for set_name in SETS:
+                d = self._dir(set_name)
+                parti = sorted(d.glob("anno=*.parquet")) if d.exists() else []
+                if not parti:
+                    continue
+                firma = tuple((p.name, p.stat().st_mtime_ns) for p in parti)
+                hit = self._set.get(set_name)
+                if hit is None or hit[0] != firma:
+                    df = pd.concat([self._leggi(p) for p in parti], ignore_index=True)
+                    if "gs" not in df.columns:
+                        df = indicizza_stagione(df)
+                    hit = self._set[set_name] = (firma, df)
+                out[set_name] = hit[1]
+        return out
+
+    def anni(self):
+        """Set → anni presenti in archivio (dal solo elenco dei file)."""
+        return {k: sorted(int(p.stem.split("=")[1]) for p in self._dir(k).glob("anno=*.parquet"))
+                for k in SETS if self._dir(k).exists()}
+
+    def svuota(self):
+        with self._lock:
+            shutil.rmtree(self.radice, ignore_errors=True)
+            self._parti.clear()
+            self._set.clear()
+
+
+ARCHIVIO = ArchivioStorico()